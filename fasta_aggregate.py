@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_aggregate.py
+
+Vectorized aggregation over RecordView metadata columns for charts and
+reports. Counts are computed with np.bincount on integer period numbers and
+dictionary-encoded category codes, so no per-record Python work is done
+beyond building the (memoized) columns.
+"""
+
+import numpy as np
+import pandas as pd
+
+from fasta_engine import DEFAULT_UNKNOWN, RecordView
+
+# ==================== CONSTANTS ====================
+PERIOD_FREQ = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+COUNT_COLUMN = 'Count'
+DATE_FIELDS = {'year': 'Y', 'month': 'M'}  # Metadata fields derived from collection_date
+CROSSTAB_MAX_CELLS = 50_000_000  # Largest dense count matrix crosstab() will allocate
+
+
+def as_view(sequences):
+    """RecordView over `sequences` (returned unchanged if it already is one)."""
+    return sequences if isinstance(sequences, RecordView) else RecordView([sequences])
+
+
+def period_ordinals(dates, interval='month'):
+    """pandas Period ordinals (e.g. months since 1970-01) of datetime64 dates."""
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    if interval == 'year':
+        return months // 12
+    if interval == 'quarter':
+        return months // 3
+    return months
+
+
+def temporal_counts(sequences, interval='month', by=None):
+    """Record counts per period, indexed by a gap-free PeriodIndex.
+
+    Periods between the first and last dated record that have no records
+    are included with zero counts. With `by` (a metadata field such as
+    'clade' or 'host') there is one column per value of that field,
+    computed in the same pass; otherwise a single COUNT_COLUMN, read from
+    the month buckets of the view's DateIndex. Records without a collection
+    date are not counted.
+    """
+    view = as_view(sequences)
+    if by is None:
+        return _bucket_counts(view.date_index(), interval)
+    dates = view.collection_dates()
+    dated = ~np.isnat(dates)
+    freq = PERIOD_FREQ[interval]
+    codes, labels = view.metadata_codes(by)
+    codes = codes[dated]
+    if not dated.any():
+        return pd.DataFrame(columns=[], index=pd.PeriodIndex([], freq=freq), dtype=np.int64)
+
+    ordinals = period_ordinals(dates[dated], interval)
+    first = int(ordinals.min())
+    periods = int(ordinals.max()) - first + 1
+    counts = np.bincount((ordinals - first) * len(labels) + codes,
+                         minlength=periods * len(labels)).reshape(periods, len(labels))
+    index = pd.period_range(start=pd.Period(ordinal=first, freq=freq), periods=periods, freq=freq)
+    frame = pd.DataFrame(counts, index=index, columns=labels)
+    return frame.loc[:, counts.sum(axis=0) > 0]  # Values seen only on undated records
+
+
+def _bucket_counts(index, interval):
+    """temporal_counts() without `by`, summed from a DateIndex's month counts."""
+    freq = PERIOD_FREQ[interval]
+    if not index.dated:
+        return pd.DataFrame(columns=[COUNT_COLUMN], index=pd.PeriodIndex([], freq=freq), dtype=np.int64)
+    month_counts = index.month_counts()
+    months = np.arange(index.first_month, index.first_month + len(month_counts))
+    ordinals = period_ordinals(months.astype('datetime64[M]'), interval)
+    first = int(ordinals[0])
+    counts = np.bincount(ordinals - first, weights=month_counts).astype(np.int64)
+    index = pd.period_range(start=pd.Period(ordinal=first, freq=freq), periods=len(counts), freq=freq)
+    return pd.DataFrame({COUNT_COLUMN: counts}, index=index)
+
+
+def field_codes(sequences, field):
+    """Dictionary-encoded metadata field as (int64 codes, labels).
+
+    'year' and 'month' are derived from collection dates ('2023', '2023-04');
+    undated records get DEFAULT_UNKNOWN.
+    """
+    view = as_view(sequences)
+    if field not in DATE_FIELDS:
+        return view.metadata_codes(field)
+    dates = view.collection_dates()
+    periods = dates.astype(f'datetime64[{DATE_FIELDS[field]}]')
+    dated = ~np.isnat(periods)
+    unique, inverse = np.unique(periods[dated], return_inverse=True)
+    codes = np.full(len(periods), len(unique), dtype=np.int64)
+    codes[dated] = inverse
+    labels = np.array([str(period) for period in unique] + [DEFAULT_UNKNOWN], dtype=object)
+    return codes, labels
+
+
+def crosstab(sequences, fields, drop_unknown=True):
+    """Count matrix over two or more metadata fields in one vectorized pass.
+
+    Returns (counts, labels): an N-dimensional int64 array with one axis
+    per field, and the label array of each axis. Only values that occur
+    are kept; with `drop_unknown`, records where any field is
+    DEFAULT_UNKNOWN are skipped.
+    """
+    encoded = [field_codes(sequences, field) for field in fields]
+    keep = np.ones(len(encoded[0][0]), dtype=bool)
+    if drop_unknown:
+        for codes, labels in encoded:
+            unknown = np.flatnonzero(labels == DEFAULT_UNKNOWN)
+            if len(unknown):
+                keep &= codes != unknown[0]
+
+    axis_codes, axis_labels = [], []
+    for codes, labels in encoded:
+        used, compact = np.unique(codes[keep], return_inverse=True)
+        axis_codes.append(compact.astype(np.int64))
+        axis_labels.append(labels[used])
+    shape = tuple(len(labels) for labels in axis_labels)
+    cells = int(np.prod(shape, dtype=np.int64))
+    if cells > CROSSTAB_MAX_CELLS:
+        raise ValueError(f"Cross-tabulation of {', '.join(fields)} has too many combinations ({cells:,})")
+    if not cells:
+        return np.zeros(shape, dtype=np.int64), axis_labels
+    flat = np.ravel_multi_index(axis_codes, shape)
+    return np.bincount(flat, minlength=cells).reshape(shape), axis_labels
+
+
+def crosstab_frame(sequences, row_field, column_field, drop_unknown=True):
+    """crosstab() of two fields as a DataFrame (rows: row_field values, columns: column_field values)."""
+    counts, (rows, columns) = crosstab(sequences, [row_field, column_field], drop_unknown)
+    return pd.DataFrame(counts, index=pd.Index(rows, name=row_field), columns=pd.Index(columns, name=column_field))
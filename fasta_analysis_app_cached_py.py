@@ -10,10 +10,11 @@ No errors; tested for Streamlit compatibility.
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
-from collections import Counter, defaultdict
+from collections import Counter
 import re
 import os
 import gzip
@@ -24,6 +25,18 @@ import io
 import gc
 import urllib.parse
 import glob
+import uuid
+import tempfile
+
+from fasta_aggregate import COUNT_COLUMN, DATE_FIELDS, as_view, crosstab_frame, temporal_counts
+from fasta_browse import SORT_FIELDS, RecordBrowser
+from fasta_consensus import consensus_fasta, profile_groups, variability_summary
+from fasta_engine import ACCESSION_KINDS, DEFAULT_UNKNOWN, Query, QueryError, RecordView, SequenceAnalyzer, write_fasta
+from fasta_geo import country_codes, country_counts
+from fasta_jobs import JOB_DONE, JOB_FAILED, JobRunner
+from fasta_merge import merge_datasets, provenance_table
+from fasta_store import (DatasetLease, DatasetRegistry, DatasetRegistryFull, PartitionedWorkspace,
+                         is_partitioned_workspace, is_workspace)
 
 # --- Attempt Google Colab Import ---
 try:
@@ -34,8 +47,23 @@ except ImportError:
 
 # ==================== CONSTANTS ====================
 DEFAULT_TIMEOUT = 30  # For URL downloads
-DEFAULT_UNKNOWN = "Unknown"  # Consistent default value
-DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%Y/%m/%d", "%Y-%m", "%Y", "%d-%b-%Y", "%b-%d-%Y", "%Y%m%d"]
+JOB_WORKERS = 2  # Background job threads shared by all sessions
+JOB_POLL_INTERVAL = 1.0  # Seconds between job status refreshes
+DATASET_MEMORY_LIMIT = 2 * 1024 ** 3  # Ceiling for parsed datasets shared by all sessions
+WORKSPACE_DIR = os.path.join(tempfile.gettempdir(), "virseqsift_workspaces")  # On-disk datasets
+WORKSPACE_SPILL_BYTES = 256 * 1024 ** 2  # Files at least this large are kept on disk (mmap)
+WORKSPACE_DISK_LIMIT = 20 * 1024 ** 3  # Ceiling for on-disk datasets created by the app
+PACK_SEQUENCES = True  # Keep in-memory sequences 4-bit packed (about half the memory)
+CHART_CACHE_ENTRIES = 32  # Visualizer figures kept (least recently used are dropped)
+CHART_POINT_BUDGET = 2000  # Default cap on plotted values (points/bar segments) per chart
+CHART_MAX_CATEGORIES = 15  # Categories shown in distribution charts before "Other"
+CHART_MAX_SERIES = 12  # Stacked-bar series shown before "Other"
+CHART_AUTO_PERIODS = 60  # Target number of periods for the "Auto" time interval
+CHART_LABEL_POINTS = 60  # Above this many points, per-point text labels are dropped
+CHART_WEBGL_POINTS = 500  # Above this many points, line charts render with WebGL
+TIME_INTERVALS = ('month', 'quarter', 'year')
+INTERVAL_MONTHS = {'month': 1, 'quarter': 3, 'year': 12}
+LIST_FILTER_FIELDS = ('accession', 'isolate_name', 'isolate_id')  # Fields offered by the ID/name list filter
 
 # ==================== TRANSLATIONS ====================
 TRANSLATIONS = {
@@ -98,6 +126,8 @@ TRANSLATIONS = {
         "tip_multi_file": "Load multiple files and activate specific subsets for analysis!",
         "loaded_datasets_header": "📋 Loaded Datasets",
         "loaded_datasets_desc": "Select files below to include them in the 'Active Dataset' for analysis.",
+        "shared_cache_caption": "🗄️ Shared dataset cache: {datasets} datasets ({referenced} in use), {used:,.0f} of {limit:,.0f} MB in memory; {on_disk} on disk ({disk:,.0f} MB)",
+        "registry_full_error": "Cannot load {filename}: {error}",
         "actions_header": "⚡ Actions on Selected Files",
         "activate_btn": "✅ Activate Selected Files",
         "activate_help": "Load selected sequences into the active dataset for analysis",
@@ -109,6 +139,30 @@ TRANSLATIONS = {
         "confirm_yes": "Yes, Remove Files",
         "confirm_cancel": "Cancel",
         "no_files_selected_activate": "No files selected to activate.",
+        "append_btn": "➕ Append to Active",
+        "append_help": "Add the selected files to the active dataset, keeping the filters and steps already applied to it",
+        "append_dedup_label": "Skip sequences already in the active dataset",
+        "no_files_to_append": "Select files that are not active yet to append them.",
+        "files_appended": "Appended {added} sequences from {count} files ({skipped} duplicates skipped).",
+        "merge_dedup_btn": "🔗 Merge Selected (Remove Cross-File Duplicates)",
+        "merge_dedup_help": "Activate the selected files as one dataset, keeping only the first copy of sequences found in several files",
+        "files_merged": "Merged {count} files: kept {kept} of {total} sequences.",
+        "partitions_header": "🧩 Partitions of {name}",
+        "partitions_desc": "Partitioned by {fields}. Each partition is loaded as its own dataset, so filters, dedup and charts on it never read the others.",
+        "partition_col_partition": "Partition",
+        "partition_col_dated": "Dated",
+        "partition_col_first": "First Date",
+        "partition_col_last": "Last Date",
+        "partition_col_length": "Mean Length",
+        "partition_col_subtypes": "Subtypes",
+        "partitions_select_label": "Partitions to activate",
+        "partitions_activate_btn": "Activate Partitions",
+        "merge_report_header": "🔗 Merge Report",
+        "merge_overlap_title": "Unique Sequences Shared Between Files",
+        "merge_provenance_btn": "📥 Download Provenance (TSV)",
+        "merge_col_records": "Records",
+        "merge_col_kept": "Kept",
+        "merge_col_unique": "Unique Sequences",
         "no_files_selected_remove": "No files selected to remove.",
         "removed_files_msg": "Removed {count} file(s) from session.",
         "active_dataset": "Active Dataset",
@@ -125,6 +179,27 @@ TRANSLATIONS = {
         "deduplication": "Deduplication",
         "quality_filter": "Quality Filter",
         "subtype_operations": "Subtype Operations",
+        "browse_header": "🔎 Browse Records",
+        "browse_search_label": "Search",
+        "browse_search_placeholder": "e.g. chicken, EPI_ISL_402124 or host == duck and year >= 2023",
+        "browse_search_help": "Plain text matches isolate names, IDs, subtype, segment, clade, host and location; accessions and query expressions (as in the Refine tab) also work",
+        "browse_page_size": "Rows per page",
+        "browse_descending": "Descending",
+        "browse_page_label": "Page (of {pages})",
+        "browse_showing": "Showing records {start}-{end} of {total:,}",
+        "browse_sort_position": "Dataset order",
+        "browse_sort_collection_date": "Collection date",
+        "browse_sort_length": "Length",
+        "browse_sort_isolate_name": "Isolate name",
+        "browse_sort_type": "Subtype",
+        "browse_sort_segment": "Segment",
+        "browse_sort_clade": "Clade",
+        "browse_sort_host": "Host",
+        "browse_sort_location": "Location",
+        "browse_col_header": "Header",
+        "browse_col_date": "Date",
+        "browse_col_length": "Length",
+        "browse_col_sequence": "Sequence (start)",
         "distribution_viewer_title": "📈 Advanced Distribution Viewer",
         
         # Field Names
@@ -153,10 +228,18 @@ TRANSLATIONS = {
         "vis_type_line": "Line Chart (Temporal)",
         "vis_type_heatmap": "Heatmap (Geographic)",
         "vis_type_stacked": "Stacked Bar (Two Categories)",
+        "vis_type_matrix": "Heatmap (Two Categories)",
+        "vis_type_map": "Map (Countries)",
+        "map_unmatched": "{count:,} sequences with unknown or unrecognized locations are not shown",
         "time_interval_label": "Time Interval:",
         "vis_interval_month": "Monthly",
         "vis_interval_quarter": "Quarterly",
         "vis_interval_year": "Yearly",
+        "vis_interval_auto": "Auto (by date span)",
+        "vis_split_label": "Split by:",
+        "vis_split_none": "None (total)",
+        "vis_point_budget": "Max points per chart:",
+        "help_point_budget": "Large charts are reduced on the server to stay under this many plotted values: long tails become 'Other' and time periods are coarsened.",
         "top_n_label": "Show Top N:",
         "category1_label": "Primary Category (X-axis/Groups):",
         "category2_label": "Secondary Category (Stack/Color):",
@@ -221,10 +304,84 @@ TRANSLATIONS = {
         "custom_grouping_placeholder": "e.g., location,host",
         "apply_temporal_filter_button": "Apply Enhanced Temporal Filter",
         
-        "extract_accessions_btn": "Extract EPI_ISL Accessions",
+        "extract_accessions_btn": "Extract Accessions",
         "accession_preview": "Accession Preview (first 20)",
         "accessions_found": "Found {count} accessions. Download available in '{tab}'.",
-        "no_accessions_found": "No valid EPI_ISL accession numbers found in the current active dataset.",
+        "no_accessions_found": "No accession numbers of the selected types found in the current active dataset.",
+        "accession_kinds_label": "Accession types:",
+        "accession_kind_epi_isl": "GISAID isolate (EPI_ISL_…)",
+        "accession_kind_epi": "GISAID segment (EPI…)",
+        "accession_kind_genbank": "GenBank / RefSeq",
+        "list_filter_header": "Filter by ID / Name List",
+        "list_values_label": "Values (accessions separated by spaces, commas or new lines; names and IDs one per line):",
+        "list_upload_label": "...or upload a list (.txt/.csv/.tsv):",
+        "list_values_count": "{count} values in list",
+        "list_mode_keep": "Keep listed",
+        "list_mode_drop": "Remove listed",
+        "list_field_label": "Match against:",
+        "list_field_accession": "Accession IDs (anywhere in header)",
+        "list_field_isolate_name": "Isolate names",
+        "list_field_isolate_id": "Isolate IDs",
+        "list_filter_btn": "Apply List Filter",
+        "id_list_empty": "No values given for the list filter.",
+        "query_filter_header": "Query Filter",
+        "query_label": "Query:",
+        "query_placeholder": 'e.g., host == chicken and date >= 2023-01 and location in [Egypt, "Viet Nam"]',
+        "query_help": "Fields: any metadata field (host, location, clade, type, segment, isolate_name, isolate_id), date, year, month, length, gc (a percentage, 0–100). Operators: == != < <= > >= contains, in [..], not in [..]; combine with and / or / not and parentheses. Text is compared case-insensitively; 2023 or 2023-04 covers the whole year or month. Unknown field names are reported as errors.",
+        "query_filter_btn": "Apply Query",
+        "query_invalid": "Invalid query: {error}",
+        "diversity_header": "Diversity Sampling",
+        "diversity_desc": "Keep the most mutually different sequences of each group instead of the first or last by date. Equal-length groups are compared by Hamming distance, others by shared k-mers.",
+        "diversity_per_group_label": "Representatives per group",
+        "diversity_btn": "Apply Diversity Sampling",
+        "diversity_per_group_error": "Keep at least one record per group.",
+        "sample_header": "Random Subsampling",
+        "sample_desc": "Draw a statistically fair subset: a simple random sample, a fixed number per stratum (e.g. location x month), or a total split across strata in proportion to their sizes.",
+        "sample_mode_random": "Random (whole dataset)",
+        "sample_mode_per_stratum": "N per stratum",
+        "sample_mode_proportional": "Proportional to strata",
+        "sample_strata_label": "Strata",
+        "sample_size_per_stratum": "Records per stratum",
+        "sample_size_total": "Total records",
+        "sample_seed_label": "Seed",
+        "sample_seed_help": "The same seed draws the same records from the same data; change it for a different sample",
+        "sample_btn": "Apply Subsampling",
+        "sample_size_error": "Sample size must be at least 1.",
+        "consensus_header": "Consensus & Site Variability",
+        "consensus_desc": "Consensus sequence and per-site Shannon entropy of each group, computed from the aligned (or equal-length) sequences.",
+        "consensus_group_label": "Group by (none = whole dataset)",
+        "consensus_min_label": "Min. sequences per group",
+        "consensus_fraction_label": "Min. majority fraction",
+        "consensus_fraction_help": "Sites where the most common base makes up less than this fraction of the sequences are written as N",
+        "consensus_btn": "Compute Consensus",
+        "consensus_running": "Counting bases per site...",
+        "consensus_none": "No group has enough sequences.",
+        "consensus_col_group": "Group",
+        "consensus_col_columns": "Sites",
+        "consensus_col_equal": "Equal Length",
+        "consensus_col_entropy": "Mean Entropy",
+        "consensus_col_variable": "Variable Sites",
+        "consensus_plot_group": "Group to plot",
+        "consensus_entropy_title": "Per-site Entropy: {group}",
+        "consensus_position": "Position",
+        "consensus_entropy_axis": "Entropy (bits)",
+        "consensus_download_fasta": "Download Consensus FASTA",
+        "consensus_download_sites": "Download Site Table (TSV)",
+        "similar_header": "Similarity & Motif Search",
+        "similar_query_label": "Query sequence (plain or FASTA):",
+        "similar_query_placeholder": "Paste a nucleotide sequence to find the most similar active sequences",
+        "similar_top_label": "Number of matches:",
+        "similar_find_btn": "Find Similar",
+        "similar_keep_btn": "Keep Most Similar",
+        "similar_building": "Indexing k-mers of the active sequences (first search only)...",
+        "similar_none": "No active sequence shares k-mers with the query.",
+        "similar_query_empty": "No query sequence given.",
+        "similar_query_short": "The query is too short to search by similarity (a sketch keeps about one 21-mer in 32, so use a few hundred bases or more). For short sequences, use the motif filter.",
+        "motif_label": "Motif (exact subsequence):",
+        "motif_mode_keep": "Keep containing",
+        "motif_mode_drop": "Remove containing",
+        "motif_filter_btn": "Apply Motif Filter",
+        "motif_empty": "No motif given.",
         
         # Export Tab
         "last_report_header": "Last Analysis Report",
@@ -301,6 +458,20 @@ TRANSLATIONS = {
         "clade_filter_btn": "Apply Clade Monthly Filter",
         "export_fasta_btn": "Export FASTA",
         "lang_selector": "Language",
+
+        # Background Jobs
+        "jobs_header": "⏳ Background Jobs",
+        "job_queued": "Queued",
+        "job_running": "Running",
+        "job_done": "Done",
+        "job_failed": "Failed",
+        "job_cancelled": "Cancelled",
+        "cancel_job_btn": "Cancel",
+        "job_submitted": "Queued: {label}",
+        "job_finished": "Finished: {label}",
+        "job_stale": "Discarded result of '{label}': the active dataset changed while it was running.",
+        "job_failed_msg": "Job '{label}' failed: {error}",
+        "job_cancelled_msg": "Job '{label}' was cancelled.",
     },
     
     "ru": {
@@ -362,6 +533,8 @@ TRANSLATIONS = {
         "tip_multi_file": "Загружайте несколько файлов и активируйте нужные подмножества для анализа!",
         "loaded_datasets_header": "📋 Загруженные Наборы",
         "loaded_datasets_desc": "Выберите файлы ниже для включения в 'Активный Набор' для анализа.",
+        "shared_cache_caption": "🗄️ Общий кэш наборов: {datasets} наборов ({referenced} используются), {used:,.0f} из {limit:,.0f} МБ в памяти; {on_disk} на диске ({disk:,.0f} МБ)",
+        "registry_full_error": "Не удалось загрузить {filename}: {error}",
         "actions_header": "⚡ Действия над Выбранными Файлами",
         "activate_btn": "✅ Активировать Выбранные",
         "activate_help": "Загрузить выбранные последовательности в активный набор для анализа",
@@ -373,6 +546,30 @@ TRANSLATIONS = {
         "confirm_yes": "Да, Удалить Файлы",
         "confirm_cancel": "Отмена",
         "no_files_selected_activate": "Не выбраны файлы для активации.",
+        "append_btn": "➕ Добавить к Активным",
+        "append_help": "Добавить выбранные файлы к активному набору, сохранив уже применённые фильтры и шаги",
+        "append_dedup_label": "Пропускать последовательности, уже имеющиеся в активном наборе",
+        "no_files_to_append": "Выберите ещё не активные файлы, чтобы добавить их.",
+        "files_appended": "Добавлено {added} посл. из {count} файлов (пропущено дубликатов: {skipped}).",
+        "merge_dedup_btn": "🔗 Объединить Выбранные (Без Дубликатов Между Файлами)",
+        "merge_dedup_help": "Активировать выбранные файлы как один набор, оставив только первую копию последовательностей, встречающихся в нескольких файлах",
+        "files_merged": "Объединено {count} файлов: оставлено {kept} из {total} посл.",
+        "partitions_header": "🧩 Разделы {name}",
+        "partitions_desc": "Разделено по: {fields}. Каждый раздел загружается как отдельный набор, поэтому фильтры, удаление дубликатов и графики по нему не читают остальные.",
+        "partition_col_partition": "Раздел",
+        "partition_col_dated": "С датой",
+        "partition_col_first": "Первая дата",
+        "partition_col_last": "Последняя дата",
+        "partition_col_length": "Средняя длина",
+        "partition_col_subtypes": "Подтипы",
+        "partitions_select_label": "Разделы для активации",
+        "partitions_activate_btn": "Активировать разделы",
+        "merge_report_header": "🔗 Отчёт об Объединении",
+        "merge_overlap_title": "Общие Уникальные Последовательности Файлов",
+        "merge_provenance_btn": "📥 Скачать Происхождение (TSV)",
+        "merge_col_records": "Записей",
+        "merge_col_kept": "Оставлено",
+        "merge_col_unique": "Уникальных Последовательностей",
         "no_files_selected_remove": "Не выбраны файлы для удаления.",
         "removed_files_msg": "Удалено {count} файлов из сессии.",
         "active_dataset": "Активный Набор",
@@ -389,6 +586,27 @@ TRANSLATIONS = {
         "deduplication": "Дедупликация",
         "quality_filter": "Фильтр Качества",
         "subtype_operations": "Операции с Подтипами",
+        "browse_header": "🔎 Просмотр Записей",
+        "browse_search_label": "Поиск",
+        "browse_search_placeholder": "напр. chicken, EPI_ISL_402124 или host == duck and year >= 2023",
+        "browse_search_help": "Обычный текст ищется в названиях изолятов, ID, подтипе, сегменте, кладе, хозяине и местоположении; также работают номера доступа и выражения запросов (как во вкладке Уточнение)",
+        "browse_page_size": "Строк на странице",
+        "browse_descending": "По убыванию",
+        "browse_page_label": "Страница (из {pages})",
+        "browse_showing": "Записи {start}-{end} из {total:,}",
+        "browse_sort_position": "Порядок набора",
+        "browse_sort_collection_date": "Дата сбора",
+        "browse_sort_length": "Длина",
+        "browse_sort_isolate_name": "Название изолята",
+        "browse_sort_type": "Подтип",
+        "browse_sort_segment": "Сегмент",
+        "browse_sort_clade": "Клада",
+        "browse_sort_host": "Хозяин",
+        "browse_sort_location": "Местоположение",
+        "browse_col_header": "Заголовок",
+        "browse_col_date": "Дата",
+        "browse_col_length": "Длина",
+        "browse_col_sequence": "Последовательность (начало)",
         "distribution_viewer_title": "📈 Расширенный Просмотр Распределений",
         
         # Field Names
@@ -417,10 +635,18 @@ TRANSLATIONS = {
         "vis_type_line": "Линейная Диаграмма (Временная)",
         "vis_type_heatmap": "Тепловая Карта (Географическая)",
         "vis_type_stacked": "Составная Столбчатая (Две Категории)",
+        "vis_type_matrix": "Тепловая Карта (Две Категории)",
+        "vis_type_map": "Карта (Страны)",
+        "map_unmatched": "{count:,} последовательностей с неизвестным или нераспознанным местом не показаны",
         "time_interval_label": "Временной Интервал:",
         "vis_interval_month": "По Месяцам",
         "vis_interval_quarter": "По Кварталам",
         "vis_interval_year": "По Годам",
+        "vis_interval_auto": "Авто (по диапазону дат)",
+        "vis_split_label": "Разбить по:",
+        "vis_split_none": "Нет (всего)",
+        "vis_point_budget": "Макс. точек на диаграмме:",
+        "help_point_budget": "Большие диаграммы сокращаются на сервере до этого числа значений: редкие категории объединяются в 'Other', временные периоды укрупняются.",
         "top_n_label": "Показать Топ N:",
         "category1_label": "Основная Категория (Ось X/Группы):",
         "category2_label": "Вторичная Категория (Стек/Цвет):",
@@ -485,10 +711,84 @@ TRANSLATIONS = {
         "custom_grouping_placeholder": "например, location,host",
         "apply_temporal_filter_button": "Применить Улучшенный Временной Фильтр",
         
-        "extract_accessions_btn": "Извлечь EPI_ISL Номера",
+        "extract_accessions_btn": "Извлечь Номера Доступа",
         "accession_preview": "Предпросмотр Номеров (первые 20)",
         "accessions_found": "Найдено {count} номеров. Скачать можно на '{tab}'.",
-        "no_accessions_found": "Не найдено валидных EPI_ISL номеров в текущем активном наборе.",
+        "no_accessions_found": "В текущем активном наборе не найдено номеров выбранных типов.",
+        "accession_kinds_label": "Типы номеров:",
+        "accession_kind_epi_isl": "Изолят GISAID (EPI_ISL_…)",
+        "accession_kind_epi": "Сегмент GISAID (EPI…)",
+        "accession_kind_genbank": "GenBank / RefSeq",
+        "list_filter_header": "Фильтр по Списку ID / Названий",
+        "list_values_label": "Значения (номера через пробел, запятую или с новой строки; названия и ID по одному в строке):",
+        "list_upload_label": "...или загрузите список (.txt/.csv/.tsv):",
+        "list_values_count": "{count} значений в списке",
+        "list_mode_keep": "Оставить из списка",
+        "list_mode_drop": "Удалить из списка",
+        "list_field_label": "Сопоставлять с:",
+        "list_field_accession": "Номера доступа (в любом месте заголовка)",
+        "list_field_isolate_name": "Названия изолятов",
+        "list_field_isolate_id": "ID изолятов",
+        "list_filter_btn": "Применить Фильтр по Списку",
+        "id_list_empty": "Не задано ни одного значения для фильтра.",
+        "query_filter_header": "Фильтр по Запросу",
+        "query_label": "Запрос:",
+        "query_placeholder": 'например, host == chicken and date >= 2023-01 and location in [Egypt, "Viet Nam"]',
+        "query_help": "Поля: любое поле метаданных (host, location, clade, type, segment, isolate_name, isolate_id), date, year, month, length, gc (в процентах, 0–100). Операторы: == != < <= > >= contains, in [..], not in [..]; объединяйте через and / or / not и скобки. Текст сравнивается без учёта регистра; 2023 или 2023-04 охватывает весь год или месяц. Неизвестные имена полей выдаются как ошибка.",
+        "query_filter_btn": "Применить Запрос",
+        "query_invalid": "Некорректный запрос: {error}",
+        "diversity_header": "Выборка по Разнообразию",
+        "diversity_desc": "Оставить в каждой группе наиболее отличающиеся друг от друга последовательности вместо первых или последних по дате. Группы равной длины сравниваются по расстоянию Хэмминга, остальные — по общим k-мерам.",
+        "diversity_per_group_label": "Представителей на группу",
+        "diversity_btn": "Применить Выборку по Разнообразию",
+        "diversity_per_group_error": "Оставьте хотя бы одну запись на группу.",
+        "sample_header": "Случайная Подвыборка",
+        "sample_desc": "Статистически корректное подмножество: простая случайная выборка, фиксированное число на страту (например, местоположение x месяц) или общее число, распределённое по стратам пропорционально их размеру.",
+        "sample_mode_random": "Случайная (весь набор)",
+        "sample_mode_per_stratum": "N на страту",
+        "sample_mode_proportional": "Пропорционально стратам",
+        "sample_strata_label": "Страты",
+        "sample_size_per_stratum": "Записей на страту",
+        "sample_size_total": "Всего записей",
+        "sample_seed_label": "Зерно (seed)",
+        "sample_seed_help": "Одно и то же зерно выбирает одни и те же записи из одних и тех же данных; измените его для другой выборки",
+        "sample_btn": "Применить Подвыборку",
+        "sample_size_error": "Размер выборки должен быть не меньше 1.",
+        "consensus_header": "Консенсус и Вариабельность Позиций",
+        "consensus_desc": "Консенсусная последовательность и энтропия Шеннона по позициям для каждой группы, по выровненным (или равной длины) последовательностям.",
+        "consensus_group_label": "Группировать по (пусто = весь набор)",
+        "consensus_min_label": "Мин. последовательностей в группе",
+        "consensus_fraction_label": "Мин. доля большинства",
+        "consensus_fraction_help": "Позиции, где самый частый нуклеотид составляет меньшую долю последовательностей, записываются как N",
+        "consensus_btn": "Рассчитать Консенсус",
+        "consensus_running": "Подсчёт нуклеотидов по позициям...",
+        "consensus_none": "Ни в одной группе нет достаточного числа последовательностей.",
+        "consensus_col_group": "Группа",
+        "consensus_col_columns": "Позиций",
+        "consensus_col_equal": "Равная длина",
+        "consensus_col_entropy": "Средняя энтропия",
+        "consensus_col_variable": "Вариабельных позиций",
+        "consensus_plot_group": "Группа для графика",
+        "consensus_entropy_title": "Энтропия по позициям: {group}",
+        "consensus_position": "Позиция",
+        "consensus_entropy_axis": "Энтропия (бит)",
+        "consensus_download_fasta": "Скачать Консенсус FASTA",
+        "consensus_download_sites": "Скачать Таблицу Позиций (TSV)",
+        "similar_header": "Поиск Похожих Последовательностей и Мотивов",
+        "similar_query_label": "Последовательность-запрос (обычная или FASTA):",
+        "similar_query_placeholder": "Вставьте нуклеотидную последовательность, чтобы найти самые похожие активные последовательности",
+        "similar_top_label": "Число совпадений:",
+        "similar_find_btn": "Найти Похожие",
+        "similar_keep_btn": "Оставить Самые Похожие",
+        "similar_building": "Индексирование k-меров активных последовательностей (только при первом поиске)...",
+        "similar_none": "Ни одна активная последовательность не имеет общих k-меров с запросом.",
+        "similar_query_empty": "Не задана последовательность-запрос.",
+        "similar_query_short": "Запрос слишком короткий для поиска по сходству (скетч сохраняет примерно один 21-мер из 32, поэтому используйте от нескольких сотен оснований). Для коротких последовательностей используйте фильтр по мотиву.",
+        "motif_label": "Мотив (точная подпоследовательность):",
+        "motif_mode_keep": "Оставить содержащие",
+        "motif_mode_drop": "Удалить содержащие",
+        "motif_filter_btn": "Применить Фильтр по Мотиву",
+        "motif_empty": "Не задан мотив.",
         
         # Export Tab
         "last_report_header": "Последний Отчет Анализа",
@@ -565,6 +865,20 @@ TRANSLATIONS = {
         "clade_filter_btn": "Применить Фильтр Клады",
         "export_fasta_btn": "Экспорт FASTA",
         "lang_selector": "Язык",
+
+        # Background Jobs
+        "jobs_header": "⏳ Фоновые Задачи",
+        "job_queued": "В очереди",
+        "job_running": "Выполняется",
+        "job_done": "Готово",
+        "job_failed": "Ошибка",
+        "job_cancelled": "Отменено",
+        "cancel_job_btn": "Отменить",
+        "job_submitted": "В очереди: {label}",
+        "job_finished": "Завершено: {label}",
+        "job_stale": "Результат '{label}' отброшен: активный набор изменился во время выполнения.",
+        "job_failed_msg": "Задача '{label}' завершилась ошибкой: {error}",
+        "job_cancelled_msg": "Задача '{label}' отменена.",
     }
 }
 
@@ -575,24 +889,10 @@ def get_translation(key, lang=None):
         lang = st.session_state.get('lang', 'en')
     return TRANSLATIONS.get(lang, TRANSLATIONS["en"]).get(key, f"_{key}_")
 
-def parse_date(date_str):
-    """Parse various date formats"""
-    if isinstance(date_str, datetime):
-        return date_str
-    if not date_str or 'unknown' in str(date_str).lower() or date_str is None:
-        return None
-    date_str = str(date_str).strip()
-    for fmt in DATE_FORMATS:
-        try:
-            parsed_date = datetime.strptime(date_str, fmt)
-            if fmt == "%Y":
-                return datetime(parsed_date.year, 1, 1)
-            if fmt == "%Y-%m":
-                return datetime(parsed_date.year, parsed_date.month, 1)
-            return parsed_date
-        except ValueError:
-            continue
-    return None
+def parse_id_list(text, per_line=False):
+    """Values from pasted or uploaded text: one per line, or split on whitespace, commas and semicolons."""
+    tokens = (text or "").splitlines() if per_line else re.split(r"[\s,;]+", text or "")
+    return [token.strip() for token in tokens if token.strip()]
 
 def update_status(message_key, status_type="info", log=True):
     """Display status message and optionally log"""
@@ -654,528 +954,291 @@ class ProgressTracker:
             with st.session_state.status_placeholder.container():
                 st.error(msg, icon="❌")
 
-progress_tracker = ProgressTracker()
+    def log_event(self, event):
+        """Record an EngineEvent emitted by fasta_engine operations."""
+        if event.level == 'error':
+            self.log_error(get_translation(event.key) if event.key else event.message)
+        elif 'analysis_log' in st.session_state:
+            st.session_state.analysis_log.append(event.format())
 
-# --- Cached Parsing Function ---
-@st.cache_data
-def parse_fasta_content(content_string):
-    """Parses FASTA content string (cached). Returns (sequences, errors)."""
-    temp_parser = FastaParser()
-    sequences = []
-    errors = []
-    header = None
-    seq_parts = []
-    line_num = 0
+progress_tracker = ProgressTracker()
 
+# ==================== SHARED DATASETS ====================
+@st.cache_resource
+def get_dataset_registry():
+    """Process-wide registry: identical uploads are parsed and held once for all sessions."""
+    return DatasetRegistry(memory_limit=DATASET_MEMORY_LIMIT, workspace_dir=WORKSPACE_DIR,
+                           spill_bytes=WORKSPACE_SPILL_BYTES, disk_limit=WORKSPACE_DISK_LIMIT,
+                           pack_sequences=PACK_SEQUENCES)
+
+def get_dataset_lease():
+    """This session's lease on shared datasets (released when the session ends)."""
+    if st.session_state.get('dataset_lease') is None:
+        st.session_state.dataset_lease = DatasetLease(get_dataset_registry())
+    return st.session_state.dataset_lease
+
+def parse_fasta_file(filename, content_string=None, workspace_path=None):
+    """Load FASTA content (or an on-disk workspace) through the shared registry and log parser issues."""
     try:
-        for line_num, line in enumerate(content_string.splitlines(), start=1):
-            line = line.strip()
-            if not line:
-                continue
-
-            if line.startswith('>'):
-                if header is not None:
-                    sequence = "".join(seq_parts).upper().replace(" ", "").replace("-", "")
-                    if sequence:
-                        metadata = temp_parser._parse_header(header)
-                        sequences.append([header, sequence, metadata])
-                    else:
-                        errors.append(f"Line ~{line_num}: Empty sequence for header '{header}'")
-                header = line
-                seq_parts = []
-            elif header is not None:
-                seq_parts.append(line)
-            else:
-                errors.append(f"Line {line_num}: Sequence data before first header ('>'). Ignoring.")
-
-        if header is not None:
-            sequence = "".join(seq_parts).upper().replace(" ", "").replace("-", "")
-            if sequence:
-                metadata = temp_parser._parse_header(header)
-                sequences.append([header, sequence, metadata])
-            else:
-                errors.append(f"End of file: Empty sequence for header '{header}'")
-
-    except Exception as e:
-        errors.append(f"Fatal parsing error around line {line_num}: {str(e)}")
+        if workspace_path:
+            dataset = get_dataset_lease().open_workspace(filename, workspace_path)
+        else:
+            dataset = get_dataset_lease().load(filename, content_string)
+    except (DatasetRegistryFull, OSError, ValueError) as e:
+        progress_tracker.log_error(get_translation("registry_full_error").format(filename=filename, error=e))
+        return [], []
+    sequences, errors = dataset.records, dataset.errors
+
+    if errors:
+        st.warning(f"Parser encountered {len(errors)} issues (see details in log).")
+        for err in errors[:5]:
+            log_entry = f"[{datetime.now().strftime('%H:%M:%S')}] PARSER_WARN: {err}"
+            if log_entry not in st.session_state.analysis_log:
+                st.session_state.analysis_log.append(log_entry)
 
     return sequences, errors
 
-class FastaParser:
-    """Parse FASTA files and extract metadata"""
-    def __init__(self):
-        self.known_hosts = {'chicken', 'human', 'swine', 'duck', 'avian', 'environment', 'turkey', 'goose', 'wild bird'}
-
-    def _extract_host_and_location(self, isolate_name):
-        """Extract host and location from isolate name"""
+def activate_files(filenames):
+    """Make the given loaded files the active dataset as one shared view."""
+    st.session_state.active_filenames = list(filenames)
+    st.session_state.original_sequences = {fname: st.session_state.all_files[fname] for fname in filenames}
+    set_active_sequences(RecordView(st.session_state.original_sequences.values()))
+
+def append_files(filenames, skip_duplicates=True):
+    """Append loaded files to the active dataset without re-running the steps that produced it.
+
+    Only the incoming records are hashed: with `skip_duplicates`, those whose
+    sequence is already active (or earlier among the appended records) are
+    left out. Columns memoized on the active view carry over, so charts only
+    compute the new records. Returns (added, skipped).
+    """
+    active = as_view(st.session_state.active_sequences)
+    incoming = RecordView([st.session_state.all_files[fname] for fname in filenames])
+    skipped = 0
+    if skip_duplicates:
+        digests = incoming.sequence_digests()
+        keep = np.zeros(len(digests), dtype=bool)
+        keep[np.unique(digests, return_index=True)[1]] = True
+        keep &= ~np.isin(digests, active.sequence_digests())
+        skipped = len(digests) - int(keep.sum())
+        incoming = incoming.take(np.flatnonzero(keep))
+    for fname in filenames:
+        if fname not in st.session_state.active_filenames:
+            st.session_state.active_filenames.append(fname)
+        st.session_state.original_sequences[fname] = st.session_state.all_files[fname]
+    set_active_sequences(active.extend(incoming))
+    return len(incoming), skipped
+
+def merge_files(filenames):
+    """Activate files as one dataset with cross-file duplicate sequences removed.
+
+    Files are deduplicated one after another against a shared digest index;
+    the DatasetMerge is kept for the provenance and overlap report.
+    """
+    sources = {fname: st.session_state.all_files[fname] for fname in filenames}
+    view, merge = merge_datasets(sources)
+    st.session_state.active_filenames = list(filenames)
+    st.session_state.original_sequences = sources
+    set_active_sequences(view)
+    st.session_state.merge_report = {"version": st.session_state.active_version, "merge": merge, "view": view}
+    return view
+
+def render_merge_report():
+    """Per-file counts, overlap matrix and provenance download of the last merge, while it is active."""
+    report = st.session_state.get("merge_report")
+    if not report or report["version"] != st.session_state.active_version:
+        return
+    merge = report["merge"]
+    T = lambda key: get_translation(key, st.session_state.lang)
+    with st.expander(T("merge_report_header"), expanded=True):
+        summary = merge.summary().rename(columns={"Records": T("merge_col_records"), "Kept": T("merge_col_kept"),
+                                                  "Unique": T("merge_col_unique")})
+        st.dataframe(summary, use_container_width=True)
+        overlap = merge.overlap()
+        fig = px.imshow(overlap.values, x=list(overlap.columns), y=list(overlap.index), title=T("merge_overlap_title"),
+                        text_auto=overlap.size <= CHART_LABEL_POINTS * 4,
+                        color_continuous_scale=px.colors.sequential.Blues, aspect='auto')
+        fig.update_layout(margin=dict(t=50, b=20, l=20, r=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
+        st.plotly_chart(fig, use_container_width=True)
+        if "provenance" not in report:
+            report["provenance"] = provenance_table(report["view"], merge).to_csv(sep='\t', index=False)
+        st.download_button(T("merge_provenance_btn"), data=report["provenance"], file_name="merge_provenance.tsv",
+                           mime="text/tab-separated-values", key="manage_merge_provenance", use_container_width=True)
+
+def render_record_browser():
+    """Searchable, sortable record table of the active dataset; only the visible page is read."""
+    T = lambda key: get_translation(key, st.session_state.lang)
+    cached = st.session_state.get("record_browser")
+    if not cached or cached["version"] != st.session_state.active_version:
+        cached = st.session_state.record_browser = {"version": st.session_state.active_version,
+                                                    "browser": RecordBrowser(st.session_state.active_sequences)}
+    browser = cached["browser"]
+    with st.expander(T("browse_header"), expanded=False):
+        sort_options = {T(f"browse_sort_{field}"): field for field in SORT_FIELDS}
+        browse_cols = st.columns([3, 2, 1, 1])
+        with browse_cols[0]:
+            search = st.text_input(T("browse_search_label"), key="analyze_browse_search",
+                                   placeholder=T("browse_search_placeholder"), help=T("browse_search_help"))
+        with browse_cols[1]:
+            sort_by = sort_options[st.selectbox(T("sort_by_label"), list(sort_options.keys()), key="analyze_browse_sort")]
+        with browse_cols[2]:
+            page_size = st.selectbox(T("browse_page_size"), [25, 50, 100, 200], index=1, key="analyze_browse_size")
+        with browse_cols[3]:
+            descending = st.checkbox(T("browse_descending"), key="analyze_browse_desc")
+        positions = browser.select(search, sort_by, descending)
+        pages = max(1, -(-len(positions) // page_size))
+        selection = (cached["version"], search.strip(), sort_by, descending, page_size)
+        if st.session_state.get("analyze_browse_selection") != selection:  # New search or sort: back to page 1
+            st.session_state.analyze_browse_selection = selection
+            st.session_state.analyze_browse_page = 1
+        page = st.number_input(T("browse_page_label").format(pages=pages), min_value=1, max_value=pages,
+                               step=1, key="analyze_browse_page")
+        start = (page - 1) * page_size
+        st.caption(T("browse_showing").format(start=min(start + 1, len(positions)),
+                                              end=min(start + page_size, len(positions)), total=len(positions)))
+        if len(positions):
+            table = browser.page(positions, page - 1, page_size).rename(columns={
+                "Header": T("browse_col_header"), "Subtype": T("vis_field_subtype"), "Segment": T("vis_field_segment"),
+                "Clade": T("vis_field_clade"), "Host": T("vis_field_host"), "Location": T("vis_field_location"),
+                "Date": T("browse_col_date"), "Length": T("browse_col_length"), "Sequence": T("browse_col_sequence")})
+            st.dataframe(table, use_container_width=True, hide_index=True)
+
+def partition_file_name(name, key):
+    return f"{name} [{key}]"
+
+def load_partitioned_workspace(name, path):
+    """Load every partition of a partitioned workspace as its own dataset; returns (files, seqs) loaded."""
+    try:
+        workspace = PartitionedWorkspace(path)
+    except (OSError, ValueError) as e:
+        progress_tracker.log_error(get_translation("registry_full_error").format(filename=name, error=e))
+        return 0, 0
+    files = seqs = 0
+    for key in workspace.partitions:
+        filename = partition_file_name(name, key)
+        sequences, errors = parse_fasta_file(filename, workspace_path=os.path.join(path, key))
+        if sequences:
+            st.session_state.all_files[filename] = sequences
+            files += 1
+            seqs += len(sequences)
+    st.session_state.partitioned_workspaces[name] = path
+    return files, seqs
+
+def render_partition_stats():
+    """Per-partition statistics of the loaded partitioned workspaces, with activation of chosen partitions."""
+    T = lambda key: get_translation(key, st.session_state.lang)
+    for name, path in st.session_state.partitioned_workspaces.items():
         try:
-            parts = isolate_name.split('/')
-            if len(parts) >= 3:
-                potential_host = parts[1].lower().replace('_', ' ')
-                is_known = any(known in potential_host for known in self.known_hosts)
-                if is_known or potential_host == 'unknown':
-                    host = parts[1].capitalize()
-                    location = parts[2].capitalize()
-                    return host, location
-                else:
-                    location = parts[1].capitalize()
-                    return DEFAULT_UNKNOWN, location
-            elif len(parts) == 2:
-                return DEFAULT_UNKNOWN, parts[1].capitalize()
-        except Exception:
-            pass
-        return DEFAULT_UNKNOWN, DEFAULT_UNKNOWN
-
-    def _parse_header(self, header):
-        """Parse FASTA header and extract metadata"""
-        clean_header = header.lstrip('>').strip()
-        metadata = {
-            "original_header": header, "isolate_name": clean_header,
-            "type": DEFAULT_UNKNOWN, "segment": DEFAULT_UNKNOWN, "collection_date": None,
-            "isolate_id": DEFAULT_UNKNOWN, "clade": DEFAULT_UNKNOWN,
-            "host": DEFAULT_UNKNOWN, "location": DEFAULT_UNKNOWN
-        }
-
-        if '|' in clean_header:
-            parts = [p.strip() for p in clean_header.split('|')]
-            metadata['isolate_name'] = parts[0]
-            if len(parts) > 1: metadata['type'] = parts[1] if parts[1] else DEFAULT_UNKNOWN
-            if len(parts) > 2: metadata['segment'] = parts[2] if parts[2] else DEFAULT_UNKNOWN
-            if len(parts) > 3: metadata['collection_date'] = parse_date(parts[3])
-            if len(parts) > 4: metadata['isolate_id'] = parts[4] if parts[4] else DEFAULT_UNKNOWN
-            if len(parts) > 5: metadata['clade'] = parts[5] if parts[5] else DEFAULT_UNKNOWN
-            host_in_parts = parts[6] if len(parts) > 6 and parts[6] else None
-            loc_in_parts = parts[7] if len(parts) > 7 and parts[7] else None
-
-            host_from_name, loc_from_name = self._extract_host_and_location(metadata['isolate_name'])
-            metadata['host'] = host_in_parts if host_in_parts else host_from_name
-            metadata['location'] = loc_in_parts if loc_in_parts else loc_from_name
-        else:
-            gisaid_parts = clean_header.split('|')
-            name_part = gisaid_parts[0]
-            metadata['isolate_name'] = name_part
-            host, location = self._extract_host_and_location(name_part)
-            metadata['host'] = host
-            metadata['location'] = location
-
-            if len(gisaid_parts) > 1 and gisaid_parts[1].startswith('EPI'):
-                metadata['isolate_id'] = gisaid_parts[1]
-            if len(gisaid_parts) > 2:
-                metadata['collection_date'] = parse_date(gisaid_parts[2])
-
-            name_lower = name_part.lower()
-            if name_lower.startswith('a/'): metadata['type'] = 'A'
-            elif name_lower.startswith('b/'): metadata['type'] = 'B'
-
-            match_hxny = re.search(r'/(H\d+N\d+)', name_part, re.IGNORECASE)
-            if match_hxny:
-                metadata['type'] = match_hxny.group(1).upper()
-            elif '(h' in name_lower and 'n' in name_lower:
-                match_paren = re.search(r'\((H\d+N\d+)\)', name_part, re.IGNORECASE)
-                if match_paren:
-                    metadata['type'] = match_paren.group(1).upper()
-
-            if any(seg in name_lower for seg in ['/ha', '(ha)']): metadata['segment'] = 'HA'
-            elif any(seg in name_lower for seg in ['/na', '(na)']): metadata['segment'] = 'NA'
-
-        return metadata
-
-    def parse(self, file_content_string):
-        """Parse FASTA content string using the cached function."""
-        sequences, errors = parse_fasta_content(file_content_string)
-
-        if errors:
-            st.warning(f"Parser encountered {len(errors)} issues (see details in log).")
-            for err in errors[:5]:
-                log_entry = f"[{datetime.now().strftime('%H:%M:%S')}] PARSER_WARN: {err}"
-                if log_entry not in st.session_state.analysis_log:
-                    st.session_state.analysis_log.append(log_entry)
-
-        return sequences, errors
-
-class FastaConverter:
-    """Convert FASTA headers to standardized format"""
-    def __init__(self, sequences, progress_tracker):
-        self.sequences = sequences
-        self.tracker = progress_tracker
-
-    def run(self):
-        """Convert headers to pipe format"""
-        converted = []
-        errors = []
-        
-        for header, seq, metadata in self.sequences:
-            try:
-                date_obj = metadata.get("collection_date")
-                date_str = date_obj.strftime("%Y-%m-%d") if date_obj else "Unknown"
-                
-                parts = [
-                    metadata.get('isolate_name', 'Unknown'),
-                    metadata.get('type', 'Unknown'),
-                    metadata.get('segment', 'Unknown'),
-                    date_str,
-                    metadata.get('isolate_id', 'Unknown'),
-                    metadata.get('clade', 'Unknown'),
-                    metadata.get('host', 'Unknown'),
-                    metadata.get('location', 'Unknown')
-                ]
-                
-                header_parts = [str(p) for p in parts if p and p != "Unknown"]
-                new_header = ">" + "|".join(header_parts)
-                converted.append([new_header, seq, metadata])
-            except Exception as e:
-                errors.append(f"Error converting header '{header}': {str(e)}")
-                converted.append([header, seq, metadata])
-        
-        return converted, errors
-
-class SequenceAnalyzer:
-    """Analyze and filter FASTA sequences"""
-    def __init__(self, sequences):
-        self.sequences = [list(item) for item in sequences]
-        self.original_count_for_last_op = len(sequences)
-
-    def _update_state_and_log(self, result_sequences, operation_name, removed_headers=None):
-        """Helper to update session state and log results."""
-        final_count = len(result_sequences)
-        removed_count = self.original_count_for_last_op - final_count
-
-        st.session_state.active_sequences = result_sequences
-        log_message = f"{operation_name}: Kept {final_count}, Removed {removed_count}"
-        progress_tracker.complete_operation(log_message, "complete")
-
-        st.session_state.last_report = (
-            f"Operation: {operation_name}\n"
-            f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-            f"Initial Count: {self.original_count_for_last_op}\n"
-            f"Final Count: {final_count}\n"
-            f"Removed: {removed_count}"
-        )
-        if removed_headers:
-            st.session_state.last_report += f"\n\nRemoved Headers (sample):\n" + "\n".join(removed_headers[:5]) + ("\n..." if len(removed_headers) > 5 else "")
-
-        return result_sequences
-
-    def convert_headers(self):
-        """Convert headers to standardized pipe format"""
-        operation_name = "Convert Headers"
-        progress_tracker.start_operation(operation_name)
-        converter = FastaConverter(self.sequences, progress_tracker)
-        converted_seqs, errors = converter.run()
-        
-        st.session_state.active_sequences = converted_seqs
-        st.session_state.last_report = (
-            f"Operation: {operation_name}\n"
-            f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-            f"Headers Processed: {len(converted_seqs)}\n"
-            f"Errors: {len(errors)}"
-        )
-        progress_tracker.complete_operation(operation_name, "complete")
-        return converted_seqs
-
-    def quality_filter(self, min_length=200, max_n_run=100):
-        """Filter by sequence quality"""
-        operation_name = f"Quality Filter (MinLen={min_length}, MaxN={max_n_run})"
-        progress_tracker.start_operation(operation_name)
-        filtered = []
-        removed_headers = []
-
-        for header, seq, metadata in self.sequences:
-            if len(seq) < min_length:
-                removed_headers.append(header)
-                continue
-
-            n_runs = re.findall(r'N+', seq.upper())
-            longest_n_run = max(len(run) for run in n_runs) if n_runs else 0
-
-            if longest_n_run > max_n_run:
-                removed_headers.append(header)
-                continue
-
-            filtered.append([header, seq, metadata])
-
-        return self._update_state_and_log(filtered, operation_name, removed_headers)
-
-    def deduplicate_basic(self):
-        """Remove duplicate sequences based on sequence only."""
-        operation_name = "Basic Deduplication (Sequence Only)"
-        progress_tracker.start_operation(operation_name)
-        seen = set()
-        unique = []
-        removed_headers = []
-
-        for header, seq, metadata in self.sequences:
-            if seq not in seen:
-                seen.add(seq)
-                unique.append([header, seq, metadata])
-            else:
-                removed_headers.append(header)
-
-        return self._update_state_and_log(unique, operation_name, removed_headers)
-
-    def deduplicate_advanced(self):
-        """Remove duplicates preserving subtype diversity per sequence."""
-        operation_name = "Advanced Deduplication (Seq + Subtype)"
-        progress_tracker.start_operation(operation_name)
-        sequence_groups = defaultdict(list)
-        for item in self.sequences:
-            sequence_groups[item[1]].append(item)
-
-        unique = []
-        removed_headers = []
-
-        for seq, group in sequence_groups.items():
-            if len(group) == 1:
-                unique.append(group[0])
-            else:
-                kept_subtypes_for_seq = set()
-                for header, _, metadata in sorted(group, key=lambda x: x[0]):
-                    subtype = metadata.get('type', DEFAULT_UNKNOWN)
-                    if subtype not in kept_subtypes_for_seq:
-                        unique.append([header, seq, metadata])
-                        kept_subtypes_for_seq.add(subtype)
-                    else:
-                        removed_headers.append(header)
-
-        return self._update_state_and_log(unique, operation_name, removed_headers)
-
-    def filter_by_subtype(self, target_subtypes):
-        """Filter sequences by specific subtypes."""
-        if not target_subtypes or 'All' in target_subtypes:
-            st.info(get_translation("warning_select_subtype"))
-            return self.sequences
-
-        target_set = {s.strip().upper() for s in target_subtypes}
-        operation_name = f"Filter by Subtype ({', '.join(target_set)})"
-        progress_tracker.start_operation(operation_name)
-        filtered = []
-        removed_headers = []
-
-        for header, seq, metadata in self.sequences:
-            seq_type = str(metadata.get('type', '')).strip().upper()
-            if any(target in seq_type for target in target_set if target):
-                filtered.append([header, seq, metadata])
-            else:
-                removed_headers.append(header)
-
-        return self._update_state_and_log(filtered, operation_name, removed_headers)
-
-    def get_subtype_distribution(self):
-        """Get subtype distribution counts."""
-        progress_tracker.start_operation("Calculating Subtype Distribution")
-        counts = Counter(m.get('type', DEFAULT_UNKNOWN) for _, _, m in self.sequences)
-        progress_tracker.complete_operation("Subtype distribution calculated")
-        return counts
-
-    def get_metadata_distribution(self, field):
-        """Get distribution counts for any metadata field."""
-        progress_tracker.start_operation(f"Calculating {field} Distribution")
-        if field == 'year':
-            counts = Counter(str(m['collection_date'].year) for _, _, m in self.sequences if m.get('collection_date'))
-        elif field == 'month':
-            counts = Counter(m['collection_date'].strftime('%Y-%m') for _, _, m in self.sequences if m.get('collection_date'))
-        else:
-            counts = Counter(str(m.get(field, DEFAULT_UNKNOWN)) for _, _, m in self.sequences)
-        progress_tracker.complete_operation(f"{field} distribution calculated")
-        return counts
-
-    def enhanced_temporal_filter(self, group_by="location_host",
-                                  sort_by="date", keep_per_group="both", custom_grouping=None):
-        """Enhanced temporal diversity filter using Pandas."""
-        operation_name = f"Enhanced Temporal Filter (Group={group_by}, Sort={sort_by}, Keep={keep_per_group})"
-        progress_tracker.start_operation(operation_name)
-
-        if not self.sequences:
-            progress_tracker.log_error(get_translation("no_sequences_error"))
-            return []
-
-        df_data = []
-        for i, (header, seq, metadata) in enumerate(self.sequences):
-            date_val = metadata.get('collection_date')
-            row = {
-                'index': i, 'header': header, 'seq': seq, 'metadata': metadata,
-                'date': date_val,
-                'location': metadata.get('location', DEFAULT_UNKNOWN),
-                'host': metadata.get('host', DEFAULT_UNKNOWN),
-                'clade': metadata.get('clade', DEFAULT_UNKNOWN),
-                'isolate_id': metadata.get('isolate_id', DEFAULT_UNKNOWN),
-                'month': date_val.month if date_val else -1
-            }
-            if group_by == 'custom' and custom_grouping:
-                for field in custom_grouping:
-                    row[field] = metadata.get(field, DEFAULT_UNKNOWN)
-            df_data.append(row)
-
-        df = pd.DataFrame(df_data)
-
-        if sort_by == 'date':
-            df = df.dropna(subset=['date'])
-        if df.empty:
-            progress_tracker.log_error(get_translation("no_sequences_after_filter"))
-            return []
-
-        group_keys = []
-        if group_by == 'none':
-            df['group_key_col'] = 'all'
-            group_keys = ['group_key_col']
-        elif group_by == 'custom' and custom_grouping:
-            valid_custom_grouping = [k for k in custom_grouping if k in df.columns]
-            if not valid_custom_grouping:
-                progress_tracker.log_error("Custom grouping keys not found.")
-                return self.sequences
-            group_keys = valid_custom_grouping
-        else:
-            group_map = {
-                "location_host_month_clade": ['location', 'host', 'month', 'clade'],
-                "location": ['location'], "host": ['host'], "clade": ['clade'],
-                "location_host": ['location', 'host'], "host_clade": ['host', 'clade'],
-            }
-            group_keys = group_map.get(group_by, ['location', 'host', 'month', 'clade'])
-
-        for key in group_keys:
-            if key in df.columns:
-                df[key] = df[key].fillna(DEFAULT_UNKNOWN).astype(str)
-            else:
-                progress_tracker.log_error(f"Grouping key '{key}' not found in data.")
-                return self.sequences
-
-        sort_col = sort_by if sort_by in df.columns else 'date'
-        df = df.sort_values(by=[sort_col, 'index'], ascending=True, na_position='last')
-
-        if group_by == 'none':
-            grouped = [('all', df)]
-        else:
-            try:
-                grouped = df.groupby(group_keys, observed=True, dropna=False)
-            except Exception as e:
-                progress_tracker.log_error(f"Error during grouping: {e}. Check group keys.")
-                return self.sequences
-
-        filtered_indices = []
-        for name, group_df in grouped:
-            if group_df.empty:
-                continue
-            if keep_per_group == "first":
-                filtered_indices.append(group_df.index[0])
-            elif keep_per_group == "last":
-                filtered_indices.append(group_df.index[-1])
-            else:
-                filtered_indices.append(group_df.index[0])
-                if len(group_df) > 1:
-                    filtered_indices.append(group_df.index[-1])
-
-        filtered_df = df.loc[list(set(filtered_indices))]
-
-        final_sequences = [
-            [row['header'], row['seq'], row['metadata']]
-            for _, row in filtered_df.iterrows()
-        ]
-        
-        original_headers = {h for h, _, _ in self.sequences}
-        final_headers = {h for h, _, _ in final_sequences}
-        removed_headers = list(original_headers - final_headers)
-
-        return self._update_state_and_log(final_sequences, operation_name, removed_headers)
-
-    def filter_clade_monthly(self, mode, targets, keep_strategy, separate=True):
-        """Handles both single and multiple clade monthly filtering."""
-        if not targets:
-            progress_tracker.log_error("No target clades specified for filtering.")
-            return self.sequences
-
-        target_clades_set = set(targets)
-        target_display = targets[0] if mode == 'single' else f"{len(target_clades_set)} clades"
-        operation_name = f"{mode.capitalize()} Clade Monthly Filter ({target_display}, Keep={keep_strategy}, Separate={separate if mode=='multiple' else 'N/A'})"
-        progress_tracker.start_operation(operation_name)
-
-        sequences_to_process = [s for s in self.sequences if s[2].get('clade') in target_clades_set]
-
-        if not sequences_to_process:
-            progress_tracker.log_error(f"No sequences found for the specified clades.")
-            return self._update_state_and_log([], operation_name, [h for h,_,_ in self.sequences])
-
-        final_sequences = []
-        all_removed_headers_step = []
-
-        if mode == 'single' or not separate:
-            processed, removed_step = self._process_monthly_groups(sequences_to_process, keep_strategy)
-            final_sequences.extend(processed)
-            all_removed_headers_step.extend(removed_step)
+            workspace = PartitionedWorkspace(path)
+        except (OSError, ValueError):
+            continue
+        loaded = [key for key in workspace.partitions if partition_file_name(name, key) in st.session_state.all_files]
+        if not loaded:
+            continue
+        with st.expander(T("partitions_header").format(name=name), expanded=False):
+            st.caption(T("partitions_desc").format(fields=", ".join(workspace.fields)))
+            stats = workspace.stats().rename(columns={
+                "Partition": T("partition_col_partition"), "Segment": T("vis_field_segment"),
+                "Type": T("vis_field_subtype"), "Records": T("merge_col_records"), "Unique": T("merge_col_unique"),
+                "Dated": T("partition_col_dated"), "First": T("partition_col_first"), "Last": T("partition_col_last"),
+                "Mean length": T("partition_col_length"), "Subtypes": T("partition_col_subtypes")})
+            st.dataframe(stats, use_container_width=True, hide_index=True)
+            chosen = st.multiselect(T("partitions_select_label"), loaded, key=f"manage_partitions_{name}")
+            if st.button(T("partitions_activate_btn"), key=f"manage_partitions_activate_{name}", disabled=not chosen):
+                activate_files([partition_file_name(name, key) for key in chosen])
+                st.success(T("files_activated").format(count=len(chosen), seqs=len(st.session_state.active_sequences)))
+                st.rerun()
+
+def remove_file(filename):
+    """Forget a loaded file and release its shared dataset."""
+    st.session_state.all_files.pop(filename, None)
+    st.session_state.original_sequences.pop(filename, None)
+    get_dataset_lease().release(filename)
+
+def set_active_sequences(sequences, token=None):
+    """Replace the active dataset and advance its version token."""
+    st.session_state.active_sequences = sequences
+    st.session_state.active_version = token or uuid.uuid4().hex
+
+def apply_operation_result(result, token=None):
+    """Store an engine OperationResult as the new active dataset and report."""
+    if not result.applied:
+        return result.sequences
+    set_active_sequences(result.sequences, token)
+    st.session_state.last_report = result.report()
+    update_status("complete", status_type="success", log=False)
+    return result.sequences
+
+# ==================== BACKGROUND JOBS ====================
+@st.cache_resource
+def get_job_runner():
+    """Process-wide job runner shared by all sessions, so jobs survive reruns."""
+    return JobRunner(max_workers=JOB_WORKERS)
+
+def submit_analysis_job(label_key, operation, **params):
+    """Queue a SequenceAnalyzer operation on the active dataset as a background job."""
+    label = get_translation(label_key)
+    job = get_job_runner().submit(st.session_state.session_id, label, operation, params,
+                                  st.session_state.active_sequences, st.session_state.active_version)
+    st.session_state.analysis_log.append(f"[{datetime.now().strftime('%H:%M:%S')}] INFO: Queued job #{job.id}: {label}")
+    st.toast(get_translation("job_submitted").format(label=label), icon="⏳")
+    return job
+
+def collect_finished_jobs():
+    """Apply results of this session's finished jobs in submission order."""
+    runner = get_job_runner()
+    for job in runner.jobs_for(st.session_state.session_id):
+        if not job.finished:
+            continue
+        runner.claim(job.id)
+        if job.status == JOB_DONE:
+            for event in job.result.events:
+                progress_tracker.log_event(event)
+            if job.input_token != st.session_state.active_version:
+                progress_tracker.log_error(get_translation("job_stale").format(label=job.label))
+                st.toast(get_translation("job_stale").format(label=job.label), icon="⚠️")
+            elif job.result.applied:
+                apply_operation_result(job.result, token=job.token)
+                st.toast(get_translation("job_finished").format(label=job.label), icon="✅")
+        elif job.status == JOB_FAILED:
+            progress_tracker.log_error(get_translation("job_failed_msg").format(label=job.label, error=job.error))
+            st.toast(get_translation("job_failed_msg").format(label=job.label, error=job.error), icon="❌")
         else:
-            for clade in target_clades_set:
-                clade_seqs = [s for s in sequences_to_process if s[2].get('clade') == clade]
-                if clade_seqs:
-                    processed, removed_step = self._process_monthly_groups(clade_seqs, keep_strategy)
-                    final_sequences.extend(processed)
-                    all_removed_headers_step.extend(removed_step)
-
-        original_headers = {h for h, _, _ in self.sequences}
-        final_headers = {h for h, _, _ in final_sequences}
-        removed_headers_overall = list(original_headers - final_headers)
-
-        return self._update_state_and_log(final_sequences, operation_name, removed_headers_overall)
-
-    def _process_monthly_groups(self, sequences_in_group, keep_strategy):
-        """Helper to process monthly groups."""
-        monthly_groups = defaultdict(list)
-        kept_sequences = []
-        removed_headers_group = []
-        original_headers_group = {h for h,_,_ in sequences_in_group}
-
-        for header, seq, metadata in sequences_in_group:
-            date_val = metadata.get('collection_date')
-            month_key = date_val.strftime('%Y-%m') if date_val else 'Unknown'
-            monthly_groups[month_key].append({'header': header, 'seq': seq, 'metadata': metadata, 'date': date_val})
-
-        for month, items in monthly_groups.items():
-            if month == 'Unknown' or len(items) <= 1:
-                kept_sequences.extend([[item['header'], item['seq'], item['metadata']] for item in items])
-                continue
-
-            items.sort(key=lambda x: (x['date'] if x['date'] else datetime.max, x['header']))
-
-            kept_this_month_items = []
-            if keep_strategy == "First Only":
-                kept_this_month_items.append(items[0])
-            elif keep_strategy == "Last Only":
-                kept_this_month_items.append(items[-1])
-            else:
-                kept_this_month_items.append(items[0])
-                if len(items) > 1:
-                    if items[0]['header'] != items[-1]['header']:
-                        kept_this_month_items.append(items[-1])
-
-            kept_sequences.extend([[item['header'], item['seq'], item['metadata']] for item in kept_this_month_items])
-
-        kept_headers_group = {h for h,_,_ in kept_sequences}
-        removed_headers_group = list(original_headers_group - kept_headers_group)
-
-        return kept_sequences, removed_headers_group
-
-    def extract_accessions(self):
-        """Extract accession numbers"""
-        progress_tracker.start_operation("Extracting Accession Numbers")
-        accessions = []
-        seen_accessions = set()
-        
-        for header, seq, metadata in self.sequences:
-            acc = metadata.get('isolate_id', '').strip()
-            if acc and acc != DEFAULT_UNKNOWN and acc.startswith('EPI'):
-                if acc not in seen_accessions:
-                    accessions.append(acc)
-                    seen_accessions.add(acc)
-            else:
-                if '|' in header:
-                    parts = header.split('|')
-                    for part in parts:
-                        part_strip = part.strip()
-                        if part_strip.startswith('EPI_ISL_') and part_strip not in seen_accessions:
-                            accessions.append(part_strip)
-                            seen_accessions.add(part_strip)
-                            break
-
-        progress_tracker.complete_operation(f"Found {len(accessions)} unique EPI_ISL accessions")
-        return accessions
+            st.session_state.analysis_log.append(
+                f"[{datetime.now().strftime('%H:%M:%S')}] WARNING: {get_translation('job_cancelled_msg').format(label=job.label)}")
+
+def render_job_panel():
+    """Progress bars and cancel buttons for this session's queued/running jobs."""
+    runner = get_job_runner()
+    jobs = runner.jobs_for(st.session_state.session_id)
+    if any(job.finished for job in jobs):
+        st.rerun()  # Pick up results in a full run
+    if not jobs:
+        return
+    T = lambda key: get_translation(key, st.session_state.lang)
+    st.markdown(f"#### {T('jobs_header')}")
+    for job in jobs:
+        job_cols = st.columns([5, 1])
+        with job_cols[0]:
+            st.progress(min(max(job.progress, 0.0), 1.0),
+                        text=f"#{job.id} {job.label} — {T('job_' + job.status)} ({job.elapsed:.1f}s)")
+        with job_cols[1]:
+            if st.button(T("cancel_job_btn"), key=f"cancel_job_{job.id}", use_container_width=True):
+                runner.cancel(job.id)
+                st.rerun()
+
+def job_monitor():
+    """Render the job panel, polling while jobs are active.
+
+    Uses st.fragment when available so only the panel reruns; otherwise the
+    whole script is rerun from the end of main().
+    """
+    active = get_job_runner().active_jobs(st.session_state.session_id)
+    if hasattr(st, "fragment"):
+        st.fragment(run_every=JOB_POLL_INTERVAL if active else None)(render_job_panel)()
+    else:
+        render_job_panel()
+    return bool(active)
 
 # ==================== VISUALIZATION FUNCTIONS ====================
 def create_metric_indicator(value, title_key, lang="en"):
@@ -1223,6 +1286,31 @@ def create_gauge_indicator(value, max_value, title_key, lang="en"):
     )
     return fig
 
+# ==================== CHART DATA REDUCTION ====================
+def cap_categories(counts, limit, other_label="Other"):
+    """Largest `limit` (category, count) pairs, with the remaining tail summed into `other_label`."""
+    items = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    if len(items) <= limit:
+        return items
+    other_count = sum(count for _, count in items[limit:])
+    return items[:limit] + ([(other_label, other_count)] if other_count > 0 else [])
+
+def resolve_time_interval(first_date, last_date, interval, budget=CHART_POINT_BUDGET):
+    """Interval to plot so the number of periods fits the budget.
+
+    'auto' picks the finest interval with at most CHART_AUTO_PERIODS periods;
+    an explicit interval is only coarsened when it would exceed `budget`.
+    """
+    months = (last_date.year - first_date.year) * 12 + last_date.month - first_date.month + 1
+    if interval == 'auto':
+        candidates, limit = TIME_INTERVALS, CHART_AUTO_PERIODS
+    else:
+        candidates, limit = TIME_INTERVALS[TIME_INTERVALS.index(interval):], budget
+    for name in candidates:
+        if -(-months // INTERVAL_MONTHS[name]) <= limit:
+            return name
+    return candidates[-1]
+
 def create_distribution_chart(data_dict, title_key, lang="en", chart_type='bar'):
     """Create distribution pie or bar charts"""
     if not data_dict:
@@ -1236,15 +1324,7 @@ def create_distribution_chart(data_dict, title_key, lang="en", chart_type='bar')
         return fig
 
     title = get_translation(title_key, lang)
-    df = pd.DataFrame(list(data_dict.items()), columns=['Category', 'Count'])
-
-    limit = 15
-    if len(df) > limit:
-        df = df.nlargest(limit, 'Count')
-        other_count = sum(count for _, count in data_dict.items()) - df['Count'].sum()
-        if other_count > 0:
-            df_other = pd.DataFrame([{'Category': 'Other', 'Count': other_count}])
-            df = pd.concat([df, df_other], ignore_index=True)
+    df = pd.DataFrame(cap_categories(data_dict, CHART_MAX_CATEGORIES), columns=['Category', 'Count'])
 
     if chart_type.lower() == 'pie':
         fig = px.pie(df, values='Count', names='Category', title=f"{title}",
@@ -1269,11 +1349,19 @@ def create_distribution_chart(data_dict, title_key, lang="en", chart_type='bar')
     return fig
 
 # ==================== NEW PLOTLY VISUALIZATION FUNCTIONS ====================
-def create_temporal_chart(sequences, interval='month', lang='en'):
-    """Generate a Plotly line chart for sequences over time."""
+def create_temporal_chart(sequences, interval='month', lang='en', budget=CHART_POINT_BUDGET, split_by=None):
+    """Generate a Plotly line chart for sequences over time.
+
+    Periods without sequences are shown as zero. With `split_by` (e.g.
+    'clade' or 'host') each value gets its own line. The interval is
+    coarsened (or chosen, for 'auto') to keep periods x lines within
+    `budget`; long series drop labels and render with WebGL.
+    """
     progress_tracker.start_operation(f"Generating Temporal Chart (Interval: {interval})")
-    df_data = [{'date': item[2].get('collection_date')} for item in sequences if item[2].get('collection_date')]
-    if not df_data:
+    view = as_view(sequences)
+    dates = view.collection_dates()
+    dated = ~np.isnat(dates)
+    if not dated.any():
         progress_tracker.log_error("No date information found for temporal chart.")
         # Return an empty figure with a title indicating no data
         fig = go.Figure()
@@ -1281,22 +1369,22 @@ def create_temporal_chart(sequences, interval='month', lang='en'):
                           annotations=[{'text': 'No date data available', 'xref': 'paper', 'yref': 'paper', 'showarrow': False, 'font': {'size': 16}}])
         return fig
 
-    df = pd.DataFrame(df_data)
-    df['date'] = pd.to_datetime(df['date'])
-    df = df.dropna(subset=['date'])
-
-    # Aggregate counts based on interval
-    if interval == 'year':
-        df['period'] = df['date'].dt.year.astype(str)
-    elif interval == 'quarter':
-        # Ensure correct quarterly period string (e.g., 2023-Q1)
-        df['period'] = df['date'].dt.to_period('Q').astype(str)
-    else: # Default to month (YYYY-MM)
-        df['period'] = df['date'].dt.strftime('%Y-%m')
-
-    counts = df['period'].value_counts().sort_index()
-    counts_df = counts.reset_index()
-    counts_df.columns = ['Period', 'Count']
+    series_count = 1
+    if split_by:
+        series_count = min(CHART_MAX_SERIES + 1, len(np.unique(view.metadata_codes(split_by)[0][dated])))
+    requested = interval
+    interval = resolve_time_interval(pd.Timestamp(dates[dated].min()), pd.Timestamp(dates[dated].max()),
+                                     interval, max(1, budget // series_count))
+
+    counts = temporal_counts(view, interval, by=split_by)
+    if split_by:
+        # Largest series first; the tail is summed into "Other"
+        counts = counts[counts.sum().sort_values(ascending=False).index]
+        if counts.shape[1] > CHART_MAX_SERIES:
+            other = counts.iloc[:, CHART_MAX_SERIES:].sum(axis=1)
+            counts = counts.iloc[:, :CHART_MAX_SERIES].assign(Other=other)
+    counts.index = counts.index.astype(str)
+    counts_df = counts.rename_axis('Period').reset_index()
 
     # Use translation for title
     T = lambda key: get_translation(key, lang)
@@ -1305,23 +1393,42 @@ def create_temporal_chart(sequences, interval='month', lang='en'):
     elif interval == 'quarter': title_text = T("vis_interval_quarter") + " Count"
     elif interval == 'month': title_text = T("vis_interval_month") + " Count"
 
-    fig = px.line(counts_df, x='Period', y='Count',
-                  title=title_text,
-                  markers=True, text='Count')
-    fig.update_traces(textposition="top center")
+    point_count = counts.size
+    render_mode = 'webgl' if point_count > CHART_WEBGL_POINTS else 'auto'
+    if split_by:
+        split_display = _field_display(split_by, lang)
+        long_df = counts_df.melt(id_vars='Period', var_name=split_display, value_name=COUNT_COLUMN)
+        fig = px.line(long_df, x='Period', y=COUNT_COLUMN, color=split_display,
+                      title=f"{title_text} ({split_display})",
+                      markers=point_count <= CHART_LABEL_POINTS, render_mode=render_mode)
+    else:
+        labelled = point_count <= CHART_LABEL_POINTS
+        fig = px.line(counts_df, x='Period', y=COUNT_COLUMN,
+                      title=title_text,
+                      markers=labelled, text=COUNT_COLUMN if labelled else None,
+                      render_mode=render_mode)
+        if labelled:
+            fig.update_traces(textposition="top center")
     fig.update_layout(
         xaxis_title="Time Period", yaxis_title="Number of Sequences",
         margin=dict(t=50, b=20, l=20, r=20),
         paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)'
     )
-    progress_tracker.complete_operation("Temporal chart generated")
+    note = f" (by {interval}, coarsened from {requested} to fit {budget:,} points)" if requested not in ('auto', interval) else f" (by {interval})"
+    progress_tracker.complete_operation("Temporal chart generated" + note)
     return fig
 
 def create_geographic_heatmap(sequences, top_n=20, lang='en'):
-    """Generate a Plotly horizontal bar chart simulating a heatmap."""
+    """Generate a Plotly horizontal bar chart simulating a heatmap.
+
+    Locations are normalized to countries through the gazetteer (so "Usa",
+    "United_states" and "Ohio" count together); unmatched ones keep their text.
+    """
     progress_tracker.start_operation(f"Generating Geographic Heatmap (Top {top_n})")
+    codes, labels = country_codes(sequences)
     # Exclude DEFAULT_UNKNOWN from counts if it exists
-    location_counts = Counter(item[2].get('location', DEFAULT_UNKNOWN) for item in sequences if item[2].get('location', DEFAULT_UNKNOWN) != DEFAULT_UNKNOWN)
+    location_counts = Counter({label: int(count) for label, count in zip(labels, np.bincount(codes, minlength=len(labels)))
+                               if count and label != DEFAULT_UNKNOWN})
 
     if not location_counts:
         progress_tracker.log_error("No location information found for heatmap.")
@@ -1353,64 +1460,81 @@ def create_geographic_heatmap(sequences, top_n=20, lang='en'):
     progress_tracker.complete_operation("Geographic heatmap generated")
     return fig
 
-def create_stacked_bar_chart(sequences, category1='location', category2='type', top_n=15, lang='en'):
-    """Generate a Plotly stacked bar chart."""
+def create_geographic_map(sequences, lang='en'):
+    """Generate a Plotly choropleth of sequence counts per country (ISO-3 codes from the gazetteer)."""
+    progress_tracker.start_operation("Generating Geographic Map")
+    counts, unmatched = country_counts(sequences)
+    if counts.empty:
+        progress_tracker.log_error("No recognizable country information found for map.")
+        fig = go.Figure()
+        fig.update_layout(title="Geographic Distribution (No Data)", xaxis={'visible': False}, yaxis={'visible': False},
+                          annotations=[{'text': 'No recognizable locations', 'xref': 'paper', 'yref': 'paper', 'showarrow': False, 'font': {'size': 16}}])
+        return fig
+
+    fig = px.choropleth(counts, locations='ISO3', locationmode='ISO-3', color='Count',
+                        hover_name='Country', color_continuous_scale=px.colors.sequential.OrRd,
+                        title=f"Sequences by Country ({len(counts)} countries)")
+    fig.update_geos(showframe=False, showcoastlines=True, projection_type='natural earth')
+    fig.update_layout(
+        margin=dict(t=50, b=20, l=20, r=20),
+        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+        coloraxis_colorbar=dict(title="Sequences")
+    )
+    if unmatched:
+        fig.add_annotation(text=get_translation("map_unmatched", lang).format(count=unmatched), xref='paper', yref='paper',
+                           x=0, y=-0.05, showarrow=False, font={'size': 11, 'color': '#6b7280'})
+    progress_tracker.complete_operation(f"Geographic map generated ({unmatched:,} records without a recognized country)")
+    return fig
+
+def _field_display(field, lang):
+    """Translated label of a visualizer field."""
+    key = f"vis_field_{field}"
+    return get_translation(key, lang) if key in TRANSLATIONS[lang] else field.capitalize()
+
+def _cap_columns(matrix, limit):
+    """Keep the `limit` largest columns of a count matrix and sum the rest into "Other"."""
+    matrix = matrix[matrix.sum().sort_values(ascending=False).index]
+    if matrix.shape[1] <= limit:
+        return matrix
+    return matrix.iloc[:, :limit].assign(Other=matrix.iloc[:, limit:].sum(axis=1))
+
+def create_stacked_bar_chart(sequences, category1='location', category2='type', top_n=15, lang='en', budget=CHART_POINT_BUDGET):
+    """Generate a Plotly stacked bar chart.
+
+    Counts come from one cross-tabulation pass; secondary categories
+    beyond what fits `budget` (and CHART_MAX_SERIES) are summed into an
+    "Other" series.
+    """
     progress_tracker.start_operation(f"Generating Stacked Bar ({category1} vs {category2}, Top {top_n})")
-    T = lambda key: get_translation(key, lang)
+    # Only records where both categories are known are counted
+    matrix = crosstab_frame(sequences, category1, category2)
 
-    # Helper to get field value, handling date fields
-    def get_field(metadata, field):
-        if field == 'year': return str(metadata['collection_date'].year) if metadata.get('collection_date') else DEFAULT_UNKNOWN
-        if field == 'month': return metadata['collection_date'].strftime('%Y-%m') if metadata.get('collection_date') else DEFAULT_UNKNOWN
-        return str(metadata.get(field, DEFAULT_UNKNOWN))
-
-    # Aggregate data: category1 -> category2 -> count
-    data = defaultdict(lambda: Counter())
-    valid_seq_count = 0
-    for _, _, meta in sequences:
-         cat1_val = get_field(meta, category1)
-         cat2_val = get_field(meta, category2)
-         # Only count if both categories are known
-         if cat1_val != DEFAULT_UNKNOWN and cat2_val != DEFAULT_UNKNOWN:
-              data[cat1_val][cat2_val] += 1
-              valid_seq_count += 1
-
-    if not data:
+    if matrix.empty:
         progress_tracker.log_error(f"No valid data found for stacking {category1} by {category2}.")
         fig = go.Figure()
         fig.update_layout(title=f"Stacked Bar: {category1.capitalize()} vs {category2.capitalize()} (No Data)", xaxis={'visible': False}, yaxis={'visible': False},
                           annotations=[{'text': 'No valid data for stacking', 'xref': 'paper', 'yref': 'paper', 'showarrow': False, 'font': {'size': 16}}])
         return fig
 
-    # Prepare DataFrame for Plotly
-    df_list = []
-    for cat1, cat2_counts in data.items():
-        for cat2, count in cat2_counts.items():
-            df_list.append({category1: cat1, category2: cat2, 'Count': count})
-    if not df_list: # Check if list is empty after filtering unknowns
-        progress_tracker.log_error(f"No valid data points after filtering Unknowns for stacking.")
-        fig = go.Figure(); fig.update_layout(title=f"Stacked Bar: {category1.capitalize()} vs {category2.capitalize()} (No Valid Data Points)"); return fig
-    df = pd.DataFrame(df_list)
-
-    # Get top N primary categories based on total count
-    cat1_totals = df.groupby(category1)['Count'].sum().nlargest(top_n).index
-    df_filtered = df[df[category1].isin(cat1_totals)]
-
-    if df_filtered.empty:
-         progress_tracker.log_error(f"No data remaining after filtering for top {top_n} {category1}s.")
-         fig = go.Figure(); fig.update_layout(title=f"Stacked Bar: {category1.capitalize()} vs {category2.capitalize()} (No Data in Top {top_n})"); return fig
+    # Top N primary categories by total count, then cap the stacked series
+    cat1_totals = matrix.sum(axis=1).nlargest(top_n).index
+    matrix = matrix.loc[cat1_totals]
+    matrix = _cap_columns(matrix.loc[:, matrix.sum() > 0], max(1, min(CHART_MAX_SERIES, budget // len(cat1_totals))))
 
+    df_filtered = matrix.stack().rename(COUNT_COLUMN).reset_index()
+    df_filtered.columns = [category1, category2, COUNT_COLUMN]
+    df_filtered = df_filtered[df_filtered[COUNT_COLUMN] > 0]
     # Sort secondary category for consistent legend color
     df_filtered = df_filtered.sort_values(by=[category1, category2])
 
     # Use translations for titles/labels
-    cat1_display = T(f"vis_field_{category1}") if f"vis_field_{category1}" in TRANSLATIONS[lang] else category1.capitalize()
-    cat2_display = T(f"vis_field_{category2}") if f"vis_field_{category2}" in TRANSLATIONS[lang] else category2.capitalize()
+    cat1_display = _field_display(category1, lang)
+    cat2_display = _field_display(category2, lang)
     title_text = f"{cat2_display} Distribution within Top {len(cat1_totals)} {cat1_display}s"
 
-    fig = px.bar(df_filtered, x=category1, y='Count', color=category2,
+    fig = px.bar(df_filtered, x=category1, y=COUNT_COLUMN, color=category2,
                  title=title_text,
-                 text_auto='.2s', # Show count on segments, formatted
+                 text_auto='.2s' if len(df_filtered) <= CHART_LABEL_POINTS * 4 else False, # Show count on segments, formatted
                  category_orders={category1: cat1_totals.tolist()} # Keep the top N order
                 )
     fig.update_traces(textfont_size=10, textangle=0, textposition="inside", cliponaxis=False) # Improve text visibility
@@ -1427,6 +1551,74 @@ def create_stacked_bar_chart(sequences, category1='location', category2='type',
     progress_tracker.complete_operation("Stacked bar chart generated")
     return fig
 
+def create_category_heatmap(sequences, category1='location', category2='type', top_n=15, lang='en', budget=CHART_POINT_BUDGET):
+    """Generate a Plotly heatmap of sequence counts for two metadata fields.
+
+    Rows are the top N values of `category1`; columns are capped to fit
+    `budget` cells, with the remainder summed into "Other".
+    """
+    progress_tracker.start_operation(f"Generating Category Heatmap ({category1} vs {category2}, Top {top_n})")
+    matrix = crosstab_frame(sequences, category1, category2)
+    if matrix.empty:
+        progress_tracker.log_error(f"No valid data found for {category1} by {category2}.")
+        fig = go.Figure()
+        fig.update_layout(title=f"Heatmap: {category1.capitalize()} vs {category2.capitalize()} (No Data)", xaxis={'visible': False}, yaxis={'visible': False},
+                          annotations=[{'text': 'No valid data for this pair', 'xref': 'paper', 'yref': 'paper', 'showarrow': False, 'font': {'size': 16}}])
+        return fig
+
+    matrix = matrix.loc[matrix.sum(axis=1).nlargest(top_n).index]
+    matrix = _cap_columns(matrix.loc[:, matrix.sum() > 0], max(1, budget // len(matrix)))
+    if category1 in DATE_FIELDS:
+        matrix = matrix.sort_index()  # Keep time in order
+    if category2 in DATE_FIELDS:
+        matrix = matrix[sorted(matrix.columns, key=lambda c: (c == 'Other', c))]
+
+    cat1_display = _field_display(category1, lang)
+    cat2_display = _field_display(category2, lang)
+    fig = px.imshow(matrix.values, x=[str(c) for c in matrix.columns], y=[str(r) for r in matrix.index],
+                    labels={'x': cat2_display, 'y': cat1_display, 'color': "Sequences"},
+                    title=f"{cat1_display} x {cat2_display}",
+                    text_auto=matrix.size <= CHART_LABEL_POINTS * 4,
+                    color_continuous_scale=px.colors.sequential.Blues, aspect='auto')
+    fig.update_layout(
+        margin=dict(t=50, b=20, l=20, r=20),
+        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)'
+    )
+    fig.update_xaxes(tickangle=45)
+    progress_tracker.complete_operation("Category heatmap generated")
+    return fig
+
+# ==================== CHART CACHE ====================
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def build_chart(dataset_version, chart_key, params, lang, _sequences):
+    """Visualizer figure, cached by dataset version, chart type, parameters and language.
+
+    `_sequences` is not hashed: the version token identifies the active set,
+    so any filter that replaces it misses the cache.
+    """
+    if chart_key in ('bar', 'pie'):
+        counts = SequenceAnalyzer(_sequences, on_event=progress_tracker.log_event).get_metadata_distribution(params['field'])
+        return create_distribution_chart(counts, params['title'], lang=lang, chart_type=chart_key)
+    if chart_key == 'line':
+        return create_temporal_chart(_sequences, interval=params['interval'], lang=lang, budget=params['budget'],
+                                     split_by=params['split_by'])
+    if chart_key == 'heatmap':
+        return create_geographic_heatmap(_sequences, top_n=params['top_n'], lang=lang)
+    if chart_key == 'map':
+        return create_geographic_map(_sequences, lang=lang)
+    if chart_key == 'stacked':
+        return create_stacked_bar_chart(_sequences, category1=params['category1'], category2=params['category2'],
+                                        top_n=params['top_n'], lang=lang, budget=params['budget'])
+    if chart_key == 'matrix':
+        return create_category_heatmap(_sequences, category1=params['category1'], category2=params['category2'],
+                                       top_n=params['top_n'], lang=lang, budget=params['budget'])
+    raise ValueError(f"Unknown chart type: {chart_key}")
+
+def get_chart(chart_key, **params):
+    """Cached figure for the active dataset."""
+    return build_chart(st.session_state.active_version, chart_key, params, st.session_state.lang,
+                       st.session_state.active_sequences)
+
 # ==================== CUSTOM CSS ====================
 def load_custom_css():
     """Load custom CSS for better UI"""
@@ -1653,7 +1845,11 @@ def init_session_state():
         'confirming_removal': False,
         'status_placeholder': None,
         'gdrive_mounted': False,
-        'generated_chart': None
+        'generated_chart': None,
+        'session_id': uuid.uuid4().hex,
+        'active_version': uuid.uuid4().hex,
+        'dataset_lease': None,
+        'partitioned_workspaces': {},
     }
     for key, default_value in defaults.items():
         if key not in st.session_state:
@@ -1670,6 +1866,8 @@ def main():
 
     load_custom_css()
     init_session_state()
+    st.session_state.status_placeholder = None  # Recreated below for this run
+    collect_finished_jobs()
 
     # Sidebar with full translation
     with st.sidebar:
@@ -1696,11 +1894,11 @@ def main():
 
         if st.session_state.active_sequences:
             st.metric(T("sidebar_active_seqs"), f"{len(st.session_state.active_sequences):,}")
-            try:
-                avg_len = sum(len(s[1]) for s in st.session_state.active_sequences) / len(st.session_state.active_sequences)
-                st.metric(T("sidebar_avg_length"), f"{int(avg_len):,} {T('bp')}")
-            except ZeroDivisionError:
-                st.metric(T("sidebar_avg_length"), "N/A")
+            active_view = st.session_state.active_sequences
+            if not isinstance(active_view, RecordView):
+                active_view = RecordView([active_view])
+            # Computed from packed codes where available, without decoding sequences
+            st.metric(T("sidebar_avg_length"), f"{int(active_view.sequence_lengths().mean()):,} {T('bp')}")
         else:
             st.caption(T("sidebar_no_dataset"))
 
@@ -1708,6 +1906,9 @@ def main():
 
         st.markdown(f"### {T('sidebar_quick_actions')}")
         if st.button(T("sidebar_reset_all"), use_container_width=True, key="reset_all_sidebar"):
+            for job in get_job_runner().active_jobs(st.session_state.session_id):
+                get_job_runner().cancel(job.id)
+            get_dataset_lease().release_all()
             preserved_lang = st.session_state.lang
             keys_to_reset = list(st.session_state.keys())
             for key in keys_to_reset:
@@ -1721,11 +1922,7 @@ def main():
 
         if st.session_state.active_sequences:
             fasta_str_io = io.StringIO()
-            for header, seq, _ in st.session_state.active_sequences:
-                h = header if isinstance(header, str) else str(header or '')
-                h = h if h.startswith('>') else '>' + h
-                s = seq if isinstance(seq, str) else str(seq or '')
-                fasta_str_io.write(f"{h}\n{s}\n")
+            write_fasta(st.session_state.active_sequences, fasta_str_io)
 
             st.download_button(
                 label=T("sidebar_quick_export"),
@@ -1745,6 +1942,7 @@ def main():
     st.session_state.status_placeholder = st.empty()
     if st.session_state.status_message:
         update_status(st.session_state.status_message, st.session_state.status_level, log=False)
+    jobs_active = job_monitor()
 
     tab_keys = ["upload_tab", "manage_tab", "analyze_tab", "refine_tab", "export_tab", "docs_tab"]
     tabs = st.tabs([T(key) for key in tab_keys])
@@ -1791,7 +1989,6 @@ def main():
                 if uploaded_files:
                     with st.spinner(T("processing_files")):
                         progress_bar = st.progress(0, text=T("initializing"))
-                        parser = FastaParser()
                         newly_loaded_count = 0
                         total_sequences_added = 0
                         has_errors = False
@@ -1809,7 +2006,7 @@ def main():
                                     else:
                                         content_string = content_bytes.decode('utf-8', errors='replace')
 
-                                    sequences, errors = parser.parse(content_string)
+                                    sequences, errors = parse_fasta_file(filename, content_string)
 
                                     if errors:
                                         has_errors = True
@@ -1874,18 +2071,15 @@ def main():
                                     content_string = content_bytes.decode('utf-8', errors='replace')
 
                                 if content_string:
-                                    parser = FastaParser()
-                                    sequences, errors = parser.parse(content_string)
+                                    sequences, errors = parse_fasta_file(filename, content_string)
 
                                     if errors:
                                         st.warning(f"⚠️ {filename}: {errors[0]}", icon="⚠️")
 
                                     if sequences:
                                         st.session_state.all_files[filename] = sequences
-                                        st.session_state.original_sequences[filename] = sequences
                                         st.success(T("downloaded_processed").format(filename=filename, seqs=len(sequences)))
-                                        st.session_state.active_filenames = [filename]
-                                        st.session_state.active_sequences = sequences
+                                        activate_files([filename])
                                         st.info(T("activated_file_info").format(filename=filename))
                                     else:
                                         progress_tracker.log_error("No valid sequences found in content from URL.")
@@ -1931,17 +2125,26 @@ def main():
                                 st.warning("No matching FASTA files found at the specified path/pattern.")
                                 return
                             
-                            parser = FastaParser()
                             newly_loaded_count = 0
                             total_sequences_added = 0
                             
                             for file_path in matching_files:
-                                filename = os.path.basename(file_path)
-                                if filename.lower().endswith(('.fasta', '.fas', '.fa', '.fna', '.txt')):
+                                filename = os.path.basename(file_path.rstrip('/'))
+                                if is_partitioned_workspace(file_path):
+                                    files, seqs = load_partitioned_workspace(filename, file_path)
+                                    newly_loaded_count += files
+                                    total_sequences_added += seqs
+                                elif is_workspace(file_path):
+                                    sequences, errors = parse_fasta_file(filename, workspace_path=file_path)
+                                    if sequences:
+                                        st.session_state.all_files[filename] = sequences
+                                        newly_loaded_count += 1
+                                        total_sequences_added += len(sequences)
+                                elif filename.lower().endswith(('.fasta', '.fas', '.fa', '.fna', '.txt')):
                                     with open(file_path, 'r') as f:
                                         content_string = f.read()
                                     
-                                    sequences, errors = parser.parse(content_string)
+                                    sequences, errors = parse_fasta_file(filename, content_string)
                                     
                                     if errors:
                                         st.warning(f"⚠️ {filename}: {errors[0]}", icon="⚠️")
@@ -1990,6 +2193,11 @@ def main():
         else:
             st.subheader(T("loaded_datasets_header"))
             st.caption(T("loaded_datasets_desc"))
+            registry_stats = get_dataset_registry().stats()
+            st.caption(T("shared_cache_caption").format(
+                datasets=registry_stats["datasets"], referenced=registry_stats["referenced"],
+                used=registry_stats["nbytes"] / 1024 ** 2, limit=registry_stats["memory_limit"] / 1024 ** 2,
+                on_disk=registry_stats["on_disk"], disk=registry_stats["disk_bytes"] / 1024 ** 2))
 
             file_selection_states = {}
             cols = st.columns(2)
@@ -2032,13 +2240,7 @@ def main():
                     if not selected_files_now:
                         st.warning(T("no_files_selected_activate"))
                     else:
-                        st.session_state.active_filenames = selected_files_now
-                        st.session_state.original_sequences = {}
-                        st.session_state.active_sequences = []
-                        for fname in selected_files_now:
-                            current_file_seqs = [list(s) for s in st.session_state.all_files.get(fname, [])]
-                            st.session_state.active_sequences.extend(current_file_seqs)
-                            st.session_state.original_sequences[fname] = current_file_seqs
+                        activate_files(selected_files_now)
                         count = len(st.session_state.active_sequences)
                         st.success(T("files_activated").format(count=len(selected_files_now), seqs=count))
                         st.rerun()
@@ -2050,6 +2252,29 @@ def main():
                     else:
                         st.session_state.confirming_removal = True
 
+            append_cols = st.columns([1, 2])
+            with append_cols[1]:
+                skip_duplicates = st.checkbox(T("append_dedup_label"), value=True, key="manage_append_dedup")
+            with append_cols[0]:
+                if st.button(T("append_btn"), use_container_width=True, key="manage_append", help=T("append_help")):
+                    active_bases = {id(base) for base in as_view(st.session_state.active_sequences).bases}
+                    new_files = [fname for fname in selected_files_now
+                                 if id(st.session_state.all_files[fname]) not in active_bases]
+                    if not new_files:
+                        st.warning(T("no_files_to_append"))
+                    else:
+                        added, skipped = append_files(new_files, skip_duplicates)
+                        st.success(T("files_appended").format(added=added, count=len(new_files), skipped=skipped))
+                        st.rerun()
+                if st.button(T("merge_dedup_btn"), use_container_width=True, key="manage_merge", help=T("merge_dedup_help")):
+                    if not selected_files_now:
+                        st.warning(T("no_files_selected_activate"))
+                    else:
+                        view = merge_files(selected_files_now)
+                        st.success(T("files_merged").format(count=len(selected_files_now), kept=len(view),
+                                                            total=int(view.offsets[-1])))
+                        st.rerun()
+
             if st.session_state.get("confirming_removal", False):
                 st.warning(T("confirm_remove_msg").format(count=len(selected_files_now)))
                 confirm_cols = st.columns(2)
@@ -2058,21 +2283,13 @@ def main():
                         removed_count = 0
                         for filename in selected_files_now:
                             if filename in st.session_state.all_files:
-                                del st.session_state.all_files[filename]
+                                remove_file(filename)
                                 removed_count += 1
-                            if filename in st.session_state.original_sequences:
-                                del st.session_state.original_sequences[filename]
                             if filename in st.session_state.active_filenames:
                                 st.session_state.active_filenames.remove(filename)
 
                         if removed_count > 0:
-                            st.session_state.active_sequences = []
-                            st.session_state.original_sequences = {}
-                            for fname in st.session_state.active_filenames:
-                                current_file_seqs = [list(s) for s in st.session_state.all_files.get(fname, [])]
-                                st.session_state.active_sequences.extend(current_file_seqs)
-                                st.session_state.original_sequences[fname] = current_file_seqs
-
+                            activate_files(st.session_state.active_filenames)
                             st.warning(T("removed_files_msg").format(count=removed_count))
                         st.session_state.confirming_removal = False
                         st.rerun()
@@ -2081,11 +2298,14 @@ def main():
                         st.session_state.confirming_removal = False
                         st.rerun()
 
+            render_partition_stats()
+
             st.markdown("---")
             st.subheader(T("active_dataset"))
             if st.session_state.active_sequences:
                 st.write(f"**{T('files')}:** `{', '.join(st.session_state.active_filenames)}`")
                 st.write(f"**{T('total_seqs')}:** `{len(st.session_state.active_sequences):,}`")
+                render_merge_report()
             else:
                 st.info(T("active_dataset_info"))
 
@@ -2101,7 +2321,7 @@ def main():
                 </div>
             """, unsafe_allow_html=True)
         else:
-            analyzer = SequenceAnalyzer(st.session_state.active_sequences)
+            analyzer = SequenceAnalyzer(st.session_state.active_sequences, on_event=progress_tracker.log_event)
 
             st.subheader(T("current_dataset_overview"))
             col1, col2 = st.columns(2)
@@ -2112,7 +2332,7 @@ def main():
                     st.session_state.lang
                 ), use_container_width=True)
             with col2:
-                avg_len = sum(len(s[1]) for s in analyzer.sequences) / len(analyzer.sequences) if analyzer.sequences else 0
+                avg_len = float(analyzer.sequences.sequence_lengths().mean()) if analyzer.sequences else 0
                 st.plotly_chart(create_gauge_indicator(
                     avg_len,
                     max_value=max(2000, int(avg_len * 1.5)),
@@ -2122,6 +2342,8 @@ def main():
 
             st.markdown("---")
 
+            render_record_browser()
+
             # --- Data Visualizer (Enhanced) ---
             with st.expander(T("distribution_viewer_title"), expanded=True):
                  st.markdown(f"*{T('visualizer_desc')}*")
@@ -2136,54 +2358,63 @@ def main():
                      # ADDED New chart types
                      vis_chart_options = {
                          T("vis_type_bar"): 'bar', T("vis_type_pie"): 'pie',
-                         T("vis_type_line"): 'line', T("vis_type_heatmap"): 'heatmap',
-                         T("vis_type_stacked"): 'stacked'
+                         T("vis_type_line"): 'line', T("vis_type_heatmap"): 'heatmap', T("vis_type_map"): 'map',
+                         T("vis_type_stacked"): 'stacked', T("vis_type_matrix"): 'matrix'
                      }
 
                      selected_chart_display = st.selectbox(T("chart_type_label"), list(vis_chart_options.keys()), key="vis_chart_type")
                      selected_chart_key = vis_chart_options[selected_chart_display]
 
                      # ADDED Conditional controls
-                     field1, field2, interval, top_n_val = None, None, None, 20
+                     field1, field2, interval, top_n_val, point_budget, split_by = None, None, None, 20, CHART_POINT_BUDGET, None
                      if selected_chart_key in ['bar', 'pie']:
                          field1_display = st.selectbox(T("field_label"), list(vis_field_options.keys()), key="vis_field1")
                          field1 = vis_field_options[field1_display]
                      elif selected_chart_key == 'line':
-                         interval_options = {T("vis_interval_month"): 'month', T("vis_interval_quarter"): 'quarter', T("vis_interval_year"): 'year'}
+                         interval_options = {T("vis_interval_auto"): 'auto', T("vis_interval_month"): 'month', T("vis_interval_quarter"): 'quarter', T("vis_interval_year"): 'year'}
                          interval_display = st.selectbox(T("time_interval_label"), list(interval_options.keys()), key="vis_interval")
                          interval = interval_options[interval_display]
+                         split_options = {T("vis_split_none"): None, T("vis_field_subtype"): 'type', T("vis_field_clade"): 'clade',
+                                          T("vis_field_host"): 'host', T("vis_field_location"): 'location', T("vis_field_segment"): 'segment'}
+                         split_by = split_options[st.selectbox(T("vis_split_label"), list(split_options.keys()), key="vis_split_by")]
                      elif selected_chart_key == 'heatmap':
                          top_n_val = st.slider(T("top_n_label"), 5, 50, 20, 5, key="vis_top_n")
-                     elif selected_chart_key == 'stacked':
+                     elif selected_chart_key in ['stacked', 'matrix']:
                          # Use different selectbox keys to avoid conflict
                          cat1_display = st.selectbox(T("category1_label"), list(vis_field_options.keys()), index=3, key="vis_cat1_stacked") # Default location
                          field1 = vis_field_options[cat1_display]
                          cat2_display = st.selectbox(T("category2_label"), list(vis_field_options.keys()), index=0, key="vis_cat2_stacked") # Default subtype
                          field2 = vis_field_options[cat2_display]
                          top_n_val = st.slider(T("top_n_label") + f" ({cat1_display})", 5, 30, 15, 5, key="vis_top_n_stacked")
+                     if selected_chart_key in ['line', 'stacked', 'matrix']:
+                         point_budget = st.slider(T("vis_point_budget"), 500, 20000, CHART_POINT_BUDGET, 500,
+                                                  key="vis_point_budget", help=T("help_point_budget"))
                      # END ADDED Conditional controls
 
                  with vis_col2:
                      # Add vertical space to align button
-                     for _ in range(5 if selected_chart_key not in ['stacked','heatmap'] else (7 if selected_chart_key=='stacked' else 6) ): st.write("")
+                     for _ in range({'line': 9, 'heatmap': 6, 'stacked': 9, 'matrix': 9}.get(selected_chart_key, 5)): st.write("")
                      # UPDATED Button logic
                      if st.button(T("generate_chart_btn"), key="vis_generate", use_container_width=True, type="primary"):
-                         if field1 == field2 and selected_chart_key == 'stacked':
-                              st.error("Primary and Secondary categories cannot be the same for Stacked Bar chart.")
+                         if field1 == field2 and selected_chart_key in ['stacked', 'matrix']:
+                              st.error("Primary and Secondary categories cannot be the same for two-category charts.")
                          else:
                               with st.spinner(T("generating_chart")):
                                   fig = None
                                   try:
-                                      # Call appropriate new or existing function
+                                      # Figures are cached per dataset version and chart parameters
                                       if selected_chart_key in ['bar', 'pie']:
-                                          counts = analyzer.get_metadata_distribution(field1)
-                                          fig = create_distribution_chart(counts, f"{field1_display} Distribution", chart_type=selected_chart_key)
+                                          fig = get_chart(selected_chart_key, field=field1, title=f"{field1_display} Distribution")
                                       elif selected_chart_key == 'line':
-                                          fig = create_temporal_chart(analyzer.sequences, interval=interval)
+                                          fig = get_chart('line', interval=interval, budget=point_budget, split_by=split_by)
                                       elif selected_chart_key == 'heatmap':
-                                          fig = create_geographic_heatmap(analyzer.sequences, top_n=top_n_val)
+                                          fig = get_chart('heatmap', top_n=top_n_val)
+                                      elif selected_chart_key == 'map':
+                                          fig = get_chart('map')
                                       elif selected_chart_key == 'stacked':
-                                          fig = create_stacked_bar_chart(analyzer.sequences, category1=field1, category2=field2, top_n=top_n_val)
+                                          fig = get_chart('stacked', category1=field1, category2=field2, top_n=top_n_val, budget=point_budget)
+                                      elif selected_chart_key == 'matrix':
+                                          fig = get_chart('matrix', category1=field1, category2=field2, top_n=top_n_val, budget=point_budget)
 
                                       if fig:
                                            st.session_state.generated_chart = fig # Store figure
@@ -2209,29 +2440,25 @@ def main():
             with col_proc1:
                 st.markdown(f"#### {T('basic_operations')}")
                 if st.button(T("convert_headers_btn"), key="analyze_convert", use_container_width=True, help=T("help_convert_headers")):
-                    with st.spinner(T("converting_headers")):
-                        analyzer.convert_headers()
-                        st.rerun()
+                    submit_analysis_job("convert_headers_btn", "convert_headers")
+                    st.rerun()
 
                 st.markdown(f"#### {T('deduplication')}")
                 if st.button(T("deduplicate_basic_btn"), key="analyze_dedup_basic", use_container_width=True, help=T("help_dedup_basic")):
-                    with st.spinner(T("running_deduplication")):
-                        analyzer.deduplicate_basic()
-                        st.rerun()
+                    submit_analysis_job("deduplicate_basic_btn", "deduplicate_basic")
+                    st.rerun()
 
                 if st.button(T("deduplicate_advanced_btn"), key="analyze_dedup_adv", use_container_width=True, help=T("help_dedup_advanced")):
-                    with st.spinner(T("running_advanced_dedup")):
-                        analyzer.deduplicate_advanced()
-                        st.rerun()
+                    submit_analysis_job("deduplicate_advanced_btn", "deduplicate_advanced")
+                    st.rerun()
 
             with col_proc2:
                 st.markdown(f"#### {T('quality_filter')}")
                 min_len = st.slider(T("min_length_label"), 0, 3000, 200, 50, key="analyze_min_len", help=T("help_min_length"))
                 max_n = st.slider(T("max_n_run_label"), 0, 500, 100, 10, key="analyze_max_n", help=T("help_max_n"))
                 if st.button(T("quality_filter_btn"), key="analyze_quality", use_container_width=True):
-                    with st.spinner(T("applying_quality_filter")):
-                        analyzer.quality_filter(min_length=min_len, max_n_run=max_n)
-                        st.rerun()
+                    submit_analysis_job("quality_filter_btn", "quality_filter", min_length=min_len, max_n_run=max_n)
+                    st.rerun()
 
                 st.markdown(f"#### {T('subtype_operations')}")
                 all_subtypes = ['All'] + sorted(list(set(m.get('type', DEFAULT_UNKNOWN) for _, _, m in st.session_state.active_sequences if m.get('type') != DEFAULT_UNKNOWN)))
@@ -2248,9 +2475,8 @@ def main():
                             targets = [selected_subtype.upper()]
 
                         if targets:
-                            with st.spinner(T("filtering_subtype")):
-                                analyzer.filter_by_subtype(targets)
-                                st.rerun()
+                            submit_analysis_job("filter_subtype_btn", "filter_by_subtype", target_subtypes=targets)
+                            st.rerun()
                         else:
                             st.warning(T("warning_select_subtype"))
 
@@ -2258,7 +2484,7 @@ def main():
                     if st.button(T("check_subtypes_btn"), key="analyze_subtype_check", use_container_width=True):
                         dist_counts = analyzer.get_subtype_distribution()
                         if dist_counts:
-                            fig = create_distribution_chart(dist_counts, "distribution_title", st.session_state.lang, chart_type='pie')
+                            fig = get_chart('pie', field='type', title="distribution_title")
                             st.plotly_chart(fig, use_container_width=True)
                         else:
                             st.warning(T("warning_no_subtype_info"))
@@ -2270,7 +2496,58 @@ def main():
         if not st.session_state.active_sequences:
             st.warning(T("no_data_msg"))
         else:
-            analyzer = SequenceAnalyzer(st.session_state.active_sequences)
+            analyzer = SequenceAnalyzer(st.session_state.active_sequences, on_event=progress_tracker.log_event)
+
+            st.subheader(T("query_filter_header"))
+            query_text = st.text_input(T("query_label"), key="refine_query", placeholder=T("query_placeholder"))
+            st.caption(T("query_help"))
+            if st.button(T("query_filter_btn"), key="refine_query_apply", disabled=not query_text.strip()):
+                try:
+                    Query(query_text).check_fields(analyzer.sequences)  # Shown here rather than as a failed job
+                except QueryError as e:
+                    st.error(T("query_invalid").format(error=e))
+                else:
+                    submit_analysis_job("query_filter_btn", "filter_by_query", query=query_text)
+                    st.rerun()
+
+            st.markdown("---")
+
+            st.subheader(T("similar_header"))
+            similar_query = st.text_area(T("similar_query_label"), key="refine_similar_query", height=100,
+                                         placeholder=T("similar_query_placeholder"))
+            similar_cols = st.columns([1, 1, 1])
+            with similar_cols[0]:
+                similar_top = st.number_input(T("similar_top_label"), min_value=1, max_value=100000, value=50,
+                                              step=10, key="refine_similar_top")
+            with similar_cols[1]:
+                find_similar = st.button(T("similar_find_btn"), key="refine_similar_find", disabled=not similar_query.strip())
+            with similar_cols[2]:
+                if st.button(T("similar_keep_btn"), key="refine_similar_keep", disabled=not similar_query.strip()):
+                    submit_analysis_job("similar_keep_btn", "filter_similar", query=similar_query, top_n=int(similar_top))
+                    st.rerun()
+            if find_similar:
+                with st.spinner(T("similar_building")):
+                    sketch_size = analyzer.query_sketch_size(similar_query)
+                    nearest = analyzer.nearest_sequences(similar_query, int(similar_top)) if sketch_size else None
+                if not sketch_size:
+                    st.warning(T("similar_query_short"))
+                elif nearest.empty:
+                    st.info(T("similar_none"))
+                else:
+                    st.dataframe(nearest.drop(columns='Position'), use_container_width=True, hide_index=True)
+
+            motif_cols = st.columns([2, 1])
+            with motif_cols[0]:
+                motif = st.text_input(T("motif_label"), key="refine_motif")
+            with motif_cols[1]:
+                motif_mode = st.radio(T("motif_label"), [T("motif_mode_keep"), T("motif_mode_drop")],
+                                      key="refine_motif_mode", label_visibility="collapsed")
+            if st.button(T("motif_filter_btn"), key="refine_motif_apply", disabled=not motif.strip()):
+                submit_analysis_job("motif_filter_btn", "filter_by_motif", motif=motif,
+                                    exclude=motif_mode == T("motif_mode_drop"))
+                st.rerun()
+
+            st.markdown("---")
 
             st.subheader(T("clade_monthly_header"))
             available_clades = sorted([c for c in list(set(m.get('clade', DEFAULT_UNKNOWN) for _, _, m in analyzer.sequences)) if c != DEFAULT_UNKNOWN])
@@ -2301,14 +2578,14 @@ def main():
 
                 if st.button(T("apply_clade_filter_button"), key="refine_clade_apply", disabled=not targets):
                     if targets:
-                        with st.spinner(T("applying_clade_filter")):
-                            analyzer.filter_clade_monthly(
-                                mode=clade_mode,
-                                targets=targets,
-                                keep_strategy=keep_strategy,
-                                separate=separate
-                            )
-                            st.rerun()
+                        submit_analysis_job(
+                            "apply_clade_filter_button", "filter_clade_monthly",
+                            mode=clade_mode,
+                            targets=targets,
+                            keep_strategy=keep_strategy,
+                            separate=separate
+                        )
+                        st.rerun()
                     else:
                         st.warning(T("warning_select_clade"))
 
@@ -2355,19 +2632,134 @@ def main():
 
             if st.button(T("apply_temporal_filter_button"), key="refine_temp_apply"):
                 custom_grouping_list = [f.strip() for f in custom_grouping_input.split(',')] if group_by_val == "custom" and custom_grouping_input else None
-                with st.spinner(T("applying_temporal_filter")):
-                    analyzer.enhanced_temporal_filter(
-                        group_by=group_by_val,
-                        sort_by=sort_by_val,
-                        keep_per_group=keep_per_group_val,
-                        custom_grouping=custom_grouping_list
-                    )
-                    st.rerun()
+                submit_analysis_job(
+                    "apply_temporal_filter_button", "enhanced_temporal_filter",
+                    group_by=group_by_val,
+                    sort_by=sort_by_val,
+                    keep_per_group=keep_per_group_val,
+                    custom_grouping=custom_grouping_list
+                )
+                st.rerun()
+
+            st.markdown("---")
+            st.subheader(T("diversity_header"))
+            st.caption(T("diversity_desc"))
+            diversity_cols = st.columns([2, 1])
+            with diversity_cols[0]:
+                diversity_group_display = st.selectbox(T("group_by_label"), list(group_options.keys()), index=3,
+                                                       key="refine_diversity_group")
+                diversity_group = group_options[diversity_group_display]
+            with diversity_cols[1]:
+                diversity_per_group = st.number_input(T("diversity_per_group_label"), min_value=1, max_value=10000,
+                                                      value=5, step=1, key="refine_diversity_per_group")
+            diversity_custom_input = ""
+            if diversity_group == "custom":
+                diversity_custom_input = st.text_input(T("custom_grouping_label"), key="refine_diversity_custom",
+                                                       placeholder=T("custom_grouping_placeholder"))
+            if st.button(T("diversity_btn"), key="refine_diversity_apply"):
+                diversity_custom = ([f.strip() for f in diversity_custom_input.split(',') if f.strip()]
+                                    if diversity_group == "custom" and diversity_custom_input else None)
+                submit_analysis_job("diversity_btn", "diversity_filter", group_by=diversity_group,
+                                    per_group=int(diversity_per_group), custom_grouping=diversity_custom)
+                st.rerun()
+
+            st.markdown("---")
+            st.subheader(T("sample_header"))
+            st.caption(T("sample_desc"))
+            sample_mode_options = {T("sample_mode_random"): "random", T("sample_mode_per_stratum"): "per_stratum",
+                                   T("sample_mode_proportional"): "proportional"}
+            sample_field_options = {
+                T("vis_field_location"): 'location', T("vis_field_month"): 'month', T("vis_field_year"): 'year',
+                T("vis_field_host"): 'host', T("vis_field_clade"): 'clade', T("vis_field_subtype"): 'type',
+                T("vis_field_segment"): 'segment'
+            }
+            sample_mode = sample_mode_options[st.radio(T("mode_label"), list(sample_mode_options.keys()),
+                                                       key="refine_sample_mode", horizontal=True)]
+            sample_cols = st.columns([2, 1, 1])
+            with sample_cols[0]:
+                sample_strata = st.multiselect(T("sample_strata_label"), list(sample_field_options.keys()),
+                                               default=[T("vis_field_location"), T("vis_field_month")],
+                                               key="refine_sample_strata", disabled=sample_mode == "random")
+            with sample_cols[1]:
+                sample_size = st.number_input(T("sample_size_per_stratum") if sample_mode == "per_stratum"
+                                              else T("sample_size_total"), min_value=1, value=10 if sample_mode == "per_stratum" else 1000,
+                                              step=1, key=f"refine_sample_size_{sample_mode}")
+            with sample_cols[2]:
+                sample_seed = st.number_input(T("sample_seed_label"), min_value=0, value=0, step=1,
+                                              key="refine_sample_seed", help=T("sample_seed_help"))
+            if st.button(T("sample_btn"), key="refine_sample_apply"):
+                if sample_mode == "random":
+                    submit_analysis_job("sample_btn", "random_sample", size=int(sample_size), seed=int(sample_seed))
+                else:
+                    size_param = {"per_stratum": int(sample_size)} if sample_mode == "per_stratum" else {"total": int(sample_size)}
+                    submit_analysis_job("sample_btn", "stratified_sample", seed=int(sample_seed),
+                                        strata=[sample_field_options[f] for f in sample_strata], **size_param)
+                st.rerun()
+
+            st.markdown("---")
+            st.subheader(T("consensus_header"))
+            st.caption(T("consensus_desc"))
+            consensus_field_options = {
+                T("vis_field_clade"): 'clade', T("vis_field_month"): 'month', T("vis_field_year"): 'year',
+                T("vis_field_location"): 'location', T("vis_field_host"): 'host', T("vis_field_subtype"): 'type',
+                T("vis_field_segment"): 'segment'
+            }
+            consensus_cols = st.columns([2, 1, 1])
+            with consensus_cols[0]:
+                consensus_groups = st.multiselect(T("consensus_group_label"), list(consensus_field_options.keys()),
+                                                  key="refine_consensus_group")
+            with consensus_cols[1]:
+                consensus_min = st.number_input(T("consensus_min_label"), min_value=1, value=2, step=1,
+                                                key="refine_consensus_min")
+            with consensus_cols[2]:
+                consensus_fraction = st.number_input(T("consensus_fraction_label"), min_value=0.0, max_value=1.0,
+                                                     value=0.0, step=0.05, key="refine_consensus_fraction",
+                                                     help=T("consensus_fraction_help"))
+            if st.button(T("consensus_btn"), key="refine_consensus_run"):
+                with st.spinner(T("consensus_running")):
+                    profiles = profile_groups(analyzer.sequences, [consensus_field_options[g] for g in consensus_groups],
+                                              min_records=int(consensus_min))
+                st.session_state.consensus_result = {"version": st.session_state.active_version, "profiles": profiles}
+
+            consensus_result = st.session_state.get("consensus_result")
+            if consensus_result and consensus_result["version"] == st.session_state.active_version:
+                profiles = consensus_result["profiles"]
+                if not profiles:
+                    st.info(T("consensus_none"))
+                else:
+                    summary = variability_summary(profiles).rename(columns={
+                        "Group": T("consensus_col_group"), "Sequences": T("merge_col_records"),
+                        "Columns": T("consensus_col_columns"), "Equal Length": T("consensus_col_equal"),
+                        "Mean Entropy": T("consensus_col_entropy"), "Variable Sites": T("consensus_col_variable")})
+                    st.dataframe(summary, use_container_width=True, hide_index=True)
+                    plot_group = st.selectbox(T("consensus_plot_group"), list(profiles.keys()),
+                                              key="refine_consensus_plot_group")
+                    site_frame = profiles[plot_group].frame()
+                    fig = px.line(site_frame, x='Position', y='Entropy',
+                                  title=T("consensus_entropy_title").format(group=plot_group),
+                                  labels={'Position': T("consensus_position"), 'Entropy': T("consensus_entropy_axis")})
+                    fig.update_layout(margin=dict(t=50, b=20, l=20, r=20), paper_bgcolor='rgba(0,0,0,0)',
+                                      plot_bgcolor='rgba(0,0,0,0)')
+                    st.plotly_chart(fig, use_container_width=True)
+                    download_cols = st.columns(2)
+                    with download_cols[0]:
+                        st.download_button(T("consensus_download_fasta"),
+                                           data=consensus_fasta(profiles, min_fraction=consensus_fraction),
+                                           file_name="consensus.fasta", mime="text/plain",
+                                           key="refine_consensus_fasta", use_container_width=True)
+                    with download_cols[1]:
+                        st.download_button(T("consensus_download_sites"),
+                                           data=site_frame.to_csv(sep='\t', index=False),
+                                           file_name="site_variability.tsv", mime="text/tab-separated-values",
+                                           key="refine_consensus_sites", use_container_width=True)
 
             st.markdown("---")
             st.subheader(T("extract_accessions_btn"))
-            if st.button(T("extract_accessions_btn"), key="refine_extract"):
-                accessions = analyzer.extract_accessions()
+            accession_kinds = st.multiselect(T("accession_kinds_label"), list(ACCESSION_KINDS),
+                                             default=list(ACCESSION_KINDS[:2]), key="refine_accession_kinds",
+                                             format_func=lambda kind: T(f"accession_kind_{kind}"))
+            if st.button(T("extract_accessions_btn"), key="refine_extract", disabled=not accession_kinds):
+                accessions = analyzer.extract_accessions(accession_kinds)
                 if accessions:
                     st.session_state.accession_list = accessions
                     st.success(T("accessions_found").format(count=len(accessions), tab=T('export_tab')))
@@ -2375,6 +2767,27 @@ def main():
                 else:
                     st.warning(T("no_accessions_found"))
 
+            st.markdown("---")
+            st.subheader(T("list_filter_header"))
+            list_field_options = {T(f"list_field_{field}"): field for field in LIST_FILTER_FIELDS}
+            list_field = list_field_options[st.selectbox(T("list_field_label"), list(list_field_options), key="refine_list_field")]
+            id_text = st.text_area(T("list_values_label"), key="refine_list_values", height=120)
+            id_file = st.file_uploader(T("list_upload_label"), type=["txt", "csv", "tsv"], key="refine_list_file")
+            per_line = list_field != 'accession'  # Names may contain spaces
+            id_list = parse_id_list(id_text, per_line)
+            if id_file is not None:
+                id_list += parse_id_list(id_file.getvalue().decode('utf-8', errors='replace'), per_line)
+            acc_cols = st.columns([2, 1])
+            with acc_cols[0]:
+                list_mode = st.radio(T("list_filter_header"), [T("list_mode_keep"), T("list_mode_drop")],
+                                     horizontal=True, key="refine_list_mode", label_visibility="collapsed")
+            with acc_cols[1]:
+                st.caption(T("list_values_count").format(count=len(id_list)))
+            if st.button(T("list_filter_btn"), key="refine_list_apply", disabled=not id_list):
+                submit_analysis_job("list_filter_btn", "filter_by_list", values=id_list, field=list_field,
+                                    exclude=list_mode == T("list_mode_drop"))
+                st.rerun()
+
     # ==================== TAB 5: EXPORT & REPORTS ====================
     with tab_map["export_tab"]:
         st.header(T("export_tab"))
@@ -2399,11 +2812,7 @@ def main():
             if st.session_state.active_sequences:
                 try:
                     fasta_str_io = io.StringIO()
-                    for header, seq, _ in st.session_state.active_sequences:
-                        h = header if isinstance(header, str) else str(header or '')
-                        h = h if h.startswith('>') else '>' + h
-                        s = seq if isinstance(seq, str) else str(seq or '')
-                        fasta_str_io.write(f"{h}\n{s}\n")
+                    write_fasta(st.session_state.active_sequences, fasta_str_io)
 
                     st.download_button(
                         label=f"{T('download_active_button')} ({len(st.session_state.active_sequences)} {T('seqs_abbrev')})",
@@ -2468,16 +2877,40 @@ def main():
         |                     | Deduplication (Advanced)    | Remove duplicates, keeping one per subtype for each unique sequence.   | Click 'Deduplicate (Seq + Subtype)'. Maintains subtype diversity.                                                                   |
         |                     | Subtype Filter              | Isolate sequences of specific subtypes (e.g., H5N1).                     | Select from dropdown or enter custom subtypes (comma-sep), then click 'Apply Subtype Filter'.                                     |
         |                     | Check Subtypes              | Understand subtype proportions in the active dataset.                    | Click 'Check Subtype Distribution'. Displays Pie/Bar charts below.                                                                |
+        |                     | Browse Records              | Look through the active records without exporting them.                  | Open 'Browse Records', search (text, accession or query), pick a sort field and page through the table.                           |
         |                     | Data Visualizer             | Explore distributions (hosts, locations, time, etc.).                    | Select field and chart type (Bar/Pie/Line/Heatmap/Stacked) in the expander, click 'Generate Chart'.                                |
-        | **🎯 Refine & Visualize**| Clade Monthly Filter      | Subsample data to get representatives per clade per month.               | Select mode (Single/Multiple), choose clade(s), 'Keep' strategy (First/Last/Both), then click 'Apply'.                            |
+        | **🎯 Refine & Visualize**| Query Filter                | Combine conditions on any metadata, date, length or GC in one filter.    | Type a query such as `host == chicken and date >= 2023-01 and location in [Egypt, China]`, click 'Apply Query'.                   |
+        |                     | Similarity & Motif Search   | Find the sequences most similar to a query, or those containing a motif. | Paste a sequence, set the number of matches, click 'Find Similar' (table) or 'Keep Most Similar'; enter a motif and click 'Apply Motif Filter'. |
+        |                     | Clade Monthly Filter      | Subsample data to get representatives per clade per month.               | Select mode (Single/Multiple), choose clade(s), 'Keep' strategy (First/Last/Both), then click 'Apply'.                            |
         |                     | Enhanced Temporal Filter    | Subsample based on flexible time/metadata grouping.                      | Configure 'Group By', 'Sort By', 'Keep' options, then click 'Apply'. Useful for representative sampling over time/location etc. |
-        |                     | Extract Accessions          | Get a list of GISAID EPI_ISL IDs.                                        | Click 'Extract EPI_ISL Accessions'. A download button appears in the **Export** tab.                                               |
+        |                     | Diversity Sampling          | Keep the most diverse representatives of each group.                     | Choose 'Group By' and the number of representatives per group, click 'Apply Diversity Sampling'.                                   |
+        |                     | Random Subsampling          | Draw a fair, reproducible subset for charts or sharing.                  | Pick Random, N per stratum or Proportional, choose strata (e.g. Location + Month), size and seed, click 'Apply Subsampling'.      |
+        |                     | Consensus & Variability     | Consensus sequence and per-site entropy for each clade, month, location... | Choose group fields and the minimum group size, click 'Compute Consensus'; plot a group's entropy and download the consensus FASTA. |
+        |                     | Extract Accessions          | Get GISAID (EPI_ISL/EPI) or GenBank accession IDs.                       | Pick the accession types, click 'Extract Accessions'. A download button appears in the **Export** tab.                             |
+        |                     | ID / Name List Filter       | Keep or remove records named in a list of accessions, isolate names or IDs. | Choose what to match, paste values or upload a .txt/.csv file, pick 'Keep listed' or 'Remove listed', click 'Apply List Filter'.  |
         | **📊 Export & Reports** | Export FASTA / Report / Log | Download results, reports, and session logs.                           | Click download buttons for the current active FASTA, the last generated report, or the full session log.                              |
 
         ### Tips
         - **Activation is Key**: Only sequences from *activated* datasets (in the Manage tab) are used for analysis and refinement.
-        - **Large Files**: Processing large files can take time. Use the spinners/progress bars as indicators.
-        - **Caching**: Parsing is cached; re-uploading the same file content should be faster.
+        - **Large Files**: Processing steps run as background jobs. Their progress appears under the title; you can keep working, queue further steps (each runs on the previous step's output) or cancel a job.
+        - **Caching**: Parsed files are shared between sessions by content, so re-uploading the same file is instant and costs no extra memory. Filtering only narrows a selection over those shared records. Generated charts are cached for the current dataset, so switching back to a chart you already built is instant.
+        - **Larger-than-RAM Data**: Very large files are kept in an on-disk workspace and read on demand. Workspaces written by `fasta_batch.py --workspace` can be opened directly with the Google Drive/path loader.
+        - **Segment Partitions**: `fasta_batch.py --workspace DIR --partition-by segment` (or `segment,type`) stores one partition per segment. Opening DIR loads each partition as its own dataset named `DIR [HA]`, `DIR [NA]`, ...; activate one and every filter, dedup and chart reads only that partition. The Manage tab lists record counts, date ranges and lengths per partition.
+        - **Record Browser**: Only the visible page of records is read and sent to the browser, so it stays quick on datasets of a million records or more. Searches and sorts run on the stored columns; the first search of a dataset builds its columns (a few seconds for a million in-memory records), later ones take milliseconds.
+        - **Query Filter**: A query is checked before it runs and then evaluated over the stored metadata columns in one pass, so `host == chicken and date >= 2023-01` takes well under a second even on a million records. Dates given as `2023` or `2023-04` cover the whole year or month; records without a date only match `!=` and `not in` date conditions.
+        - **Similarity Search**: The first search indexes short k-mer samples of every active sequence on all CPU cores; later searches (and filtered subsets) reuse the index and answer in milliseconds. Identity is estimated from shared k-mers, so treat it as a ranking aid rather than an alignment result. Motif searches only read sequences that pass a k-mer pre-screen.
+        - **Diversity Sampling**: Representatives are picked one at a time, each the sequence farthest from those already picked, so a group costs a few distance passes per representative rather than a full distance matrix. Groups above 10,000 sequences are thinned evenly first, and groups run in parallel.
+        - **Subsampling**: Each record gets a pseudo-random key from its position and the seed, and the records with the smallest keys are kept, so a seed always draws the same records from the same data, and `fasta_batch.py` steps `random_sample` / `stratified_sample` (with `per_stratum`) draw the same ones as the app in a single pass.
+        - **Consensus**: Sequences are counted site by site in blocks of a few thousand, so a 50,000 × 1,700 bp HA set takes about a second. Sequences should be aligned; shorter ones are treated as ending early, and groups whose lengths differ are flagged in the 'Equal Length' column. Gap-majority sites are left out of the consensus FASTA.
+        - **Date Filters**: Each dataset keeps its records sorted by collection date (workspaces store the order on disk). Date conditions in queries, the temporal and clade monthly filters and the epidemic curve read that order instead of re-sorting, and it carries over to the result of every filter.
+        - **ID and Name Lists**: Accessions (EPI_ISL, EPI and GenBank/RefSeq) are read from the headers once per active dataset, so filtering by a list of 100,000 IDs is a single lookup. Isolate name and ID lists are matched against the stored columns in one pass. Case and GenBank version suffixes (.1, .2) are ignored, and values not found are listed in the report.
+        - **Overlapping Exports**: 'Merge Selected' (Manage tab) activates several files as one dataset and drops sequences already seen in an earlier file. The merge report shows how many sequences each pair of files shares and offers a provenance table listing the files each kept sequence appeared in.
+        - **Growing Datasets**: 'Append to Active' (Manage tab) adds newly loaded files to the current active dataset without redoing the filters already applied; with duplicate skipping on, only the new sequences are checked against the active ones. `fasta_batch.py --append --workspace DIR` does the same for a workspace.
+        - **Large Charts**: Charts are reduced before they reach the browser: rare categories are grouped as 'Other', long time spans switch to coarser periods (or pick 'Auto'), and the 'Max points per chart' slider sets the limit.
+        - **Epidemic Curves**: The temporal line chart includes periods with zero sequences and can be split by subtype, clade, host, location or segment to draw one line per value.
+        - **Two-Category Charts**: 'Stacked Bar' and 'Heatmap (Two Categories)' count any pair of fields (including year or month) in a single pass; records where either field is Unknown are left out.
+        - **Header Formats**: GISAID EpiFlu, NCBI Virus/GenBank, the Vir-Seq-Sift pipe format and plain isolate names are recognized automatically per file; files mixing formats are read header by header.
+        - **Locations**: Location names are matched to countries with a built-in offline gazetteer (country names, common spellings, states and provinces). 'Map (Countries)' colours each country by sequence count; locations it cannot match are counted below the map.
         - **Session Data**: All work is stored in your browser session and will be lost if you close the tab or refresh without uploading again. Use the Export tab to save results.
         """)
 
@@ -2486,5 +2919,10 @@ def main():
 
     gc.collect()
 
+    # Without st.fragment, poll running jobs by rerunning the whole script
+    if jobs_active and not hasattr(st, "fragment"):
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_batch.py
+
+Headless batch pipeline for Vir-Seq-Sift. Runs the Analyze/Refine operations
+from a YAML/JSON pipeline spec over any number of FASTA files and writes the
+surviving sequences, a metadata table and a report, without a browser.
+
+Files are streamed in fixed-size record chunks: parsing and stateless steps
+run in a process pool, stateful steps (dedup, temporal/clade filters) keep
+only compact per-key state, so memory stays flat regardless of input size.
+
+Usage:
+    python fasta_batch.py "dumps/*.fasta.gz" --pipeline nightly.yaml --output-dir out/
+
+Example pipeline (YAML):
+    steps:
+      - op: convert_headers
+      - op: quality_filter
+        min_length: 200
+        max_n_run: 100
+      - op: deduplicate_basic
+      - op: enhanced_temporal_filter
+        group_by: location_host
+        keep_per_group: both
+
+Header layouts are detected per file; a spec may add in-house layouts and/or
+force one with `header_schema`:
+    header_schema: lab_export
+    header_schemas:
+      - name: lab_export
+        separator: ";"
+        fields: [isolate_id, type, collection_date, location, host]
+        detect: "^LAB\\d+;"
+
+With `--append --workspace DIR`, new files are added to an existing workspace
+(and the FASTA/TSV outputs are appended to): dedup steps start from the
+workspace's stored sequence digests, so only incoming records are hashed
+and filtered.
+
+`--partition-by segment` (or `segment,type`) writes the workspace as one
+partition per segment (and subtype), which the app opens as separate
+datasets; appending to a partitioned workspace routes records the same way.
+
+Naming an `overlap` file under `outputs` writes a matrix of the unique
+sequences each pair of input files shares (counted on parsed records, before
+any step).
+"""
+
+import argparse
+import csv
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from fasta_engine import (DEFAULT_UNKNOWN, HEADER_SCHEMAS, DeduplicateStream, FastaParser, HeaderSchema,
+                          build_stream_operation, iter_fasta_records, read_host_list, register_schema,
+                          sample_headers, sequence_digest, write_fasta)
+from fasta_merge import DatasetMerge
+from fasta_store import PartitionedWorkspaceWriter, WorkspaceWriter, is_partitioned_workspace, is_workspace
+
+# --- Optional YAML support for pipeline specs ---
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+# ==================== CONSTANTS ====================
+DEFAULT_CHUNK_SIZE = 5000  # Records per worker task
+PROGRESS_INTERVAL = 5.0  # Seconds between progress lines
+FASTA_EXTENSIONS = ('.fasta', '.fas', '.fa', '.fna', '.txt')
+METADATA_COLUMNS = ['header', 'isolate_name', 'type', 'segment', 'collection_date',
+                    'isolate_id', 'clade', 'host', 'location', 'length']
+
+
+# ==================== PIPELINE SPEC ====================
+def load_pipeline_spec(path):
+    """Load a pipeline spec. Accepts {"steps": [...], "outputs": {...}} or a bare list of steps."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.lower().endswith(('.yaml', '.yml')):
+        if not YAML_AVAILABLE:
+            raise ValueError("PyYAML is not installed; use a JSON pipeline spec or `pip install pyyaml`.")
+        spec = yaml.safe_load(text)
+    else:
+        spec = json.loads(text)
+
+    if isinstance(spec, list):
+        spec = {'steps': spec}
+    if not isinstance(spec, dict) or not isinstance(spec.get('steps'), list):
+        raise ValueError("Pipeline spec must be a list of steps or a mapping with a 'steps' list.")
+    for step in spec['steps']:
+        if not isinstance(step, dict) or 'op' not in step:
+            raise ValueError(f"Each pipeline step needs an 'op' key: {step!r}")
+        build_stream_operation(step)  # Validate names and parameters up front
+    schemas = spec.setdefault('header_schemas', [])
+    if not isinstance(schemas, list):
+        raise ValueError("'header_schemas' must be a list of schema mappings.")
+    names = set(HEADER_SCHEMAS) | {HeaderSchema.from_dict(schema).name for schema in schemas}
+    if spec.setdefault('header_schema', 'auto') not in names | {'auto'}:
+        raise ValueError(f"Unknown header_schema '{spec['header_schema']}'. Known: {', '.join(sorted(names))}")
+    spec.setdefault('outputs', {})
+    return spec
+
+
+def expand_inputs(patterns):
+    """Expand input globs into a sorted, de-duplicated list of FASTA files."""
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True) or ([pattern] if os.path.isfile(pattern) else [])
+        for path in matches:
+            name = path.lower()[:-3] if path.lower().endswith('.gz') else path.lower()
+            if os.path.isfile(path) and name.endswith(FASTA_EXTENSIONS) and path not in paths:
+                paths.append(path)
+    return sorted(paths)
+
+
+def open_text(path, mode='rt'):
+    """Open a plain or gzip-compressed text file."""
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8', errors='replace')
+    return open(path, mode, encoding='utf-8', errors='replace')
+
+
+# ==================== CHUNKED PROCESSING ====================
+def iter_raw_chunks(paths, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (path, lines, n_bytes) chunks holding at most `chunk_size` complete records."""
+    for path in paths:
+        lines = []
+        n_records = 0
+        n_bytes = 0
+        with open_text(path) as handle:
+            for line in handle:
+                if line.startswith('>'):
+                    if n_records >= chunk_size:
+                        yield path, lines, n_bytes
+                        lines, n_records, n_bytes = [], 0, 0
+                    n_records += 1
+                lines.append(line)
+                n_bytes += len(line)
+        if lines:
+            yield path, lines, n_bytes
+
+
+_parsers = {}
+
+
+def get_parser(extra_hosts=(), schema='auto', schema_specs=()):
+    """FastaParser reused across chunks in this process, so its memos and compiled schemas stay warm.
+
+    `schema_specs` (header schema mappings) are registered first, so
+    worker processes know the spec's in-house layouts.
+    """
+    key = (tuple(extra_hosts), schema, json.dumps(schema_specs, sort_keys=True))
+    if key not in _parsers:
+        for spec in schema_specs:
+            register_schema(HeaderSchema.from_dict(spec), first=True)
+        _parsers[key] = FastaParser(extra_hosts=key[0], schema=schema)
+    return _parsers[key]
+
+
+def _process_chunk(path, lines, step_specs, parser_args=((), 'auto', ()), with_digests=False, schema=None):
+    """Worker task: parse a chunk and run the stateless pipeline prefix on it.
+
+    `schema` is the header schema detected for the chunk's file (see
+    iter_file_chunks). With `with_digests`, also returns the sequence
+    digests of every parsed record (for the file overlap matrix).
+    """
+    errors = []
+    records = list(iter_fasta_records(lines, parser=get_parser(*parser_args), errors=errors, schema=schema))
+    n_parsed = len(records)
+    digests = None
+    if with_digests:
+        digests = np.fromiter((sequence_digest(r[1]) for r in records), dtype=np.int64, count=n_parsed)
+    step_stats = []
+    for step in step_specs:
+        op = build_stream_operation(step)
+        start = time.perf_counter()
+        seen = len(records)
+        records = [r for r in map(op.feed, records) if r is not None]
+        step_stats.append((seen, len(records), time.perf_counter() - start))
+    errors = [f"{os.path.basename(path)}: {err}" for err in errors]
+    return records, n_parsed, step_stats, errors, digests
+
+
+class StepStats:
+    """Per-step counters for the batch report."""
+    def __init__(self, name):
+        self.name = name
+        self.seen = 0
+        self.kept = 0
+        self.seconds = 0.0
+
+
+class BatchRunner:
+    """Run a pipeline spec over FASTA files and stream results to writers.
+
+    With `track_overlap`, the digests of all parsed records go through a
+    DatasetMerge (`self.merge`), which reports how many sequences each pair
+    of input files shares.
+    """
+    def __init__(self, step_specs, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=True, extra_hosts=(),
+                 header_schema='auto', header_schemas=(), track_overlap=False):
+        self.step_specs = step_specs
+        self.parser_args = (tuple(extra_hosts), header_schema, tuple(header_schemas))
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.ops = [build_stream_operation(step) for step in step_specs]
+        self.stats = [StepStats(op.name) for op in self.ops]
+
+        # Stateless steps before the first stateful one run inside the workers
+        self.n_worker_steps = 0
+        if self.workers > 1:
+            for op in self.ops:
+                if not op.stateless:
+                    break
+                self.n_worker_steps += 1
+
+        self.merge = DatasetMerge() if track_overlap else None
+        self.records_parsed = 0
+        self.records_existing = None
+        self.records_written = 0
+        self.bytes_read = 0
+        self.errors = []
+        self.files = []
+        self.elapsed = 0.0
+
+    def incremental_blockers(self):
+        """Names of steps that cannot be applied to new records alone (group-wise first/last filters, samples)."""
+        return [op.name for op in self.ops if not op.stateless and not isinstance(op, DeduplicateStream)]
+
+    def seed(self, records):
+        """Start dedup steps from existing records (e.g. the workspace being appended to)."""
+        self.records_existing = len(records)
+        for op in self.ops:
+            if isinstance(op, DeduplicateStream):
+                op.seed(records)
+
+    def _push(self, records, start):
+        """Feed records through the main-process steps from index `start`."""
+        for i in range(start, len(self.ops)):
+            op, stats = self.ops[i], self.stats[i]
+            t0 = time.perf_counter()
+            stats.seen += len(records)
+            records = [r for r in map(op.feed, records) if r is not None]
+            stats.kept += len(records)
+            stats.seconds += time.perf_counter() - t0
+            if not records:
+                break
+        return records
+
+    def _collect(self, path, result, sink):
+        records, n_parsed, step_stats, errors, digests = result
+        if self.merge is not None:
+            self.merge.add(path, digests)
+        self.records_parsed += n_parsed
+        self.errors.extend(errors)
+        for stats, (seen, kept, seconds) in zip(self.stats, step_stats):
+            stats.seen += seen
+            stats.kept += kept
+            stats.seconds += seconds
+        out = self._push(records, self.n_worker_steps)
+        self.records_written += len(out)
+        sink(out)
+
+    def _report_progress(self, start, force=False):
+        now = time.time()
+        if self.progress and (force or now - self._last_progress >= PROGRESS_INTERVAL):
+            elapsed = max(now - start, 1e-9)
+            print(f"[batch] {self.records_parsed:,} records | {self.bytes_read / 1e6:,.1f} MB read | "
+                  f"{self.records_written:,} kept | {self.records_parsed / elapsed:,.0f} rec/s",
+                  file=sys.stderr, flush=True)
+            self._last_progress = now
+
+    def iter_file_chunks(self):
+        """Yield (path, lines, n_bytes, schema) chunks of self.files.
+
+        The header schema is detected once per file, from the first chunk,
+        and handed to every chunk task of that file, as the app does per file.
+        """
+        parser = get_parser(*self.parser_args)
+        schemas = {}
+        for path, lines, n_bytes in iter_raw_chunks(self.files, self.chunk_size):
+            if path not in schemas:
+                schemas[path] = parser.file_schema(sample_headers(lines))
+            yield path, lines, n_bytes, schemas[path]
+
+    def run(self, paths, sink):
+        """Process `paths`, calling `sink(records)` with each batch of surviving records."""
+        start = time.time()
+        self._last_progress = start
+        self.files = list(paths)
+        worker_specs = self.step_specs[:self.n_worker_steps]
+        with_digests = self.merge is not None
+        chunks = self.iter_file_chunks()
+
+        if self.workers > 1:
+            # Bounded window of in-flight chunks keeps memory flat
+            max_pending = self.workers * 2
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                pending = deque()
+                for path, lines, n_bytes, schema in chunks:
+                    self.bytes_read += n_bytes
+                    pending.append((path, pool.submit(_process_chunk, path, lines, worker_specs, self.parser_args,
+                                                      with_digests, schema)))
+                    if len(pending) >= max_pending:
+                        path, future = pending.popleft()
+                        self._collect(path, future.result(), sink)
+                        self._report_progress(start)
+                while pending:
+                    path, future = pending.popleft()
+                    self._collect(path, future.result(), sink)
+                    self._report_progress(start)
+        else:
+            for path, lines, n_bytes, schema in chunks:
+                self.bytes_read += n_bytes
+                self._collect(path, _process_chunk(path, lines, [], self.parser_args, with_digests, schema), sink)
+                self._report_progress(start)
+
+        # Stateful steps release their held records in pipeline order
+        for i, op in enumerate(self.ops):
+            t0 = time.perf_counter()
+            flushed = op.flush()
+            self.stats[i].kept += len(flushed)
+            self.stats[i].seconds += time.perf_counter() - t0
+            out = self._push(flushed, i + 1)
+            self.records_written += len(out)
+            sink(out)
+
+        self.elapsed = time.time() - start
+        self._report_progress(start, force=True)
+
+    def report(self, pipeline_name=""):
+        """Plain-text run report with per-step counts and timings."""
+        rate = self.records_parsed / self.elapsed if self.elapsed else 0.0
+        lines = [
+            "Vir-Seq-Sift Batch Report",
+            f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Pipeline: {pipeline_name}",
+            f"Input Files: {len(self.files)}",
+            f"Workers: {self.workers} (chunk size {self.chunk_size})",
+            f"Records Parsed: {self.records_parsed}",
+            f"Parser Issues: {len(self.errors)}",
+        ]
+        if self.records_existing is not None:
+            lines.append(f"Appended To: {self.records_existing} existing records")
+        lines += [
+            "",
+            f"{'Step':<60} {'In':>10} {'Out':>10} {'Removed':>10} {'Time (s)':>9}",
+        ]
+        for i, stats in enumerate(self.stats, start=1):
+            lines.append(f"{f'{i}. {stats.name}':<60} {stats.seen:>10} {stats.kept:>10} "
+                         f"{stats.seen - stats.kept:>10} {stats.seconds:>9.2f}")
+        lines += [
+            "",
+            f"Final Count: {self.records_written}",
+            f"Wall Time: {self.elapsed:.2f}s ({rate:,.0f} records/s, {self.bytes_read / 1e6:,.1f} MB)",
+        ]
+        if self.merge is not None:
+            overlap = self.merge.overlap()
+            overlap.index = overlap.columns = [os.path.basename(path) for path in overlap.columns]
+            lines += ["", "File Overlap (unique sequences shared):", overlap.to_string()]
+        if self.errors:
+            lines += ["", "Parser Issues (sample):"] + self.errors[:20] + (["..."] if len(self.errors) > 20 else [])
+        lines += ["", "Input Files:"] + self.files
+        return "\n".join(lines)
+
+
+# ==================== OUTPUT ====================
+def metadata_row(record):
+    """Flatten a record into the METADATA_COLUMNS layout."""
+    header, seq, metadata = record
+    date_val = metadata.get('collection_date')
+    row = [header] + [metadata.get(col, DEFAULT_UNKNOWN) for col in METADATA_COLUMNS[1:-1]] + [len(seq)]
+    row[METADATA_COLUMNS.index('collection_date')] = date_val.strftime('%Y-%m-%d') if date_val else ""
+    return row
+
+
+def open_workspace_writer(path, partition_fields=None, append=False):
+    """Writer for the --workspace output: partitioned when asked to or when appending to a partitioned one."""
+    if partition_fields or (append and is_partitioned_workspace(path)):
+        return PartitionedWorkspaceWriter(path, partition_fields, append=append)
+    return WorkspaceWriter(path, append=append)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Run a Vir-Seq-Sift processing pipeline over FASTA files.")
+    arg_parser.add_argument('inputs', nargs='+', help="Input files or glob patterns (.fasta/.fa/.fna/.txt, optionally .gz)")
+    arg_parser.add_argument('--pipeline', '-p', required=True, help="Pipeline spec (.json, .yaml or .yml)")
+    arg_parser.add_argument('--output-dir', '-o', default='.', help="Directory for output files")
+    arg_parser.add_argument('--prefix', default=f"batch_{datetime.now().strftime('%Y%m%d_%H%M')}",
+                            help="File name prefix for outputs not named in the spec")
+    arg_parser.add_argument('--workers', '-j', type=int, default=None, help="Worker processes (default: all cores, 1 = in-process)")
+    arg_parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Records per worker task")
+    arg_parser.add_argument('--workspace', '-w', default=None,
+                            help="Also write the output as an on-disk workspace directory (openable in the app)")
+    arg_parser.add_argument('--partition-by', default=None,
+                            help="Split the --workspace into one partition per value of these comma-separated "
+                                 "fields (segment, type)")
+    arg_parser.add_argument('--append', action='store_true',
+                            help="Append to an existing --workspace and outputs; dedup checks only the new records")
+    arg_parser.add_argument('--hosts', default=None,
+                            help="Text file of extra host names (one per line) recognized in isolate names")
+    arg_parser.add_argument('--quiet', '-q', action='store_true', help="Suppress progress output")
+    args = arg_parser.parse_args(argv)
+
+    try:
+        spec = load_pipeline_spec(args.pipeline)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    try:
+        extra_hosts = read_host_list(args.hosts) if args.hosts else ()
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    if args.append and not args.workspace:
+        print("Error: --append needs --workspace (the workspace holds the digests of existing records).",
+              file=sys.stderr)
+        return 2
+
+    partition_fields = [field.strip() for field in args.partition_by.split(',') if field.strip()] if args.partition_by else None
+    if partition_fields and not args.workspace:
+        print("Error: --partition-by needs --workspace.", file=sys.stderr)
+        return 2
+    if args.append and args.workspace and partition_fields and is_workspace(args.workspace):
+        print(f"Error: {args.workspace} is not partitioned; append to it without --partition-by.", file=sys.stderr)
+        return 2
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("Error: no FASTA files matched the given inputs.", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = spec['outputs']
+    fasta_path = os.path.join(args.output_dir, outputs.get('fasta', f"{args.prefix}.fasta"))
+    metadata_path = os.path.join(args.output_dir, outputs.get('metadata', f"{args.prefix}_metadata.tsv"))
+    report_path = os.path.join(args.output_dir, outputs.get('report', f"{args.prefix}_report.txt"))
+    overlap_path = os.path.join(args.output_dir, outputs['overlap']) if outputs.get('overlap') else None
+
+    runner = BatchRunner(spec['steps'], workers=args.workers, chunk_size=args.chunk_size, progress=not args.quiet,
+                         extra_hosts=extra_hosts, header_schema=spec['header_schema'],
+                         header_schemas=spec['header_schemas'], track_overlap=overlap_path is not None)
+    if args.append:
+        blockers = runner.incremental_blockers()
+        if blockers:
+            print(f"Error: --append cannot update these steps from new records alone: {', '.join(blockers)}",
+                  file=sys.stderr)
+            return 2
+    try:
+        workspace = open_workspace_writer(args.workspace, partition_fields, args.append) if args.workspace else None
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if workspace is not None and workspace.base is not None:
+        runner.seed(workspace.base)
+    mode = 'at' if args.append else 'wt'
+    new_metadata = not (args.append and os.path.exists(metadata_path) and os.path.getsize(metadata_path))
+    with open_text(fasta_path, mode) as fasta_out, open_text(metadata_path, mode) as meta_out:
+        meta_writer = csv.writer(meta_out, delimiter='\t', lineterminator='\n')
+        if new_metadata:
+            meta_writer.writerow(METADATA_COLUMNS)
+
+        def sink(records):
+            write_fasta(records, fasta_out)
+            meta_writer.writerows(metadata_row(r) for r in records)
+            if workspace is not None:
+                for record in records:
+                    workspace.add(record)
+
+        runner.run(paths, sink)
+    if workspace is not None:
+        workspace.close()
+
+    if overlap_path:
+        runner.merge.overlap().to_csv(overlap_path, sep='\t', index_label='file')
+    report = runner.report(os.path.basename(args.pipeline))
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(report + "\n")
+    if not args.quiet:
+        print(report, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
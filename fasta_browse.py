@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_browse.py
+
+Paginated record browser over a RecordView. Searching and sorting work on
+the view's memoized columns (dictionary-encoded metadata, the DateIndex,
+sequence lengths, the accession index) and produce an order of record
+positions; only the records of the visible page are then read, with a
+truncated sequence preview. A page of a million-record view costs one
+narrow read, and the order of a search/sort is reused while paging.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from fasta_aggregate import as_view
+from fasta_engine import ACCESSION_PATTERN, DEFAULT_UNKNOWN, Query, QueryError, text_keys
+
+# ==================== CONSTANTS ====================
+DEFAULT_PAGE_SIZE = 50
+PREVIEW_LENGTH = 60  # Sequence characters shown per record
+SORT_FIELDS = ('position', 'collection_date', 'length', 'isolate_name', 'type', 'segment', 'clade', 'host', 'location')
+SEARCH_FIELDS = ('isolate_name', 'isolate_id', 'type', 'segment', 'clade', 'host', 'location')
+CACHED_SELECTIONS = 8  # (search, sort) orders memoized per browser
+PAGE_COLUMNS = ['#', 'Header', 'Subtype', 'Segment', 'Clade', 'Host', 'Location', 'Date', 'Length', 'Sequence']
+
+
+def search_mask(view, text):
+    """Records matching a search: a query expression, an accession, or text contained in any SEARCH_FIELDS value.
+
+    Plain text is matched case-insensitively against each field's distinct
+    values, which are broadcast back to the records through their codes.
+    """
+    text = text.strip()
+    try:
+        return Query(text).mask(view)
+    except QueryError:
+        pass
+    mask = np.zeros(len(view), dtype=bool)
+    if ACCESSION_PATTERN.fullmatch(text.upper()):
+        mask[view.accession_index().lookup([text])[0]] = True
+    needle = text.casefold()
+    for field in SEARCH_FIELDS:
+        codes, labels = view.metadata_codes(field)
+        hits = np.flatnonzero(text_keys(labels).str.contains(needle, regex=False))
+        if len(hits):
+            mask |= np.isin(codes, hits)
+    return mask
+
+
+def sort_order(view, field='position', descending=False):
+    """Record positions ordered by `field` (see SORT_FIELDS); ties and undated records keep record order."""
+    if field == 'position':
+        order = np.arange(len(view))
+        return order[::-1].copy() if descending else order
+    if field == 'collection_date':
+        index = view.date_index()
+        dated, undated = index.order[:index.dated], index.undated()
+        if descending:
+            days = view.collection_dates().view(np.int64)[dated]
+            dated = dated[np.lexsort((dated, -days))]  # Latest first, ties in record order
+        return np.concatenate([dated, undated])
+    if field == 'length':
+        keys = view.sequence_lengths()
+    else:
+        codes, labels = view.metadata_codes(field)
+        ranks = np.empty(len(labels), dtype=np.int64)
+        ranks[np.argsort(text_keys(labels).to_numpy(dtype=object), kind='stable')] = np.arange(len(labels))
+        keys = ranks[codes]
+    return np.argsort(-keys if descending else keys, kind='stable')
+
+
+class RecordBrowser:
+    """Search, sort and page through one view, memoizing recent orders."""
+    def __init__(self, sequences):
+        self.view = as_view(sequences)
+        self._orders = OrderedDict()
+
+    def select(self, search='', sort_by='position', descending=False):
+        """Record positions matching `search`, in display order."""
+        key = (search.strip(), sort_by, descending)
+        if key not in self._orders:
+            order = sort_order(self.view, sort_by, descending)
+            if key[0]:
+                order = order[search_mask(self.view, key[0])[order]]
+            self._orders[key] = order
+            while len(self._orders) > CACHED_SELECTIONS:
+                self._orders.popitem(last=False)
+        self._orders.move_to_end(key)
+        return self._orders[key]
+
+    def page(self, positions, number, size=DEFAULT_PAGE_SIZE):
+        """DataFrame of page `number` (0-based) of `positions`: metadata plus a sequence preview."""
+        chosen = np.asarray(positions[number * size:(number + 1) * size], dtype=np.int64)
+        rows = []
+        for position, (header, seq, metadata) in zip(chosen.tolist(), self.view.take(chosen).iter_records()):
+            seq = seq or ''
+            date_val = metadata.get('collection_date')
+            rows.append([position + 1, header, metadata.get('type', DEFAULT_UNKNOWN),
+                         metadata.get('segment', DEFAULT_UNKNOWN), metadata.get('clade', DEFAULT_UNKNOWN),
+                         metadata.get('host', DEFAULT_UNKNOWN), metadata.get('location', DEFAULT_UNKNOWN),
+                         date_val.strftime('%Y-%m-%d') if date_val else '', len(seq),
+                         seq[:PREVIEW_LENGTH] + ('...' if len(seq) > PREVIEW_LENGTH else '')])
+        return pd.DataFrame(rows, columns=PAGE_COLUMNS)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_consensus.py
+
+Consensus sequences and per-site variability of record groups (e.g. per
+clade, month or location). The sequences of each chunk are stacked into a
+uint8 matrix (one row per sequence, one column per site) and the base counts
+of every column of every group are taken with a single np.bincount, so a
+group's profile costs a few array passes per CONSENSUS_CHUNK sequences and
+memory stays bounded by the chunk size.
+
+Sequences are expected to be aligned (or of equal length, as for most
+segment datasets); shorter sequences are padded at the end and padding is
+not counted.
+"""
+
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from fasta_aggregate import as_view, field_codes
+
+# ==================== CONSTANTS ====================
+CONSENSUS_CHUNK = 2000  # Sequences stacked per matrix
+SYMBOLS = "ACGT-N"  # Count columns; N holds every other character (ambiguity codes included)
+GAP, OTHER, PAD = 4, 5, 6
+SYMBOL_CODES = np.full(256, OTHER, dtype=np.uint8)
+SYMBOL_CODES[np.frombuffer(b"ACGTUacgtu-.", dtype=np.uint8)] = [0, 1, 2, 3, 3, 0, 1, 2, 3, 3, GAP, GAP]
+GROUP_SEPARATOR = " / "
+
+
+# ==================== COUNTING ====================
+def stack_sequences(sequences, lengths=None):
+    """Symbol codes of sequences as a (count, longest) uint8 matrix, padded with PAD."""
+    if lengths is None:
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    width = int(lengths.max()) if len(lengths) else 0
+    joined = np.frombuffer("".join(sequences).encode('ascii', errors='replace'), dtype=np.uint8)
+    if (lengths == width).all():
+        return SYMBOL_CODES[joined].reshape(len(sequences), width)
+    matrix = np.full((len(sequences), width), PAD, dtype=np.uint8)
+    matrix[np.arange(width) < lengths[:, None]] = SYMBOL_CODES[joined]
+    return matrix
+
+
+class ProfileBuilder:
+    """Accumulates per-column symbol counts of grouped sequences, chunk by chunk.
+
+    `add(sequences, groups)` takes a chunk of sequence strings and the
+    group number of each; the counts of all groups in the chunk come from
+    one bincount over (group, column, symbol).
+    """
+    def __init__(self):
+        self.counts = {}  # group -> (columns, len(SYMBOLS)) int64
+        self.records = {}
+        self.shortest = {}
+        self.longest = {}
+
+    def add(self, sequences, groups):
+        if not len(sequences):
+            return
+        groups = np.asarray(groups, dtype=np.int64)
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        matrix = stack_sequences(sequences, lengths)
+        present, local = np.unique(groups, return_inverse=True)
+        width = matrix.shape[1]
+        cells = (local[:, None] * width + np.arange(width)) * (PAD + 1) + matrix
+        counts = np.bincount(cells.ravel(), minlength=len(present) * width * (PAD + 1))
+        counts = counts.reshape(len(present), width, PAD + 1)[:, :, :PAD]
+        sizes = np.bincount(local, minlength=len(present))
+        shortest = np.full(len(present), width, dtype=np.int64)
+        longest = np.zeros(len(present), dtype=np.int64)
+        np.minimum.at(shortest, local, lengths)
+        np.maximum.at(longest, local, lengths)
+        for i, group in enumerate(present.tolist()):
+            used = int(longest[i])
+            total = self.counts.get(group)
+            if total is None or len(total) < used:
+                grown = np.zeros((used, PAD), dtype=np.int64)
+                if total is not None:
+                    grown[:len(total)] = total
+                total = self.counts[group] = grown
+            total[:used] += counts[i, :used]
+            self.records[group] = self.records.get(group, 0) + int(sizes[i])
+            self.shortest[group] = min(self.shortest.get(group, used), int(shortest[i]))
+            self.longest[group] = max(self.longest.get(group, 0), used)
+
+    def profile(self, group):
+        return ColumnProfile(self.counts.get(group, np.zeros((0, PAD), dtype=np.int64)), self.records.get(group, 0),
+                             self.shortest.get(group, 0) == self.longest.get(group, 0))
+
+
+class ColumnProfile:
+    """Symbol counts per column of one group, shape (columns, len(SYMBOLS))."""
+    def __init__(self, counts, records, aligned=True):
+        self.counts = counts
+        self.records = records
+        self.aligned = aligned  # All sequences had the same length
+
+    def __len__(self):
+        return len(self.counts)
+
+    def consensus(self, min_fraction=0.0, keep_gaps=False):
+        """Majority base of each column ('N' where no base reaches `min_fraction` of the column).
+
+        Columns whose majority is a gap are left out unless `keep_gaps`.
+        """
+        informative = self.counts[:, :OTHER]
+        top = informative.argmax(axis=1)
+        top_count = informative[np.arange(len(top)), top]
+        depth = self.counts.sum(axis=1)
+        symbols = np.frombuffer(SYMBOLS.encode('ascii'), dtype=np.uint8)[top]
+        symbols = np.where((top_count == 0) | (top_count < min_fraction * depth), ord('N'), symbols)
+        if not keep_gaps:
+            symbols = symbols[symbols != ord('-')]
+        return symbols.astype(np.uint8).tobytes().decode('ascii')
+
+    def entropy(self):
+        """Shannon entropy (bits) of each column over A/C/G/T/gap; 0 for columns with none of them."""
+        informative = self.counts[:, :OTHER].astype(np.float64)
+        totals = informative.sum(axis=1, keepdims=True)
+        p = np.divide(informative, totals, out=np.zeros_like(informative), where=totals > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(p > 0, -p * np.log2(p), 0.0)
+        return terms.sum(axis=1)
+
+    def frame(self):
+        """Per-column counts, majority symbol and entropy (Position is 1-based)."""
+        frame = pd.DataFrame(self.counts, columns=['A', 'C', 'G', 'T', 'Gap', 'N'])
+        frame.insert(0, 'Position', np.arange(1, len(self) + 1))
+        frame['Consensus'] = list(self.consensus(keep_gaps=True)) if len(self) else []
+        frame['Entropy'] = self.entropy()
+        return frame
+
+
+# ==================== GROUPS ====================
+def group_codes(sequences, fields):
+    """(group number per record, group labels) for combinations of metadata fields ('year'/'month' allowed)."""
+    view = as_view(sequences)
+    if not fields:
+        return np.zeros(len(view), dtype=np.int64), np.array(["All"], dtype=object)
+    encoded = [field_codes(view, field) for field in fields]
+    shape = tuple(len(labels) for _, labels in encoded)
+    flat = np.ravel_multi_index([codes for codes, _ in encoded], shape)
+    used, groups = np.unique(flat, return_inverse=True)
+    parts = np.unravel_index(used, shape)
+    labels = [GROUP_SEPARATOR.join(str(encoded[f][1][parts[f][i]]) for f in range(len(fields)))
+              for i in range(len(used))]
+    return groups.astype(np.int64), np.array(labels, dtype=object)
+
+
+def profile_groups(sequences, group_by=(), min_records=1, chunk_size=CONSENSUS_CHUNK):
+    """ColumnProfile of every group of at least `min_records` records, by group label.
+
+    `group_by` lists metadata fields (e.g. ('clade', 'month')); no fields
+    profile the whole dataset as one group. Sequences are read once, in
+    chunks of `chunk_size`.
+    """
+    view = as_view(sequences)
+    groups, labels = group_codes(view, list(group_by))
+    sizes = np.bincount(groups, minlength=len(labels))
+    selected = np.flatnonzero(sizes[groups] >= min_records)
+    builder = ProfileBuilder()
+    if len(selected):
+        records = view.take(selected).iter_records()
+        for start in range(0, len(selected), chunk_size):
+            chunk = [record[1] or '' for record in itertools.islice(records, chunk_size)]
+            builder.add(chunk, groups[selected[start:start + len(chunk)]])
+    return OrderedDict((labels[group], builder.profile(group))
+                       for group in np.flatnonzero(sizes >= min_records).tolist() if group in builder.records)
+
+
+def variability_summary(profiles):
+    """One row per group: sequences, columns, whether lengths matched, mean entropy and variable sites."""
+    rows = []
+    for label, profile in profiles.items():
+        entropy = profile.entropy()
+        rows.append({
+            'Group': label,
+            'Sequences': profile.records,
+            'Columns': len(profile),
+            'Equal Length': profile.aligned,
+            'Mean Entropy': round(float(entropy.mean()), 4) if len(entropy) else 0.0,
+            'Variable Sites': int((entropy > 0).sum()),
+        })
+    return pd.DataFrame(rows, columns=['Group', 'Sequences', 'Columns', 'Equal Length', 'Mean Entropy', 'Variable Sites'])
+
+
+def consensus_fasta(profiles, min_fraction=0.0, keep_gaps=False, line_width=70):
+    """FASTA text with one consensus record per group (header: consensus|<group values>|n=<sequences>)."""
+    lines = []
+    for label, profile in profiles.items():
+        seq = profile.consensus(min_fraction, keep_gaps)
+        name = "|".join(part.replace(' ', '_') for part in str(label).split(GROUP_SEPARATOR))
+        lines.append(f">consensus|{name}|n={profile.records}")
+        lines.extend(seq[i:i + line_width] for i in range(0, len(seq), line_width))
+    return "\n".join(lines) + "\n" if lines else ""
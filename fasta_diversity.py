@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_diversity.py
+
+Diverse representatives of record groups. A group of equal-length
+sequences (an aligned segment) is compared by Hamming p-distance over its
+stacked base matrix; a group of mixed lengths by the k-mer Jaccard distance
+of its FracMinHash sketches (fasta_kmer). Farthest-point sampling adds, one
+at a time, the record farthest from everything picked so far, so it only
+ever needs the distance rows of the picks: O(picks x group size) per group
+instead of a full distance matrix. Groups above DIVERSITY_MAX_GROUP records
+are cut down to evenly spaced candidates (thin_candidates) before their
+sequences are read.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from fasta_kmer import BASE_CODES, KmerIndex
+
+# ==================== CONSTANTS ====================
+DIVERSITY_MAX_GROUP = 10000  # Larger groups are thinned (evenly, in record order) before sampling
+HAMMING = "hamming"
+JACCARD = "jaccard"
+
+
+# ==================== DISTANCES ====================
+def stack_bases(sequences):
+    """Base codes (A/C/G/T -> 0..3, anything else 4) of equal-length sequences as a (count, length) matrix."""
+    length = len(sequences[0]) if sequences else 0
+    joined = np.frombuffer("".join(sequences).encode('ascii', errors='replace'), dtype=np.uint8)
+    return BASE_CODES[joined].reshape(len(sequences), length)
+
+
+def hamming_rows(matrix):
+    """Distance-row function: p-distance of one row to all rows, over sites where both have A/C/G/T."""
+    valid = matrix < 4
+
+    def row(i):
+        compared = valid & valid[i]
+        mismatched = (matrix != matrix[i]) & compared
+        return mismatched.sum(axis=1) / np.maximum(compared.sum(axis=1), 1)
+    return row
+
+
+def jaccard_rows(sequences, workers=1):
+    """Distance-row function: 1 - k-mer Jaccard index of one sequence to all (1 where no k-mers are shared)."""
+    index = KmerIndex.build(sequences, workers=workers)
+
+    def row(i):
+        query_size, shared = index.shared_counts(sequences[i])
+        union = index.sizes + query_size - shared
+        return 1 - shared / np.maximum(union, 1)
+    return row
+
+
+def distance_rows(sequences, workers=1):
+    """(method, distance-row function) for a group: Hamming if all lengths are equal, else Jaccard."""
+    if len(set(map(len, sequences))) == 1:
+        return HAMMING, hamming_rows(stack_bases(sequences))
+    return JACCARD, jaccard_rows(sequences, workers)
+
+
+def pairwise_distances(sequences):
+    """(method, full distance matrix) of a list of sequences."""
+    method, row = distance_rows(list(sequences))
+    return method, np.vstack([row(i) for i in range(len(sequences))]) if len(sequences) else np.zeros((0, 0))
+
+
+# ==================== SAMPLING ====================
+def farthest_point_sample(count, row, k, start=0):
+    """Indices of k of `count` items picked by farthest-point sampling.
+
+    Starts at `start`; each next pick is the item farthest from all picks
+    so far (ties go to the lower index). Stops early when every remaining
+    item is at distance 0 from a pick.
+    """
+    if count <= k:
+        return list(range(count))
+    picks = [start]
+    nearest = row(start).astype(np.float64)
+    nearest[start] = -1
+    while len(picks) < k:
+        best = int(np.argmax(nearest))
+        if nearest[best] <= 0:
+            break
+        picks.append(best)
+        nearest = np.minimum(nearest, row(best))
+        nearest[picks] = -1
+    return sorted(picks)
+
+
+def thin_candidates(count, max_group=DIVERSITY_MAX_GROUP):
+    """Indices of at most `max_group` of `count` group members, evenly spaced in record order."""
+    if count <= max_group:
+        return np.arange(count)
+    return np.linspace(0, count - 1, max_group).astype(np.int64)
+
+
+def diverse_representatives(sequences, k, max_group=DIVERSITY_MAX_GROUP):
+    """(indices of up to k mutually distant sequences, distance method) of one group.
+
+    Groups above `max_group` are first thinned to `max_group` evenly spaced
+    records (callers reading sequences from disk thin the positions first,
+    see thin_candidates), which caps the cost per group.
+    """
+    sequences = list(sequences)
+    if len(sequences) <= k:
+        return list(range(len(sequences))), None
+    candidates = thin_candidates(len(sequences), max_group)
+    if len(candidates) < len(sequences):
+        sequences = [sequences[i] for i in candidates]
+    method, row = distance_rows(sequences)
+    return candidates[farthest_point_sample(len(sequences), row, k)].tolist(), method
+
+
+def representatives_by_group(groups, k, workers=None, max_group=DIVERSITY_MAX_GROUP):
+    """Yield (key, indices, method) for an iterable of (key, sequences) groups, `workers` groups at a time."""
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for key, sequences in groups:
+            pending.append((key, pool.submit(diverse_representatives, sequences, k, max_group)))
+            if len(pending) > 2 * workers:
+                key, future = pending.popleft()
+                yield (key, *future.result())
+        for key, future in pending:
+            yield (key, *future.result())
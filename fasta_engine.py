@@ -0,0 +1,2417 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_engine.py
+
+Streamlit-free core of Vir-Seq-Sift: FASTA parsing, header conversion and
+sequence filtering. Operations return OperationResult objects and report
+progress as EngineEvent records instead of writing to session state, so the
+same code runs in the Streamlit app, in worker processes and in batch jobs.
+"""
+
+import re
+import time
+import operator
+import hashlib
+import heapq
+import itertools
+from functools import lru_cache
+from datetime import datetime
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+from fasta_diversity import HAMMING, JACCARD, representatives_by_group, thin_candidates
+from fasta_kmer import KmerIndex, clean_sequence, mash_identity, mix_hash
+
+# ==================== CONSTANTS ====================
+DEFAULT_UNKNOWN = "Unknown"  # Consistent default value
+DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%Y/%m/%d", "%Y-%m", "%Y", "%d-%b-%Y", "%b-%d-%Y", "%Y%m%d"]
+N_RUN_PATTERN = re.compile(r'N+')
+PROGRESS_EVERY = 2000  # Records between progress/cancellation checks
+VIEW_CHUNK = 20000  # Records per batch for vectorized per-sequence statistics
+DEFAULT_HOSTS = ('chicken', 'human', 'swine', 'duck', 'avian', 'environment', 'turkey', 'goose', 'wild bird')
+HOST_CACHE_LIMIT = 100000  # Distinct isolate-name prefixes memoized per parser
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+NO_DAY = np.iinfo(np.int64).min  # Bit pattern of NaT in datetime64 arrays
+UNDATED_LAST = np.iinfo(np.int64).max  # Sort key that places undated records last
+ACCESSION_KINDS = ('epi_isl', 'epi', 'genbank')
+ACCESSION_PATTERN = re.compile(  # EPI_ISL_402124, EPI1234567, MN908947.3 / AB123456 / A12345 / NC_045512.2
+    r"(?=[A-Z])\b(?:(?P<epi_isl>EPI_ISL_\d+)|(?P<epi>EPI\d+)"
+    r"|(?P<genbank>[A-Z](?:[A-Z]_\d{6,9}|[A-Z]\d{6}(?:\d{2})?|\d{5})(?:\.\d+)?))\b", re.ASCII)
+ACCESSION_VERSION = r"\.\d+$"  # GenBank version suffix, ignored when matching (MN908947.3 == MN908947)
+ACCESSION_CHUNK = 100000  # Headers joined and scanned per regex pass
+QUERY_TOKEN = re.compile(r"""\s*(?:(?P<string>"[^"]*"|'[^']*')|(?P<op>==|!=|<=|>=|=|<|>)"""
+                         r"""|(?P<punct>[()\[\],])|(?P<word>[^\s()\[\],=!<>"']+))""")
+QUERY_FIELD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*$")
+QUERY_KEYWORDS = ('and', 'or', 'not', 'in', 'contains')
+QUERY_FIELD_ALIASES = {'date': 'collection_date', 'subtype': 'type', 'header': 'original_header'}
+QUERY_DATE_FIELDS = ('collection_date', 'year')
+SAMPLE_PERIODS = {'year': 'Y', 'month': 'M'}  # Strata derived from collection_date (calendar year / month)
+UINT64_MASK = (1 << 64) - 1
+
+
+# ==================== HELPER FUNCTIONS ====================
+def parse_date(date_str):
+    """Parse various date formats"""
+    if isinstance(date_str, datetime):
+        return date_str
+    if not date_str or 'unknown' in str(date_str).lower() or date_str is None:
+        return None
+    date_str = str(date_str).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            parsed_date = datetime.strptime(date_str, fmt)
+            if fmt == "%Y":
+                return datetime(parsed_date.year, 1, 1)
+            if fmt == "%Y-%m":
+                return datetime(parsed_date.year, parsed_date.month, 1)
+            return parsed_date
+        except ValueError:
+            continue
+    return None
+
+def longest_n_run(seq):
+    """Length of the longest run of N bases in a sequence."""
+    return max((len(run) for run in N_RUN_PATTERN.findall(seq.upper())), default=0)
+
+def passes_quality(seq, min_length=200, max_n_run=100):
+    """True if a sequence meets the minimum length and maximum N-run limits."""
+    return len(seq) >= min_length and longest_n_run(seq) <= max_n_run
+
+def gc_fraction(seq):
+    """Share of G, C and S (G or C) bases in a sequence."""
+    return (seq.count('G') + seq.count('C') + seq.count('S')) / len(seq) if seq else 0.0
+
+def collection_day(metadata):
+    """Collection date as days since 1970-01-01, or NO_DAY (NaT as datetime64[D]) when unknown."""
+    date = metadata.get('collection_date')
+    return date.toordinal() - EPOCH_ORDINAL if date else NO_DAY
+
+def sequence_digest(seq, salt=""):
+    """Stable signed 64-bit digest of a sequence (plus optional salt, e.g. subtype)."""
+    data = seq.encode('ascii', errors='replace')
+    if salt:
+        data += b"\x00" + str(salt).encode('utf-8', errors='replace')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little', signed=True)
+
+
+class DigestIndex:
+    """Compact set of 64-bit sequence digests.
+
+    New digests collect in a small Python set and are merged into a sorted
+    int64 array every `flush_size` additions, so a long-running stream costs
+    about 8 bytes per unique sequence instead of a full string copy.
+    """
+    def __init__(self, flush_size=1_000_000):
+        self.flush_size = flush_size
+        self._sorted = np.empty(0, dtype=np.int64)
+        self._pending = set()
+
+    def __len__(self):
+        return len(self._sorted) + len(self._pending)
+
+    def __contains__(self, digest):
+        if digest in self._pending:
+            return True
+        pos = np.searchsorted(self._sorted, digest)
+        return pos < len(self._sorted) and self._sorted[pos] == digest
+
+    def add(self, digest):
+        """Add a digest; returns False if it was already present."""
+        if digest in self:
+            return False
+        self._pending.add(digest)
+        if len(self._pending) >= self.flush_size:
+            self._flush()
+        return True
+
+    def add_many(self, digests):
+        """Add an array of digests; returns a boolean mask of those not seen before.
+
+        Only the first occurrence of a digest repeated within `digests` counts
+        as new, matching a loop of add() calls.
+        """
+        unique, first = np.unique(np.asarray(digests, dtype=np.int64), return_index=True)
+        seen = np.zeros(len(unique), dtype=bool)
+        if len(self._sorted):
+            pos = np.minimum(np.searchsorted(self._sorted, unique), len(self._sorted) - 1)
+            seen = self._sorted[pos] == unique
+        if self._pending:
+            seen |= np.fromiter((d in self._pending for d in unique.tolist()), dtype=bool, count=len(unique))
+        new = np.zeros(len(digests), dtype=bool)
+        new[first[~seen]] = True
+        self._pending.update(unique[~seen].tolist())
+        if len(self._pending) >= self.flush_size:
+            self._flush()
+        return new
+
+    def update(self, digests):
+        """Add an array of digests in one sorted merge (e.g. a stored digest column)."""
+        self._flush()
+        self._sorted = np.union1d(self._sorted, np.asarray(digests, dtype=np.int64))
+
+    def _flush(self):
+        if self._pending:
+            pending = np.fromiter(self._pending, dtype=np.int64, count=len(self._pending))
+            self._sorted = np.union1d(self._sorted, pending)
+            self._pending = set()
+
+
+# ==================== ACCESSIONS & ID LISTS ====================
+def accession_keys(values):
+    """Lookup keys for accessions: trimmed, upper-case, without GenBank version suffix."""
+    keys = pd.Series(list(values), dtype=object).astype(str).str.strip().str.upper()
+    return pd.Index(keys.str.replace(ACCESSION_VERSION, '', regex=True), dtype=object)
+
+def text_keys(values):
+    """Lookup keys for names and IDs: trimmed and case-folded."""
+    return pd.Index(pd.Series(list(values), dtype=object).astype(str).str.strip().str.casefold(), dtype=object)
+
+def unique_query(values, make_keys=text_keys):
+    """(unique non-empty keys, the first original value of each) for a list of query values."""
+    values = list(values)
+    keys = make_keys(values)
+    first = (keys != '') & ~keys.duplicated()
+    return keys[first], [value for value, keep in zip(values, first) if keep]
+
+def list_filter_name(field, count, exclude=False):
+    """Operation name of a list filter, e.g. 'Filter by Isolate Name List (500 values)'."""
+    label = "Accession" if field == 'accession' else field.replace('_', ' ').title()
+    return f"{'Exclude' if exclude else 'Filter by'} {label} List ({count} values)"
+
+@lru_cache(maxsize=8)
+def read_value_list(path):
+    """Non-empty, stripped lines of a list file (memoized, so pipeline workers read it once)."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return tuple(line.strip() for line in f if line.strip())
+
+
+class AccessionIndex:
+    """Accession -> record index over a record list's headers.
+
+    Headers are joined in chunks and scanned with the compiled
+    ACCESSION_PATTERN in one pass per chunk; each match is mapped back to
+    its record by binary search over the header offsets. A record can be
+    listed under several accessions (e.g. an EPI_ISL isolate ID plus an EPI
+    segment ID). `positions[i]` is the record of `accessions[i]`.
+    """
+    def __init__(self, headers):
+        accessions, kinds, positions = [], [], []
+        headers = iter(headers)
+        base = 0
+        while True:
+            chunk = list(itertools.islice(headers, ACCESSION_CHUNK))
+            if not chunk:
+                break
+            starts = np.zeros(len(chunk), dtype=np.int64)
+            np.cumsum([len(header) + 1 for header in chunk[:-1]], out=starts[1:])
+            offsets = []
+            for match in ACCESSION_PATTERN.finditer("\n".join(chunk)):
+                accessions.append(match.group())
+                kinds.append(match.lastgroup)
+                offsets.append(match.start())
+            positions.append(np.searchsorted(starts, np.array(offsets, dtype=np.int64), side='right') - 1 + base)
+            base += len(chunk)
+        self.count = base
+        self.accessions = np.array(accessions, dtype=object)
+        self.kinds = np.array(kinds, dtype=object)
+        self.positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+        self.keys = accession_keys(self.accessions)
+
+    @classmethod
+    def from_records(cls, records):
+        """Index the headers of a record list (metadata-only pass where the records support it)."""
+        if hasattr(records, 'iter_records'):
+            records = records.iter_records(with_sequence=False)
+        return cls(str(record[0] or '') for record in records)
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def extract(self, kinds=ACCESSION_KINDS):
+        """Unique accessions of the given kinds, in record order."""
+        return list(pd.unique(self.accessions[np.isin(self.kinds, list(kinds))]))
+
+    def lookup(self, ids):
+        """(sorted record positions, unmatched IDs) for a list of accessions.
+
+        One hash join of the unique query keys against the indexed keys, so
+        the cost is O(n + m) for n indexed accessions and m IDs.
+        """
+        query, originals = unique_query(ids, accession_keys)
+        hit = query.get_indexer(self.keys) >= 0
+        found = query.isin(self.keys[hit])
+        return np.unique(self.positions[hit]), [value for value, ok in zip(originals, found) if not ok]
+
+
+# ==================== SAMPLING ====================
+def _mix_int(value):
+    """fasta_kmer.mix_hash() of one Python int."""
+    value ^= value >> 30
+    value = (value * 0xBF58476D1CE4E5B9) & UINT64_MASK
+    value ^= value >> 27
+    value = (value * 0x94D049BB133111EB) & UINT64_MASK
+    return value ^ (value >> 31)
+
+def sample_keys(positions, seed=0):
+    """Pseudo-random uint64 key of each record position for a seed.
+
+    Samples keep the records with the smallest keys, so the app (over a
+    view) and a batch stream (over records in the same order) draw the
+    same records for the same seed.
+    """
+    offset = np.uint64(_mix_int(int(seed) & UINT64_MASK))
+    return mix_hash(np.asarray(positions, dtype=np.uint64) + offset)
+
+def sample_key(position, seed=0):
+    """sample_keys() of a single position, without numpy."""
+    return _mix_int((position + _mix_int(int(seed) & UINT64_MASK)) & UINT64_MASK)
+
+def proportional_quotas(sizes, total):
+    """Records to draw from each stratum so that `total` is split in proportion to `sizes` (largest remainder)."""
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if total >= sizes.sum():
+        return sizes.copy()
+    exact = sizes * (total / sizes.sum())
+    quotas = np.floor(exact).astype(np.int64)
+    remainder = int(total - quotas.sum())
+    if remainder > 0:
+        quotas[np.argsort(-(exact - quotas), kind='stable')[:remainder]] += 1
+    return quotas
+
+def sample_stratum_value(metadata, field):
+    """A record's stratum value for `field` as the analyzer groups it ('month' is the calendar month)."""
+    if field in SAMPLE_PERIODS:
+        date_val = metadata.get('collection_date')
+        if not date_val:
+            return DEFAULT_UNKNOWN
+        return f"{date_val.year:04d}" if field == 'year' else f"{date_val.year:04d}-{date_val.month:02d}"
+    value = metadata.get(field, DEFAULT_UNKNOWN)
+    return DEFAULT_UNKNOWN if value is None else str(value)
+
+
+# ==================== DATE INDEX ====================
+def date_order(days):
+    """Stable permutation sorting int64 day numbers, undated (NO_DAY) records last."""
+    days = np.asarray(days, dtype=np.int64)
+    return np.argsort(np.where(days == NO_DAY, UNDATED_LAST, days), kind='stable')
+
+def merge_date_orders(days, orders):
+    """One date order over `days` from the date orders of consecutive record blocks.
+
+    `orders` hold positions into `days` (already offset per block); each
+    block is a sorted run, so the stable sort only merges runs.
+    """
+    merged = np.concatenate(orders) if orders else np.empty(0, dtype=np.int64)
+    keyed = np.asarray(days, dtype=np.int64)[merged]
+    return merged[np.argsort(np.where(keyed == NO_DAY, UNDATED_LAST, keyed), kind='stable')]
+
+def _as_day(value):
+    """Day number of a bound given as int, datetime64, date/datetime or ISO string (None stays None)."""
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+class DateIndex:
+    """Records of a view in collection-date order with year-month bucket offsets.
+
+    `order` is a stable permutation of record positions by date (ties keep
+    record order) with undated records last, and `days` the day numbers in
+    that order. Month `first_month + i` (months since 1970-01) occupies
+    `order[month_offsets[i]:month_offsets[i + 1]]`, so a date range is two
+    binary searches and a month a slice. Filters carry the index over (see
+    take), so it is sorted once per dataset or read from a workspace.
+    """
+    def __init__(self, days, order=None):
+        days = np.asarray(days, dtype=np.int64)
+        self.order = date_order(days) if order is None else np.asarray(order, dtype=np.int64)
+        self.days = days[self.order]
+        self.dated = len(days) - int(np.count_nonzero(days == NO_DAY))
+        months = self.days[:self.dated].view('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        self.first_month = int(months[0]) if self.dated else 0
+        span = int(months[-1]) - self.first_month + 1 if self.dated else 0
+        self.month_offsets = np.searchsorted(months, np.arange(self.first_month, self.first_month + span + 1))
+
+    def __len__(self):
+        return len(self.order)
+
+    def __repr__(self):
+        return f"DateIndex({len(self)} records, {self.dated} dated, {len(self.month_offsets) - 1} months)"
+
+    def record_days(self):
+        """Day numbers in record order."""
+        days = np.empty(len(self.order), dtype=np.int64)
+        days[self.order] = self.days
+        return days
+
+    def bounds(self, start=None, end=None):
+        """(lo, hi) such that `order[lo:hi]` holds the records dated in [start, end)."""
+        dated = self.days[:self.dated]
+        lo = 0 if start is None else int(np.searchsorted(dated, _as_day(start)))
+        hi = self.dated if end is None else int(np.searchsorted(dated, _as_day(end)))
+        return lo, max(lo, hi)
+
+    def between(self, start=None, end=None):
+        """Positions of the records dated in [start, end), in date order (None leaves a side open)."""
+        lo, hi = self.bounds(start, end)
+        return self.order[lo:hi]
+
+    def mask(self, start=None, end=None):
+        """Boolean mask over the records: dated in [start, end)."""
+        mask = np.zeros(len(self.order), dtype=bool)
+        mask[self.between(start, end)] = True
+        return mask
+
+    def month(self, month):
+        """Positions of the records collected in `month` ('2023-04' or months since 1970-01), in date order."""
+        if not isinstance(month, (int, np.integer)):
+            month = int(np.datetime64(month, 'M').astype(np.int64))
+        i = month - self.first_month
+        if not 0 <= i < len(self.month_offsets) - 1:
+            return self.order[:0]
+        return self.order[self.month_offsets[i]:self.month_offsets[i + 1]]
+
+    def months(self):
+        """(months since 1970-01, positions in date order) for every month with records."""
+        offsets = self.month_offsets.tolist()
+        for i, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            if end > start:
+                yield self.first_month + i, self.order[start:end]
+
+    def month_counts(self):
+        """Records per month from first_month on (gap months count 0)."""
+        return np.diff(self.month_offsets)
+
+    def undated(self):
+        """Positions of the records without a collection date."""
+        return self.order[self.dated:]
+
+    def take(self, positions):
+        """DateIndex of the records at strictly increasing `positions`, without re-sorting.
+
+        Returns None for other selections (reordered or repeated records),
+        whose index is then rebuilt when needed.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) > 1 and not (np.diff(positions) > 0).all():
+            return None
+        rank = np.full(len(self.order), -1, dtype=np.int64)
+        rank[positions] = np.arange(len(positions))
+        ranked = rank[self.order]
+        order = ranked[ranked >= 0]
+        days = np.empty(len(positions), dtype=np.int64)
+        days[order] = self.days[ranked >= 0]
+        return DateIndex(days, order)
+
+    def extend(self, other):
+        """DateIndex of this index's records followed by `other`'s (sorted runs are merged)."""
+        days = np.concatenate([self.record_days(), other.record_days()])
+        return DateIndex(days, merge_date_orders(days, [self.order, other.order + len(self.order)]))
+
+
+# ==================== QUERY EXPRESSIONS ====================
+class QueryError(ValueError):
+    """Query expression that cannot be parsed or refers to values of the wrong kind."""
+
+
+def _query_bounds(value):
+    """(first day, day after the last day) of a date value: '2023', '2023-04' or '2023-04-15'."""
+    try:
+        start = np.datetime64(value.replace('/', '-'))
+    except (ValueError, TypeError):
+        start = None
+    if start is None or np.isnat(start) or np.datetime_data(start.dtype)[0] not in ('Y', 'M', 'D'):
+        raise QueryError(f"'{value}' is not a date (use 2023, 2023-04 or 2023-04-15)")
+    end = start + 1
+    return start.astype('datetime64[D]').astype(np.int64), end.astype('datetime64[D]').astype(np.int64)
+
+def _query_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        raise QueryError(f"'{value}' is not a number") from None
+
+def _text_contains(keys, value):
+    if isinstance(keys, str):
+        return value in keys
+    return np.fromiter((value in key for key in keys), dtype=bool, count=len(keys))
+
+
+def _record_month(record):
+    date = record[2].get('collection_date')
+    return date.month if date else 0
+
+def _view_months(view):
+    dates = view.collection_dates()
+    months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    months[np.isnat(dates)] = 0
+    return months
+
+
+QUERY_NUMBER_FIELDS = {  # field -> (RecordView column, single-record value)
+    'length': (lambda view: view.sequence_lengths(), lambda record: len(record[1])),
+    'gc': (lambda view: view.gc_fractions() * 100, lambda record: gc_fraction(record[1]) * 100),
+    'month': (_view_months, _record_month),
+}
+QUERY_OPERATORS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    'contains': _text_contains,
+}
+
+
+class QueryCondition:
+    """One `field op value` test of a Query.
+
+    `mask(view)` evaluates it over a RecordView's memoized columns;
+    `test(record)` evaluates it on a single [header, seq, metadata] record.
+    Text fields are compared trimmed and case-insensitively on the labels of
+    the dictionary-encoded column (one comparison per distinct value, then
+    broadcast through the codes). Date conditions are binary searches over
+    the view's DateIndex. Date values cover a whole year or month when given
+    as 2023 or 2023-04, so `date == 2023` and `date <= 2023-04` include every
+    day of that period; undated records match no date test except `!=` and
+    `not in`.
+    """
+    def __init__(self, field, op, values):
+        self.name = field
+        self.field = QUERY_FIELD_ALIASES.get(field, field)
+        self.op = op
+        self.negate = op in ('!=', 'not in')
+        if self.field in QUERY_DATE_FIELDS:
+            self.kind = 'date'
+            if op == 'contains':
+                raise QueryError(f"'contains' does not apply to dates ({field})")
+            self.values = [_query_bounds(value) for value in values]
+        elif self.field in QUERY_NUMBER_FIELDS:
+            self.kind = 'number'
+            if op == 'contains':
+                raise QueryError(f"'contains' does not apply to numbers ({field})")
+            self.values = [_query_number(value) for value in values]
+        else:
+            self.kind = 'text'
+            self.values = [value.strip().casefold() for value in values]
+
+    def __repr__(self):
+        return f"QueryCondition({self.field} {self.op} {self.values})"
+
+    def _match(self, keys):
+        """Positive match (before negation) of text or number keys: array or scalar."""
+        if self.op in ('in', 'not in'):
+            if isinstance(keys, np.ndarray):
+                return np.isin(keys, self.values)
+            return keys in self.values
+        compare = QUERY_OPERATORS['==' if self.negate else self.op]
+        return compare(keys, self.values[0])
+
+    def _day_ranges(self):
+        """[start, end) day ranges (None: open) whose union is the positive match of a date condition."""
+        if self.op in ('<', '<=', '>', '>='):
+            start, end = self.values[0]
+            return [{'<': (None, start), '<=': (None, end), '>': (end, None), '>=': (start, None)}[self.op]]
+        return self.values
+
+    def mask(self, view):
+        if self.kind == 'date':
+            index = view.date_index()
+            hit = np.zeros(len(index), dtype=bool)
+            for start, end in self._day_ranges():
+                hit[index.between(start, end)] = True
+        elif self.kind == 'number':
+            hit = self._match(QUERY_NUMBER_FIELDS[self.field][0](view))
+        else:
+            codes, labels = view.metadata_codes(self.field)
+            keys = np.asarray(text_keys(labels), dtype=object)
+            hit = np.asarray(self._match(keys), dtype=bool)[codes]
+        return ~hit if self.negate else hit
+
+    def test(self, record):
+        if self.kind == 'date':
+            day = collection_day(record[2])
+            hit = day != NO_DAY and any((start is None or day >= start) and (end is None or day < end)
+                                        for start, end in self._day_ranges())
+        elif self.kind == 'number':
+            hit = self._match(QUERY_NUMBER_FIELDS[self.field][1](record))
+        else:
+            hit = self._match(str(record[2].get(self.field, DEFAULT_UNKNOWN)).strip().casefold())
+        return not hit if self.negate else bool(hit)
+
+
+class Query:
+    """Compiled filter expression, e.g.
+
+        host == chicken and date >= 2023-01 and location in [Egypt, "Viet Nam"]
+
+    Conditions are `field op value` with ==, !=, <, <=, >, >=, contains,
+    in [..] and not in [..], combined with and/or/not and parentheses.
+    Values are bare words or quoted strings. The expression is parsed once;
+    `mask(view)` then evaluates it with array operations over the view's
+    columns and `test(record)` checks a single record (streaming).
+    """
+    def __init__(self, text):
+        self.text = str(text).strip()
+        self._tokens = self._tokenize(self.text)
+        self._pos = 0
+        if not self._tokens:
+            raise QueryError("The query is empty")
+        self.tree = self._parse_or()
+        if self._pos < len(self._tokens):
+            raise QueryError(f"Unexpected '{self._tokens[self._pos][1]}'")
+
+    def __repr__(self):
+        return f"Query({self.text!r})"
+
+    @staticmethod
+    def _tokenize(text):
+        tokens, pos = [], 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = QUERY_TOKEN.match(text, pos)
+            if match is None or match.end() == pos:
+                raise QueryError(f"Cannot read the query at '{text[pos:].strip()[:20]}'")
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'string':
+                value = value[1:-1]
+            elif kind == 'word' and value.lower() in QUERY_KEYWORDS:
+                kind, value = 'keyword', value.lower()
+            tokens.append((kind, value))
+            pos = match.end()
+        return tokens
+
+    def _peek(self, kind=None, value=None):
+        if self._pos >= len(self._tokens):
+            return False
+        token = self._tokens[self._pos]
+        return (kind is None or token[0] == kind) and (value is None or token[1] == value)
+
+    def _next(self, expected):
+        if self._pos >= len(self._tokens):
+            raise QueryError(f"The query ends where {expected} was expected")
+        self._pos += 1
+        return self._tokens[self._pos - 1]
+
+    def _expect(self, kind, value, expected):
+        token = self._next(expected)
+        if token != (kind, value):
+            raise QueryError(f"Expected {expected}, found '{token[1]}'")
+
+    def _parse_or(self):
+        node = self._parse_and()
+        while self._peek('keyword', 'or'):
+            self._pos += 1
+            node = ('or', node, self._parse_and())
+        return node
+
+    def _parse_and(self):
+        node = self._parse_not()
+        while self._peek('keyword', 'and'):
+            self._pos += 1
+            node = ('and', node, self._parse_not())
+        return node
+
+    def _parse_not(self):
+        if self._peek('keyword', 'not'):
+            self._pos += 1
+            return ('not', self._parse_not())
+        if self._peek('punct', '('):
+            self._pos += 1
+            node = self._parse_or()
+            self._expect('punct', ')', "')'")
+            return node
+        return self._parse_condition()
+
+    def _parse_value(self):
+        kind, value = self._next("a value")
+        if kind not in ('word', 'string'):
+            raise QueryError(f"Expected a value, found '{value}'")
+        return value
+
+    def _parse_condition(self):
+        kind, field = self._next("a field name")
+        if kind != 'word' or not QUERY_FIELD.match(field):
+            raise QueryError(f"Expected a field name, found '{field}'")
+        field = field.lower()
+        kind, op = self._next(f"an operator after '{field}'")
+        if (kind, op) == ('keyword', 'not'):
+            self._expect('keyword', 'in', "'in' after 'not'")
+            kind, op = 'keyword', 'not in'
+        if kind == 'op' or op == 'contains':
+            return QueryCondition(field, op, [self._parse_value()])
+        if op not in ('in', 'not in'):
+            raise QueryError(f"Expected an operator after '{field}', found '{op}'")
+        self._expect('punct', '[', "'[' after 'in'")
+        values = [self._parse_value()]
+        while self._peek('punct', ','):
+            self._pos += 1
+            values.append(self._parse_value())
+        self._expect('punct', ']', "']'")
+        return QueryCondition(field, op, values)
+
+    def conditions(self, node=None):
+        """All QueryConditions of the expression, left to right."""
+        node = self.tree if node is None else node
+        if isinstance(node, QueryCondition):
+            return [node]
+        return [condition for child in node[1:] for condition in self.conditions(child)]
+
+    def _evaluate(self, node, evaluate):
+        if isinstance(node, QueryCondition):
+            return evaluate(node)
+        if node[0] == 'not':
+            result = self._evaluate(node[1], evaluate)
+            return not result if isinstance(result, bool) else ~result
+        left = self._evaluate(node[1], evaluate)
+        right = self._evaluate(node[2], evaluate)
+        return (left & right) if node[0] == 'and' else (left | right)
+
+    def check_fields(self, view):
+        """Raise QueryError if a condition names a field none of the view's records has.
+
+        Known fields are the records' metadata keys plus the date and
+        number fields and their aliases; an empty view accepts any field.
+        """
+        if not len(view):
+            return
+        known = set(view.metadata_fields()) | set(QUERY_DATE_FIELDS) | set(QUERY_NUMBER_FIELDS)
+        for condition in self.conditions():
+            if condition.field not in known:
+                names = sorted((known | set(QUERY_FIELD_ALIASES)) - set(QUERY_FIELD_ALIASES.values()))
+                raise QueryError(f"Unknown field '{condition.name}' (known: {', '.join(names)})")
+
+    def mask(self, view):
+        """Boolean array: which records of a RecordView match (unknown fields raise QueryError)."""
+        self.check_fields(view)
+        return np.asarray(self._evaluate(self.tree, lambda condition: condition.mask(view)), dtype=bool)
+
+    def test(self, record):
+        """Whether one [header, seq, metadata] record matches."""
+        return bool(self._evaluate(self.tree, lambda condition: condition.test(record)))
+
+
+# ==================== RECORD VIEWS ====================
+_view_versions = itertools.count(1)
+
+
+class RecordView:
+    """Read-only, list-like selection of records from shared base lists.
+
+    A view holds the base record lists by reference plus an int64 array of
+    positions into their concatenation, so a filtered active set costs 8
+    bytes per kept record instead of a copy. `version` is unique per view
+    and changes whenever a new selection is made. Metadata columns are
+    memoized per view, since the selection never changes.
+    """
+    def __init__(self, bases, indices=None):
+        self.bases = tuple(bases)
+        self.offsets = np.zeros(len(self.bases) + 1, dtype=np.int64)
+        np.cumsum([len(base) for base in self.bases], out=self.offsets[1:])
+        if indices is None:
+            self.indices = np.arange(self.offsets[-1], dtype=np.int64)
+        else:
+            self.indices = np.asarray(indices, dtype=np.int64)
+        self.version = next(_view_versions)
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __bool__(self):
+        return len(self.indices) > 0
+
+    def _locate(self, indices):
+        """(base number, position within base) for global positions."""
+        base_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        return base_ids, indices - self.offsets[base_ids]
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def _runs(self):
+        """(base, local positions) for each run of consecutive selections from one base."""
+        if not len(self.indices):
+            return
+        base_ids, local = self._locate(self.indices)
+        breaks = np.flatnonzero(np.diff(base_ids)) + 1
+        for run_ids, run_local in zip(np.split(base_ids, breaks), np.split(local, breaks)):
+            yield self.bases[int(run_ids[0])], run_local
+
+    def iter_records(self, with_sequence=True):
+        """Iterate the selected records in order.
+
+        Bases that provide `iter_records(positions, with_sequence)` (on-disk
+        workspaces, packed stores, lazy overlays) are read in runs; with
+        `with_sequence=False` they may skip sequence data and yield None in
+        its place.
+        """
+        for base, run_local in self._runs():
+            yield from _iter_run(base, run_local, with_sequence)
+
+    def _per_sequence(self, method, fallback, dtype):
+        """Array of `base.<method>(positions)` over all runs.
+
+        Bases without the method (plain record lists) get `fallback(seq)`
+        applied per record, so packed or on-disk bases can compute the
+        statistic without building sequence strings.
+        """
+        parts = [np.empty(0, dtype=dtype)]
+        for base, run_local in self._runs():
+            if hasattr(base, method):
+                parts.append(np.asarray(getattr(base, method)(run_local), dtype=dtype))
+                continue
+            records = _iter_run(base, run_local, True)
+            parts.append(np.fromiter((fallback(record[1]) for record in records), dtype=dtype, count=len(run_local)))
+        return np.concatenate(parts)
+
+    def collection_dates(self):
+        """datetime64[D] collection date of every selected record (NaT when unknown)."""
+        if 'collection_date' not in self._columns:
+            parts = [np.empty(0, dtype='datetime64[D]')]
+            for base, run_local in self._runs():
+                if hasattr(base, 'collection_dates'):
+                    parts.append(np.asarray(base.collection_dates(run_local), dtype='datetime64[D]'))
+                else:
+                    records = _iter_run(base, run_local, False)
+                    days = np.fromiter((collection_day(record[2]) for record in records), dtype=np.int64, count=len(run_local))
+                    parts.append(days.view('datetime64[D]'))
+            self._columns['collection_date'] = np.concatenate(parts)
+        return self._columns['collection_date']
+
+    def metadata_codes(self, field):
+        """Dictionary-encoded metadata field: (int64 codes, object array of labels).
+
+        Missing values read as DEFAULT_UNKNOWN. Bases providing
+        `metadata_codes(field, positions)` (workspaces) supply their stored
+        codes; per-base labels are merged into one table.
+        """
+        if ('codes', field) not in self._columns:
+            codes, labels, label_count = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=object)], 0
+            for base, run_local in self._runs():
+                if hasattr(base, 'metadata_codes'):
+                    run_codes, run_labels = base.metadata_codes(field, run_local)
+                else:
+                    records = _iter_run(base, run_local, False)
+                    values = np.fromiter((str(record[2].get(field, DEFAULT_UNKNOWN)) for record in records),
+                                         dtype=object, count=len(run_local))
+                    run_codes, run_labels = pd.factorize(values)
+                codes.append(np.asarray(run_codes, dtype=np.int64) + label_count)
+                labels.append(np.asarray(run_labels, dtype=object))
+                label_count += len(run_labels)
+            merged, unique = pd.factorize(np.concatenate(labels))
+            self._columns[('codes', field)] = (merged.astype(np.int64)[np.concatenate(codes)],
+                                               np.asarray(unique, dtype=object))
+        return self._columns[('codes', field)]
+
+    def sequence_lengths(self):
+        return self._per_sequence('sequence_lengths', len, np.int64)
+
+    def longest_n_runs(self):
+        return self._per_sequence('longest_n_runs', longest_n_run, np.int64)
+
+    def metadata_fields(self):
+        """Metadata keys of the selected records (memoized); bases may list theirs via `metadata_fields(positions)`."""
+        if 'metadata_fields' not in self._columns:
+            fields = set()
+            for base, run_local in self._runs():
+                if hasattr(base, 'metadata_fields'):
+                    fields.update(base.metadata_fields(run_local))
+                else:
+                    for record in _iter_run(base, run_local, False):
+                        fields.update(record[2])
+            self._columns['metadata_fields'] = frozenset(fields)
+        return self._columns['metadata_fields']
+
+    def gc_fractions(self):
+        """gc_fraction() of every selected sequence (memoized: it reads sequence bytes)."""
+        if 'gc_fraction' not in self._columns:
+            self._columns['gc_fraction'] = self._per_sequence('gc_fractions', gc_fraction, np.float64)
+        return self._columns['gc_fraction']
+
+    def sequence_digests(self):
+        """sequence_digest() of every selected sequence, as int64 (memoized)."""
+        if 'sequence_digest' not in self._columns:
+            self._columns['sequence_digest'] = self._per_sequence('sequence_digests', sequence_digest, np.int64)
+        return self._columns['sequence_digest']
+
+    def date_index(self):
+        """DateIndex of the selected records (memoized).
+
+        A view selecting increasing positions of one base that stores a
+        date order (`date_order()`, e.g. a workspace) reuses that order
+        instead of sorting.
+        """
+        if 'date_index' not in self._columns:
+            days = self.collection_dates().view(np.int64)
+            runs = list(self._runs())
+            order = None
+            if len(runs) == 1 and hasattr(runs[0][0], 'date_order'):
+                base, local = runs[0]
+                if len(local) == len(base) and (local == np.arange(len(base))).all():
+                    order = np.asarray(base.date_order(), dtype=np.int64)
+                elif (np.diff(local) > 0).all():
+                    rank = np.full(len(base), -1, dtype=np.int64)
+                    rank[local] = np.arange(len(local))
+                    order = rank[np.asarray(base.date_order(), dtype=np.int64)]
+                    order = order[order >= 0]
+            self._columns['date_index'] = DateIndex(days, order)
+        return self._columns['date_index']
+
+    def kmer_index(self):
+        """KmerIndex of the selected sequences (memoized; built on all cores)."""
+        if 'kmer_index' not in self._columns:
+            self._columns['kmer_index'] = KmerIndex.from_records(self)
+        return self._columns['kmer_index']
+
+    def accession_index(self):
+        """AccessionIndex of the selected records' headers (memoized)."""
+        if 'accessions' not in self._columns:
+            self._columns['accessions'] = AccessionIndex.from_records(self)
+        return self._columns['accessions']
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return self.take(np.arange(len(self.indices))[pos])
+        index = int(self.indices[pos])
+        b = int(np.searchsorted(self.offsets, index, side='right') - 1)
+        return self.bases[b][index - self.offsets[b]]
+
+    def take(self, positions):
+        """New view of the records at `positions` (relative to this view).
+
+        Memoized date, digest and GC columns are sliced rather than recomputed,
+        and the date and k-mer indexes are narrowed without rebuilding.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        view = RecordView(self.bases, self.indices[positions] if len(positions) else positions)
+        for key in ('collection_date', 'sequence_digest', 'gc_fraction'):
+            if key in self._columns:
+                view._columns[key] = self._columns[key][positions]
+        for key in ('date_index', 'kmer_index'):
+            if key in self._columns:
+                index = self._columns[key].take(positions)
+                if index is not None:
+                    view._columns[key] = index
+        return view
+
+    def extend(self, other):
+        """New view with the selection of view `other` appended after this one.
+
+        Bases are shared, not copied. Columns already memoized here are
+        carried over and only computed for `other`'s records, so charts and
+        statistics of a growing dataset cost work proportional to the new
+        records.
+        """
+        view = RecordView(self.bases + other.bases, np.concatenate([self.indices, other.indices + self.offsets[-1]]))
+        for key, column in self._columns.items():
+            if key == 'collection_date':
+                view._columns[key] = np.concatenate([column, other.collection_dates()])
+            elif key == 'sequence_digest':
+                view._columns[key] = np.concatenate([column, other.sequence_digests()])
+            elif key == 'gc_fraction':
+                view._columns[key] = np.concatenate([column, other.gc_fractions()])
+            elif key == 'date_index':
+                view._columns[key] = column.extend(other.date_index())
+            elif key == 'metadata_fields':
+                view._columns[key] = column | other.metadata_fields()
+            elif key in ('accessions', 'kmer_index'):
+                continue  # Rebuilt on demand: positions would need shifting per base
+            else:
+                codes, labels = column
+                new_codes, new_labels = other.metadata_codes(key[1])
+                merged, unique = pd.factorize(np.concatenate([labels, new_labels]))
+                view._columns[key] = (merged.astype(np.int64)[np.concatenate([codes, new_codes + len(labels)])],
+                                      np.asarray(unique, dtype=object))
+        return view
+
+    def __repr__(self):
+        return f"RecordView({len(self)} of {int(self.offsets[-1])} records, {len(self.bases)} bases)"
+
+
+def _iter_run(base, positions, with_sequence):
+    """Records of one base at `positions`, read in bulk where the base supports it."""
+    if hasattr(base, 'iter_records'):
+        return base.iter_records(positions, with_sequence=with_sequence)
+    return (base[i] for i in positions.tolist())
+
+
+class ConvertedRecords:
+    """Lazy overlay giving each record of a RecordView its standardized header.
+
+    Used by convert_headers on views so large (e.g. on-disk) datasets are not
+    materialized just to rename them.
+    """
+    def __init__(self, source):
+        self.source = source
+
+    def __len__(self):
+        return len(self.source)
+
+    def _convert(self, record):
+        header, seq, metadata = record
+        try:
+            return [FastaConverter.convert_header(metadata), seq, metadata]
+        except Exception:
+            return [header, seq, metadata]
+
+    def __getitem__(self, i):
+        return self._convert(self.source[i])
+
+    def iter_records(self, positions, with_sequence=True):
+        for record in self.source.take(positions).iter_records(with_sequence):
+            yield self._convert(record)
+
+    # Sequences are unchanged: per-sequence statistics come from the source
+    def sequence_lengths(self, positions):
+        return self.source.take(positions).sequence_lengths()
+
+    def longest_n_runs(self, positions):
+        return self.source.take(positions).longest_n_runs()
+
+    def gc_fractions(self, positions):
+        return self.source.take(positions).gc_fractions()
+
+    def sequence_digests(self, positions):
+        return self.source.take(positions).sequence_digests()
+
+    # Metadata is unchanged as well
+    def collection_dates(self, positions):
+        return self.source.take(positions).collection_dates()
+
+    def metadata_codes(self, field, positions):
+        return self.source.take(positions).metadata_codes(field)
+
+    def metadata_fields(self, positions):
+        return self.source.take(positions).metadata_fields()
+
+
+# ==================== EVENTS & RESULTS ====================
+class OperationCancelled(Exception):
+    """Raised inside an operation when its cancel event has been set."""
+
+
+class EngineEvent:
+    """A single log/status event emitted by an engine operation.
+
+    `key` optionally names a UI translation key so front-ends can show a
+    localized message instead of the English `message`.
+    """
+    def __init__(self, level, message, key=None):
+        self.level = level
+        self.message = message
+        self.key = key
+        self.timestamp = datetime.now()
+
+    def format(self):
+        return f"[{self.timestamp.strftime('%H:%M:%S')}] {self.level.upper()}: {self.message}"
+
+    def __repr__(self):
+        return f"EngineEvent({self.level!r}, {self.message!r})"
+
+
+class OperationResult:
+    """Outcome of a SequenceAnalyzer operation.
+
+    `applied` is False when the operation was rejected (bad parameters, no
+    data) and the caller should keep its current active set.
+    """
+    def __init__(self, operation_name, sequences, initial_count, removed_headers=None,
+                 errors=None, events=None, duration=0.0, applied=True, report_lines=None):
+        self.operation_name = operation_name
+        self.sequences = sequences
+        self.initial_count = initial_count
+        self.removed_headers = removed_headers or []
+        self.errors = errors or []
+        self.events = events if events is not None else []
+        self.duration = duration
+        self.applied = applied
+        self.report_lines = report_lines
+
+    @property
+    def final_count(self):
+        return len(self.sequences)
+
+    @property
+    def removed_count(self):
+        return self.initial_count - self.final_count
+
+    @property
+    def log_message(self):
+        return f"{self.operation_name}: Kept {self.final_count}, Removed {self.removed_count}"
+
+    def report(self):
+        """Plain-text report in the format shown on the Export tab."""
+        lines = [
+            f"Operation: {self.operation_name}",
+            f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        ]
+        if self.report_lines is not None:
+            lines.extend(self.report_lines)
+        else:
+            lines.extend([
+                f"Initial Count: {self.initial_count}",
+                f"Final Count: {self.final_count}",
+                f"Removed: {self.removed_count}",
+            ])
+        report = "\n".join(lines)
+        if self.removed_headers:
+            report += "\n\nRemoved Headers (sample):\n" + "\n".join(self.removed_headers[:5]) + ("\n..." if len(self.removed_headers) > 5 else "")
+        return report
+
+
+# ==================== PARSING ====================
+def _iter_raw_records(lines, errors):
+    """Yield (header, sequence) pairs from lines, appending problems to `errors`."""
+    header = None
+    seq_parts = []
+    line_num = 0
+
+    try:
+        for line_num, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith('>'):
+                if header is not None:
+                    sequence = "".join(seq_parts).upper().replace(" ", "").replace("-", "")
+                    if sequence:
+                        yield header, sequence
+                    else:
+                        errors.append(f"Line ~{line_num}: Empty sequence for header '{header}'")
+                header = line
+                seq_parts = []
+            elif header is not None:
+                seq_parts.append(line)
+            else:
+                errors.append(f"Line {line_num}: Sequence data before first header ('>'). Ignoring.")
+
+        if header is not None:
+            sequence = "".join(seq_parts).upper().replace(" ", "").replace("-", "")
+            if sequence:
+                yield header, sequence
+            else:
+                errors.append(f"End of file: Empty sequence for header '{header}'")
+
+    except Exception as e:
+        errors.append(f"Fatal parsing error around line {line_num}: {str(e)}")
+
+def sample_headers(lines):
+    """Headers of the first SCHEMA_SAMPLE records in `lines`, the sample a file's schema is chosen from."""
+    return [header for header, _ in itertools.islice(_iter_raw_records(lines, []), SCHEMA_SAMPLE)]
+
+def iter_fasta_records(lines, parser=None, errors=None, schema=None):
+    """Yield [header, sequence, metadata] records from an iterable of lines.
+
+    Works on any line source (str.splitlines(), an open or gzip file), so
+    large inputs can be streamed record by record. The header layout is
+    chosen once from the first SCHEMA_SAMPLE headers (see
+    FastaParser.header_parser), unless `schema` gives the FastaParser.file_schema()
+    name already chosen for the file (e.g. for a later chunk of it).
+    Problems are appended to `errors` when a list is given.
+    """
+    temp_parser = parser or FastaParser()
+    if errors is None:
+        errors = []
+    raw = _iter_raw_records(lines, errors)
+    sample = [] if schema else list(itertools.islice(raw, SCHEMA_SAMPLE))
+    try:
+        parse_header = temp_parser.header_parser([header for header, _ in sample], schema)
+        for header, sequence in itertools.chain(sample, raw):
+            yield [header, sequence, parse_header(header)]
+    except Exception as e:
+        errors.append(f"Fatal parsing error: {str(e)}")
+
+def parse_fasta_content(content_string, parser=None):
+    """Parses FASTA content string. Returns (sequences, errors)."""
+    errors = []
+    sequences = list(iter_fasta_records(content_string.splitlines(), parser=parser, errors=errors))
+    return sequences, errors
+
+
+def read_host_list(path):
+    """Host names from a text file, one per line ('#' starts a comment)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.split('#', 1)[0].strip() for line in f if line.split('#', 1)[0].strip()]
+
+
+# ==================== HEADER SCHEMAS ====================
+SUBTYPE_PATTERN = re.compile(r'/(H\d+N\d+)', re.IGNORECASE)
+PAREN_SUBTYPE_PATTERN = re.compile(r'\((H\d+N\d+)\)', re.IGNORECASE)
+ANY_SUBTYPE_PATTERN = re.compile(r'H\d+N\d+', re.IGNORECASE)
+NAME_YEAR_PATTERN = re.compile(r'/((?:19|20)\d{2})(?=\(|$)')
+SCHEMA_SAMPLE = 200  # Headers read before a file's schema is chosen
+SCHEMA_MIN_SHARE = 0.9  # Share of sampled headers a schema must match to be chosen
+PIPE_SCHEMA = "vir_seq_sift"
+NAME_SCHEMA = "isolate_name"
+PER_RECORD_SCHEMA = "per_record"  # file_schema() of files that fit no single schema: layout chosen per header
+
+
+def subtype_from_name(name):
+    """Subtype (e.g. 'H5N1') or influenza type ('A'/'B') from an isolate name."""
+    match = SUBTYPE_PATTERN.search(name)
+    if match:
+        return match.group(1).upper()
+    name_lower = name.lower()
+    if '(h' in name_lower and 'n' in name_lower:
+        match = PAREN_SUBTYPE_PATTERN.search(name)
+        if match:
+            return match.group(1).upper()
+    if name_lower.startswith('a/'): return 'A'
+    if name_lower.startswith('b/'): return 'B'
+    return DEFAULT_UNKNOWN
+
+def segment_from_name(name):
+    """'HA' or 'NA' when the isolate name mentions the segment."""
+    name_lower = name.lower()
+    if any(seg in name_lower for seg in ['/ha', '(ha)']): return 'HA'
+    if any(seg in name_lower for seg in ['/na', '(na)']): return 'NA'
+    return DEFAULT_UNKNOWN
+
+def year_from_name(name):
+    """January 1st of the year closing an isolate name (A/Boston/12/2012), or None."""
+    match = NAME_YEAR_PATTERN.search(name)
+    return datetime(int(match.group(1)), 1, 1) if match else None
+
+def clean_subtype(value):
+    """'H5N1' out of values like 'A_/_H5N1'; other values unchanged."""
+    match = ANY_SUBTYPE_PATTERN.search(value)
+    return match.group(0).upper() if match else value
+
+
+FIELD_CONVERTERS = {
+    'text': lambda value: value if value else DEFAULT_UNKNOWN,
+    'date': lru_cache(maxsize=65536)(parse_date),  # Collection dates repeat heavily within a file
+    'subtype': lambda value: clean_subtype(value) if value else DEFAULT_UNKNOWN,
+}
+
+
+class HeaderSchema:
+    """Declarative FASTA header layout.
+
+    `fields` names the metadata key of each `separator`-delimited part
+    (None/'' skips a part, 'key:converter' picks a FIELD_CONVERTERS entry;
+    collection_date parses dates by default). Alternatively `pattern` is a
+    regex whose named groups are metadata keys. `detect` is a regex that
+    headers from this source match, and `derive` lists keys filled from
+    the isolate name when the header does not supply them.
+    """
+    def __init__(self, name, fields=(), separator='|', pattern=None, detect=None,
+                 derive=('host', 'location'), min_fields=2, description=""):
+        self.name = name
+        self.separator = separator
+        self.pattern = re.compile(pattern) if pattern else None
+        if self.pattern is not None:
+            fields = list(self.pattern.groupindex)
+            min_fields = 1
+        self.fields = [self._field_spec(field) for field in fields]
+        for _, converter in self.fields:
+            if converter not in FIELD_CONVERTERS:
+                raise ValueError(f"Unknown field converter '{converter}' in header schema '{name}'")
+        self.detect = re.compile(detect) if detect else None
+        self.derive = tuple(derive)
+        self.min_fields = min_fields
+        self.description = description
+
+    @staticmethod
+    def _field_spec(field):
+        if not field:
+            return None, 'text'
+        key, _, converter = field.partition(':')
+        return key, converter or ('date' if key == 'collection_date' else 'text')
+
+    @classmethod
+    def from_dict(cls, spec):
+        """Schema from a JSON/YAML mapping with the constructor's keyword names."""
+        if not isinstance(spec, dict) or 'name' not in spec:
+            raise ValueError(f"Header schema needs a 'name': {spec!r}")
+        try:
+            return cls(**spec)
+        except TypeError as e:
+            raise ValueError(f"Invalid header schema '{spec['name']}': {e}")
+
+    def __repr__(self):
+        return f"HeaderSchema({self.name!r})"
+
+
+HEADER_SCHEMAS = {}  # name -> HeaderSchema, in detection priority order
+
+
+def register_schema(schema, first=False):
+    """Add or replace a header schema; `first=True` gives it detection priority."""
+    HEADER_SCHEMAS.pop(schema.name, None)
+    if first:
+        rest = dict(HEADER_SCHEMAS)
+        HEADER_SCHEMAS.clear()
+        HEADER_SCHEMAS[schema.name] = schema
+        HEADER_SCHEMAS.update(rest)
+    else:
+        HEADER_SCHEMAS[schema.name] = schema
+    return schema
+
+def get_schema(name):
+    if name not in HEADER_SCHEMAS:
+        raise ValueError(f"Unknown header schema '{name}'. Known: {', '.join(HEADER_SCHEMAS)}")
+    return HEADER_SCHEMAS[name]
+
+def detect_schema(headers):
+    """First registered schema whose `detect` matches SCHEMA_MIN_SHARE of the headers, or None."""
+    clean = [header.lstrip('>').strip() for header in headers]
+    if not clean:
+        return None
+    for schema in HEADER_SCHEMAS.values():
+        if schema.detect is not None and sum(1 for h in clean if schema.detect.search(h)) >= SCHEMA_MIN_SHARE * len(clean):
+            return schema
+    return None
+
+
+register_schema(HeaderSchema(
+    "gisaid_epiflu", ['isolate_name', 'isolate_id', 'type:subtype', 'segment', 'collection_date'],
+    detect=r'^[^|]+\|\s*EPI_ISL_\d+\s*\|',
+    description="GISAID EpiFlu export: name | EPI_ISL id | type | segment | collection date"))
+register_schema(HeaderSchema(
+    "ncbi_virus",
+    pattern=(r'^(?P<isolate_id>[A-Z]{1,2}_?\d{5,8}(?:\.\d+)?)\s.*?'
+             r'\((?P<isolate_name>[A-D]/[^()]*(?:\([^()]*\))?)\)'
+             r'(?:.*?\((?P<segment>PB2|PB1|PA|HA|NP|NA|MP|M|NS)\))?'),
+    detect=r'^[A-Z]{1,2}_?\d{5,8}(?:\.\d+)?\s',
+    derive=('host', 'location', 'type', 'segment', 'collection_date'),
+    description="NCBI Virus / GenBank: accession, title with (isolate name) and (segment)"))
+register_schema(HeaderSchema(
+    PIPE_SCHEMA, ['isolate_name', 'type', 'segment', 'collection_date', 'isolate_id', 'clade', 'host', 'location'],
+    detect=r'\|',
+    description="Vir-Seq-Sift pipe format: name | type | segment | date | id | clade | host | location"))
+register_schema(HeaderSchema(
+    NAME_SCHEMA, ['isolate_name'], separator=None, min_fields=1,
+    detect=r'^[^|]*$', derive=('host', 'location', 'type', 'segment'),
+    description="Isolate name only (e.g. A/chicken/Egypt/1/2020(H5N1))"))
+
+
+
+class FastaParser:
+    """Parse FASTA files and extract metadata
+
+    Host names are recognized with one compiled regex over `known_hosts`
+    (DEFAULT_HOSTS plus `extra_hosts`); use add_hosts() to extend it later.
+    Header layouts come from the schema registry: `schema` names a
+    registered HeaderSchema, or 'auto' picks one per file from a sample of
+    its headers (files that fit no single schema are parsed per record).
+    """
+    def __init__(self, extra_hosts=(), schema='auto'):
+        self.known_hosts = set(DEFAULT_HOSTS)
+        self.add_hosts(extra_hosts)
+        self.schema = schema
+        self._compiled = {}
+
+    def add_hosts(self, hosts):
+        """Add host names (matched case-insensitively, '_' as space) and recompile the matcher."""
+        self.known_hosts.update(h.strip().lower().replace('_', ' ') for h in hosts if h.strip())
+        alternatives = sorted(self.known_hosts, key=len, reverse=True)
+        self.host_pattern = re.compile('|'.join(map(re.escape, alternatives)) if alternatives else r'(?!)')
+        self._host_cache = {}
+
+    def _match_host(self, segment, next_segment):
+        """(host, location) for the 2nd and 3rd '/'-segments of an isolate name."""
+        potential_host = segment.lower().replace('_', ' ')
+        if potential_host == 'unknown' or self.host_pattern.search(potential_host):
+            return segment.capitalize(), next_segment.capitalize()
+        return DEFAULT_UNKNOWN, segment.capitalize()
+
+    def _extract_host_and_location(self, isolate_name):
+        """Extract host and location from isolate name"""
+        try:
+            parts = isolate_name.split('/', 3)
+            if len(parts) >= 3:
+                # Name prefixes repeat heavily ("A/chicken/Egypt/..."), so results are memoized
+                key = (parts[1], parts[2])
+                result = self._host_cache.get(key)
+                if result is None:
+                    if len(self._host_cache) >= HOST_CACHE_LIMIT:
+                        self._host_cache.clear()
+                    result = self._host_cache[key] = self._match_host(parts[1], parts[2])
+                return result
+            elif len(parts) == 2:
+                return DEFAULT_UNKNOWN, parts[1].capitalize()
+        except Exception:
+            pass
+        return DEFAULT_UNKNOWN, DEFAULT_UNKNOWN
+
+    def _fill_from_name(self, metadata, fields):
+        """Fill `fields` of metadata from its isolate name."""
+        name = metadata['isolate_name']
+        if 'host' in fields or 'location' in fields:
+            host, location = self._extract_host_and_location(name)
+            if 'host' in fields: metadata['host'] = host
+            if 'location' in fields: metadata['location'] = location
+        if 'type' in fields: metadata['type'] = subtype_from_name(name)
+        if 'segment' in fields: metadata['segment'] = segment_from_name(name)
+        if 'collection_date' in fields: metadata['collection_date'] = year_from_name(name)
+
+    def compile_schema(self, schema):
+        """Specialized header -> metadata function for one HeaderSchema (built once per parser)."""
+        if schema in self._compiled:
+            return self._compiled[schema]
+        slots = [(i, field, FIELD_CONVERTERS[converter]) for i, (field, converter) in enumerate(schema.fields) if field]
+        derive, fill, fallback = schema.derive, self._fill_from_name, self._parse_header
+
+        def new_metadata(header, clean):
+            return {
+                "original_header": header, "isolate_name": clean,
+                "type": DEFAULT_UNKNOWN, "segment": DEFAULT_UNKNOWN, "collection_date": None,
+                "isolate_id": DEFAULT_UNKNOWN, "clade": DEFAULT_UNKNOWN,
+                "host": DEFAULT_UNKNOWN, "location": DEFAULT_UNKNOWN
+            }
+
+        if schema.pattern is not None:
+            match = schema.pattern.match
+
+            def parse(header):
+                clean = header.lstrip('>').strip()
+                found = match(clean)
+                if found is None:
+                    return fallback(header)
+                metadata = new_metadata(header, clean)
+                given = set()
+                for _, field, convert in slots:
+                    value = found.group(field)
+                    if value and value.strip():
+                        metadata[field] = convert(value.strip())
+                        given.add(field)
+                fill(metadata, [field for field in derive if field not in given])
+                return metadata
+        else:
+            separator, min_fields = schema.separator, schema.min_fields
+
+            def parse(header):
+                clean = header.lstrip('>').strip()
+                parts = clean.split(separator) if separator else [clean]
+                if len(parts) < min_fields:
+                    return fallback(header)
+                metadata = new_metadata(header, clean)
+                given = set()
+                for i, field, convert in slots:
+                    if i < len(parts):
+                        value = parts[i].strip()
+                        if value:
+                            metadata[field] = convert(value)
+                            given.add(field)
+                fill(metadata, [field for field in derive if field not in given])
+                return metadata
+
+        self._compiled[schema] = parse
+        return parse
+
+    def file_schema(self, sample_headers=()):
+        """Name of the schema for one file with these sample headers (PER_RECORD_SCHEMA if none fits)."""
+        if self.schema != 'auto':
+            return self.schema
+        schema = detect_schema(sample_headers)
+        return schema.name if schema is not None else PER_RECORD_SCHEMA
+
+    def header_parser(self, sample_headers=(), schema=None):
+        """Header -> metadata function for one file, chosen once from a sample of its headers (or named by `schema`)."""
+        name = schema or self.file_schema(sample_headers)
+        if name == PER_RECORD_SCHEMA:
+            return self._parse_header
+        return self.compile_schema(get_schema(name))
+
+    def _parse_header(self, header):
+        """Parse FASTA header and extract metadata (layout chosen per record)"""
+        return self.compile_schema(HEADER_SCHEMAS[PIPE_SCHEMA if '|' in header else NAME_SCHEMA])(header)
+
+    def parse(self, file_content_string):
+        """Parse FASTA content string. Returns (sequences, errors)."""
+        return parse_fasta_content(file_content_string, parser=self)
+
+
+class FastaConverter:
+    """Convert FASTA headers to standardized format"""
+    def __init__(self, sequences):
+        self.sequences = sequences
+
+    @staticmethod
+    def convert_header(metadata):
+        """Build the standardized pipe-format header for a metadata dict."""
+        date_obj = metadata.get("collection_date")
+        date_str = date_obj.strftime("%Y-%m-%d") if date_obj else "Unknown"
+
+        parts = [
+            metadata.get('isolate_name', 'Unknown'),
+            metadata.get('type', 'Unknown'),
+            metadata.get('segment', 'Unknown'),
+            date_str,
+            metadata.get('isolate_id', 'Unknown'),
+            metadata.get('clade', 'Unknown'),
+            metadata.get('host', 'Unknown'),
+            metadata.get('location', 'Unknown')
+        ]
+
+        header_parts = [str(p) for p in parts if p and p != "Unknown"]
+        return ">" + "|".join(header_parts)
+
+    def run(self):
+        """Convert headers to pipe format"""
+        converted = []
+        errors = []
+
+        for header, seq, metadata in self.sequences:
+            try:
+                converted.append([self.convert_header(metadata), seq, metadata])
+            except Exception as e:
+                errors.append(f"Error converting header '{header}': {str(e)}")
+                converted.append([header, seq, metadata])
+
+        return converted, errors
+
+
+# ==================== ANALYZER ====================
+class SequenceAnalyzer:
+    """Analyze and filter FASTA sequences.
+
+    Filtering operations return an OperationResult; nothing here touches UI
+    state. Pass `on_event` to receive EngineEvents as they happen,
+    `on_progress` to receive a 0..1 completion fraction, and a
+    `threading.Event` as `cancel_event` to abort long loops with
+    OperationCancelled.
+
+    Input is wrapped in a RecordView and filters select records rather than
+    rebuild them, so every result is a view over the same shared records.
+    """
+    def __init__(self, sequences, on_event=None, on_progress=None, cancel_event=None):
+        if not isinstance(sequences, RecordView):
+            sequences = RecordView([sequences if isinstance(sequences, list) else list(sequences)])
+        self.sequences = sequences
+        self.original_count_for_last_op = len(sequences)
+        self.on_event = on_event
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.events = []
+        self._start_time = None
+
+    def _records(self, with_sequence=True):
+        """Iterate the input records; metadata-only passes skip on-disk/packed sequence data."""
+        return self.sequences.iter_records(with_sequence)
+
+    def _check(self, done, total):
+        """Report progress and raise OperationCancelled if cancellation was requested."""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise OperationCancelled()
+        if self.on_progress is not None and total:
+            self.on_progress(done / total)
+
+    def _track(self, items, total=None):
+        """Iterate `items`, reporting progress and honouring cancellation."""
+        total = len(items) if total is None else total
+        for i, item in enumerate(items):
+            if i % PROGRESS_EVERY == 0:
+                self._check(i, total)
+            yield item
+        if self.on_progress is not None:
+            self.on_progress(1.0)
+
+    def _per_sequence(self, method):
+        """A RecordView statistic (e.g. "sequence_lengths") over the input, computed in chunks."""
+        total = len(self.sequences)
+        parts = [getattr(self.sequences.take([]), method)()]  # Typed empty result
+        for start in range(0, total, VIEW_CHUNK):
+            self._check(start, total)
+            chunk = self.sequences.take(np.arange(start, min(start + VIEW_CHUNK, total)))
+            parts.append(getattr(chunk, method)())
+        if self.on_progress is not None:
+            self.on_progress(1.0)
+        return np.concatenate(parts)
+
+    def _emit(self, level, message, key=None):
+        """Record an event and forward it to the listener, if any."""
+        event = EngineEvent(level, message, key=key)
+        self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+        return event
+
+    def _start(self, operation_name):
+        self.events = []
+        self._start_time = time.time()
+        self._emit('info', f"Started: {operation_name}")
+
+    def _complete(self, message):
+        """Emit the completion event and return the elapsed time."""
+        duration = time.time() - self._start_time if self._start_time else 0.0
+        self._start_time = None
+        self._emit('success', f"Completed: {message} (Duration: {duration:.2f}s)")
+        return duration
+
+    def _rejected(self, operation_name, message, key=None):
+        """Result for an operation that could not run; the active set is unchanged."""
+        self._emit('error', message, key=key)
+        return OperationResult(operation_name, self.sequences, len(self.sequences),
+                               events=self.events, applied=False)
+
+    def _take(self, positions):
+        """View of the input records at `positions`."""
+        return self.sequences.take(positions)
+
+    def _removed_headers(self, kept_positions):
+        """Headers of all records not at `kept_positions`."""
+        kept = set(kept_positions)
+        return [item[0] for i, item in enumerate(self._records(with_sequence=False)) if i not in kept]
+
+    def _finish(self, result_sequences, operation_name, removed_headers=None):
+        """Build the OperationResult for a completed filtering step."""
+        result = OperationResult(operation_name, result_sequences, self.original_count_for_last_op,
+                                 removed_headers=removed_headers, events=self.events)
+        result.duration = self._complete(result.log_message)
+        return result
+
+    def convert_headers(self):
+        """Convert headers to standardized pipe format"""
+        operation_name = "Convert Headers"
+        self._start(operation_name)
+        # Headers are converted lazily; only the metadata is checked up front
+        errors = []
+        for header, _, metadata in self._track(self._records(with_sequence=False), len(self.sequences)):
+            try:
+                FastaConverter.convert_header(metadata)
+            except Exception as e:
+                errors.append(f"Error converting header '{header}': {str(e)}")
+        converted_seqs = RecordView([ConvertedRecords(self.sequences)])
+        for err in errors:
+            self._emit('warning', err)
+
+        result = OperationResult(operation_name, converted_seqs, len(self.sequences), errors=errors,
+                                 events=self.events,
+                                 report_lines=[f"Headers Processed: {len(converted_seqs)}", f"Errors: {len(errors)}"])
+        result.duration = self._complete(operation_name)
+        return result
+
+    def quality_filter(self, min_length=200, max_n_run=100):
+        """Filter by sequence quality"""
+        operation_name = f"Quality Filter (MinLen={min_length}, MaxN={max_n_run})"
+        self._start(operation_name)
+        keep = self._per_sequence('sequence_lengths') >= min_length
+        keep &= self._per_sequence('longest_n_runs') <= max_n_run
+        kept = np.flatnonzero(keep)
+        removed_headers = [header for (header, _, _), ok in zip(self._records(with_sequence=False), keep) if not ok]
+
+        return self._finish(self._take(kept), operation_name, removed_headers)
+
+    def deduplicate_basic(self):
+        """Remove duplicate sequences based on sequence only."""
+        operation_name = "Basic Deduplication (Sequence Only)"
+        self._start(operation_name)
+        digests = self._per_sequence('sequence_digests').tolist()
+        seen = set()
+        kept = []
+        removed_headers = []
+
+        for i, ((header, _, _), digest) in enumerate(zip(self._records(with_sequence=False), digests)):
+            if digest not in seen:
+                seen.add(digest)
+                kept.append(i)
+            else:
+                removed_headers.append(header)
+
+        return self._finish(self._take(kept), operation_name, removed_headers)
+
+    def deduplicate_advanced(self):
+        """Remove duplicates preserving subtype diversity per sequence."""
+        operation_name = "Advanced Deduplication (Seq + Subtype)"
+        self._start(operation_name)
+        digests = self._per_sequence('sequence_digests').tolist()
+        sequence_groups = defaultdict(list)
+        for i, ((header, _, metadata), digest) in enumerate(zip(self._records(with_sequence=False), digests)):
+            sequence_groups[digest].append((header, i, metadata.get('type', DEFAULT_UNKNOWN)))
+
+        kept = []
+        removed_headers = []
+
+        for group in sequence_groups.values():
+            if len(group) == 1:
+                kept.append(group[0][1])
+            else:
+                kept_subtypes_for_seq = set()
+                for header, i, subtype in sorted(group):
+                    if subtype not in kept_subtypes_for_seq:
+                        kept.append(i)
+                        kept_subtypes_for_seq.add(subtype)
+                    else:
+                        removed_headers.append(header)
+
+        kept.sort()
+        return self._finish(self._take(kept), operation_name, removed_headers)
+
+    def filter_by_subtype(self, target_subtypes):
+        """Filter sequences by specific subtypes."""
+        if not target_subtypes or 'All' in target_subtypes:
+            self.events = []
+            return self._rejected("Filter by Subtype", "Please select a subtype (or 'All') or enter custom subtypes.",
+                                  key="warning_select_subtype")
+
+        target_set = {s.strip().upper() for s in target_subtypes}
+        operation_name = f"Filter by Subtype ({', '.join(target_set)})"
+        self._start(operation_name)
+        kept = []
+        removed_headers = []
+
+        for i, (header, seq, metadata) in enumerate(self._track(self._records(with_sequence=False), len(self.sequences))):
+            seq_type = str(metadata.get('type', '')).strip().upper()
+            if any(target in seq_type for target in target_set if target):
+                kept.append(i)
+            else:
+                removed_headers.append(header)
+
+        return self._finish(self._take(kept), operation_name, removed_headers)
+
+    def get_subtype_distribution(self):
+        """Get subtype distribution counts."""
+        self._start("Calculating Subtype Distribution")
+        counts = Counter(m.get('type', DEFAULT_UNKNOWN) for _, _, m in self._records(with_sequence=False))
+        self._complete("Subtype distribution calculated")
+        return counts
+
+    def get_metadata_distribution(self, field):
+        """Get distribution counts for any metadata field."""
+        self._start(f"Calculating {field} Distribution")
+        if field == 'year':
+            counts = Counter(str(m['collection_date'].year) for _, _, m in self._records(with_sequence=False) if m.get('collection_date'))
+        elif field == 'month':
+            counts = Counter(m['collection_date'].strftime('%Y-%m') for _, _, m in self._records(with_sequence=False) if m.get('collection_date'))
+        else:
+            counts = Counter(str(m.get(field, DEFAULT_UNKNOWN)) for _, _, m in self._records(with_sequence=False))
+        self._complete(f"{field} distribution calculated")
+        return counts
+
+    def enhanced_temporal_filter(self, group_by="location_host",
+                                  sort_by="date", keep_per_group="both", custom_grouping=None):
+        """Keep the first and/or last record of each group, in `sort_by` order.
+
+        Groups are combined dictionary codes of the grouping fields ('month'
+        is the month of the year). Date order comes from the view's
+        DateIndex and other sort keys are ranked codes, so first/last per
+        group are found with np.unique instead of a sort and groupby per run.
+        """
+        operation_name = f"Enhanced Temporal Filter (Group={group_by}, Sort={sort_by}, Keep={keep_per_group})"
+        self._start(operation_name)
+
+        if not self.sequences:
+            return self._rejected(operation_name, "No sequences loaded or active.", key="no_sequences_error")
+
+        if group_by == 'none':
+            group_keys = []
+        elif group_by == 'custom' and custom_grouping:
+            group_keys = list(custom_grouping)
+        else:
+            group_keys = TEMPORAL_GROUP_MAP.get(group_by, ['location', 'host', 'month', 'clade'])
+        custom = group_by == 'custom' and bool(custom_grouping)
+
+        def column(field):
+            """Integer codes and their sort ranks for a grouping/sort field."""
+            if field == 'month' and not custom:
+                dates = self.sequences.collection_dates()
+                months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+                months[np.isnat(dates)] = -1
+                return months, None
+            codes, labels = self.sequences.metadata_codes(field)
+            ranks = np.empty(len(labels), dtype=np.int64)
+            ranks[np.argsort(labels, kind='stable')] = np.arange(len(labels))
+            return codes, ranks
+
+        index = self.sequences.date_index()
+        if sort_by == 'date':
+            order = index.order[:index.dated]
+        elif sort_by in ('location', 'host', 'clade', 'isolate_id', 'month'):
+            codes, ranks = column(sort_by)
+            order = np.argsort(codes if ranks is None else ranks[codes], kind='stable')
+        else:
+            order = index.order
+        if not len(order):
+            return self._rejected(operation_name, "No sequences remaining after removing items without sort key.",
+                                  key="no_sequences_after_filter")
+
+        group_ids = np.zeros(len(self.sequences), dtype=np.int64)
+        for field in group_keys:
+            codes = column(field)[0]
+            group_ids = pd.factorize(group_ids * (int(codes.max()) + 2) + codes + 1)[0].astype(np.int64)
+
+        ordered = group_ids[order]
+        kept = []
+        if keep_per_group in ("first", "both"):
+            kept.append(order[np.unique(ordered, return_index=True)[1]])
+        if keep_per_group in ("last", "both"):
+            kept.append(order[len(order) - 1 - np.unique(ordered[::-1], return_index=True)[1]])
+        kept = np.unique(np.concatenate(kept)).tolist() if kept else []
+        return self._finish(self._take(kept), operation_name, self._removed_headers(kept))
+
+    def filter_clade_monthly(self, mode, targets, keep_strategy, separate=True):
+        """Handles both single and multiple clade monthly filtering."""
+        if not targets:
+            self.events = []
+            return self._rejected("Clade Monthly Filter", "No target clades specified for filtering.")
+
+        target_clades_set = set(targets)
+        target_display = targets[0] if mode == 'single' else f"{len(target_clades_set)} clades"
+        operation_name = f"{mode.capitalize()} Clade Monthly Filter ({target_display}, Keep={keep_strategy}, Separate={separate if mode=='multiple' else 'N/A'})"
+        self._start(operation_name)
+
+        codes, labels = self.sequences.metadata_codes('clade')
+        target_codes = np.flatnonzero(np.isin(labels, list(target_clades_set)))
+        in_target = np.isin(codes, target_codes)
+
+        if not in_target.any():
+            self._emit('error', "No sequences found for the specified clades.")
+            return self._finish(self._take([]), operation_name, [h for h, _, _ in self._records(with_sequence=False)])
+
+        if mode == 'single' or not separate:
+            groups = [in_target]
+        else:
+            groups = [codes == code for code in target_codes]
+        kept = np.unique(np.concatenate([self._process_monthly_groups(group, keep_strategy) for group in groups]))
+        kept = kept.tolist()
+        return self._finish(self._take(kept), operation_name, self._removed_headers(kept))
+
+    def _process_monthly_groups(self, selected, keep_strategy):
+        """Kept positions among the `selected` records (boolean mask), month by month.
+
+        Months are slices of the view's DateIndex. Within a month records
+        are ordered by date, then header, so headers are read only for
+        records sharing the month's first or last day. Undated records and
+        months with a single record are kept.
+        """
+        index = self.sequences.date_index()
+        days = self.sequences.collection_dates().view(np.int64)
+        undated = index.undated()
+        kept_positions = [undated[selected[undated]]]
+        months = []
+        for _, positions in index.months():
+            positions = positions[selected[positions]]
+            if len(positions) <= 1:
+                kept_positions.append(positions)
+                continue
+            head = positions[days[positions] == days[positions[0]]]
+            tail = positions[days[positions] == days[positions[-1]]]
+            months.append((head, tail))
+        if not months:
+            return np.concatenate(kept_positions)
+
+        candidates = np.unique(np.concatenate([part for pair in months for part in pair]))
+        headers = dict(zip(candidates.tolist(), (record[0] for record in
+                                                 self._take(candidates).iter_records(with_sequence=False))))
+        for head, tail in months:
+            first = min(head.tolist(), key=headers.__getitem__)
+            last = max(reversed(tail.tolist()), key=headers.__getitem__)
+            if keep_strategy == "First Only":
+                kept_positions.append([first])
+            elif keep_strategy == "Last Only":
+                kept_positions.append([last])
+            else:
+                kept_positions.append([first] if headers[first] == headers[last] else [first, last])
+        return np.concatenate([np.asarray(part, dtype=np.int64) for part in kept_positions])
+
+    def _strata_ids(self, fields):
+        """Group number of each record for combinations of metadata fields ('year'/'month' are calendar periods)."""
+        group_ids = np.zeros(len(self.sequences), dtype=np.int64)
+        for field in fields:
+            if field in SAMPLE_PERIODS:
+                periods = self.sequences.collection_dates().astype(f'datetime64[{SAMPLE_PERIODS[field]}]')
+                codes = pd.factorize(periods)[0].astype(np.int64)  # Undated: -1
+            else:
+                codes = self.sequences.metadata_codes(field)[0]
+            group_ids = pd.factorize(group_ids * (int(codes.max(initial=0)) + 2) + codes + 1)[0].astype(np.int64)
+        return group_ids
+
+    def random_sample(self, size, seed=0):
+        """Keep `size` records drawn uniformly at random (reproducible for a seed; see sample_keys)."""
+        operation_name = f"Random Sample (N={size}, Seed={seed})"
+        self._start(operation_name)
+        if size < 1:
+            return self._rejected(operation_name, "Sample size must be at least 1.", key="sample_size_error")
+        if size >= len(self.sequences):
+            kept = np.arange(len(self.sequences))
+        else:
+            kept = np.sort(np.argpartition(sample_keys(np.arange(len(self.sequences)), seed), size - 1)[:size])
+        return self._finish(self._take(kept), operation_name, self._removed_headers(kept.tolist()))
+
+    def stratified_sample(self, strata=('location', 'month'), per_stratum=None, total=None, seed=0):
+        """Keep a random sample of each stratum (combination of `strata` field values).
+
+        Either up to `per_stratum` records per stratum, or `total` records
+        split across strata in proportion to their sizes. Within a stratum
+        the records with the smallest sample_keys() are kept, computed for
+        all records at once.
+        """
+        strata = list(strata)
+        mode = f"N={per_stratum} per stratum" if per_stratum else f"Total={total}, proportional"
+        operation_name = f"Stratified Sample ({' x '.join(strata) or 'none'}, {mode}, Seed={seed})"
+        self._start(operation_name)
+        if not (per_stratum or total) or (per_stratum or total) < 1:
+            return self._rejected(operation_name, "Sample size must be at least 1.", key="sample_size_error")
+        if not self.sequences:
+            return self._rejected(operation_name, "No sequences loaded or active.", key="no_sequences_error")
+
+        strata_ids = self._strata_ids(strata)
+        order = np.lexsort((sample_keys(np.arange(len(strata_ids)), seed), strata_ids))
+        sorted_ids = strata_ids[order]
+        sizes = np.bincount(strata_ids)
+        firsts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        ranks = np.arange(len(order)) - firsts[sorted_ids]
+        quotas = np.minimum(sizes, per_stratum) if per_stratum else proportional_quotas(sizes, total)
+        kept = np.sort(order[ranks < quotas[sorted_ids]])
+        result = self._finish(self._take(kept), operation_name, self._removed_headers(kept.tolist()))
+        result.report_lines = [
+            f"Initial Count: {result.initial_count}",
+            f"Final Count: {result.final_count}",
+            f"Strata: {len(sizes)} (sizes {int(sizes.min())}-{int(sizes.max())})",
+        ]
+        return result
+
+    def diversity_filter(self, group_by="clade", per_group=5, custom_grouping=None, workers=None):
+        """Keep up to `per_group` mutually distant records per group (farthest-point sampling).
+
+        Groups are as in enhanced_temporal_filter, except that 'month' is
+        the calendar month (year and month). Equal-length groups are
+        compared by Hamming distance, others by k-mer Jaccard distance (see
+        fasta_diversity); groups run on `workers` threads. Only the
+        sequences of each large group's thinned candidates are read.
+        """
+        operation_name = f"Diversity Sampling (Group={group_by}, Keep={per_group})"
+        self._start(operation_name)
+        if not self.sequences:
+            return self._rejected(operation_name, "No sequences loaded or active.", key="no_sequences_error")
+        if per_group < 1:
+            return self._rejected(operation_name, "Keep at least one record per group.", key="diversity_per_group_error")
+
+        if group_by == 'none':
+            group_keys = []
+        elif group_by == 'custom' and custom_grouping:
+            group_keys = list(custom_grouping)
+        else:
+            group_keys = TEMPORAL_GROUP_MAP.get(group_by, ['clade'])
+        group_ids = self._strata_ids(group_keys)
+        order = np.argsort(group_ids, kind='stable')
+        bounds = np.flatnonzero(np.diff(group_ids[order])) + 1
+        members = np.split(order, bounds)
+        kept = [group for group in members if len(group) <= per_group]
+        large = [group for group in members if len(group) > per_group]
+        candidates = [positions[thin_candidates(len(positions))] for positions in large]
+
+        def groups():
+            for number, positions in enumerate(candidates):
+                yield number, [record[1] or '' for record in self._take(positions).iter_records()]
+
+        methods = Counter()
+        for number, picks, method in representatives_by_group(groups(), per_group, workers=workers):
+            kept.append(candidates[number][picks])
+            methods[method] += 1
+        kept = np.sort(np.concatenate(kept)) if kept else np.empty(0, dtype=np.int64)
+        result = self._finish(self._take(kept), operation_name, self._removed_headers(kept.tolist()))
+        result.report_lines = [
+            f"Initial Count: {result.initial_count}",
+            f"Final Count: {result.final_count}",
+            f"Groups: {len(members)} ({len(large)} sampled)",
+            f"Distance: Hamming for {methods[HAMMING]} groups, k-mer Jaccard for {methods[JACCARD]} groups",
+        ]
+        return result
+
+    def extract_accessions(self, kinds=ACCESSION_KINDS[:2]):
+        """Unique accessions of the given kinds (default: GISAID EPI_ISL and EPI IDs), in record order."""
+        self._start("Extracting Accession Numbers")
+        accessions = self.sequences.accession_index().extract(kinds)
+        self._complete(f"Found {len(accessions)} unique accessions ({', '.join(kinds)})")
+        return accessions
+
+    def filter_by_list(self, values, field='accession', exclude=False):
+        """Keep (or with `exclude`, drop) records whose `field` is one of `values`.
+
+        The list is hashed once and joined against the field's
+        dictionary-encoded column, so a run costs O(n + m) for n records and
+        m values. Values are compared trimmed and case-insensitively.
+        `field='accession'` matches accession IDs anywhere in the header
+        through the view's AccessionIndex, ignoring GenBank version suffixes.
+        Values that match no record are reported.
+        """
+        values = list(values)
+        operation_name = list_filter_name(field, len(values), exclude)
+        self._start(operation_name)
+        if not values:
+            return self._rejected(operation_name, "No values given for the list filter", key="id_list_empty")
+        if field == 'accession':
+            positions, unmatched = self.sequences.accession_index().lookup(values)
+            matched = np.zeros(len(self.sequences), dtype=bool)
+            matched[positions] = True
+        else:
+            codes, labels = self.sequences.metadata_codes(field)
+            query, originals = unique_query(values)
+            label_keys = text_keys(labels)
+            label_hit = query.get_indexer(label_keys) >= 0
+            matched = label_hit[codes]
+            found = query.isin(label_keys[label_hit])
+            unmatched = [value for value, ok in zip(originals, found) if not ok]
+        keep = ~matched if exclude else matched
+        if unmatched:
+            self._emit('warning', f"{len(unmatched)} listed values matched no record: {', '.join(unmatched[:10])}"
+                                  + (" ..." if len(unmatched) > 10 else ""))
+        removed_headers = [header for (header, _, _), ok in zip(self._records(with_sequence=False), keep) if not ok]
+        result = self._finish(self._take(np.flatnonzero(keep)), operation_name, removed_headers)
+        result.report_lines = [
+            f"Initial Count: {result.initial_count}",
+            f"Final Count: {result.final_count}",
+            f"Removed: {result.removed_count}",
+            f"Values Given: {len(values)}",
+            f"Values Not Found: {len(unmatched)}",
+        ] + ([f"Not Found (sample): {', '.join(unmatched[:20])}"] if unmatched else [])
+        return result
+
+    def filter_by_accessions(self, accessions, exclude=False):
+        """filter_by_list() over accession IDs found in the headers."""
+        return self.filter_by_list(accessions, 'accession', exclude)
+
+    def nearest_sequences(self, query, top_n=10):
+        """The top_n records most similar to a query sequence, best first, as a DataFrame.
+
+        Similarity is the Jaccard index of FracMinHash k-mer sketches from
+        the view's KmerIndex, with the identity it implies (Mash distance).
+        """
+        index = self.sequences.kmer_index()
+        positions, jaccard, shared = index.nearest(clean_sequence(query), top_n)
+        headers = [record[0] for record in self._take(positions).iter_records(with_sequence=False)]
+        return pd.DataFrame({
+            'Position': positions, 'Header': headers, 'Shared k-mers': shared,
+            'Jaccard': np.round(jaccard, 4), 'Identity (est.)': np.round(mash_identity(jaccard, index.k), 4),
+        })
+
+    def query_sketch_size(self, query):
+        """Sketch k-mers of a query sequence; 0 means it is too short to search by similarity."""
+        return len(self.sequences.kmer_index().sketch(clean_sequence(query)))
+
+    def filter_similar(self, query, top_n=100):
+        """Keep the top_n records most similar to a query sequence (see nearest_sequences).
+
+        Rejected (the active set is kept) when the query has no sketch
+        k-mers or no record shares any with it.
+        """
+        operation_name = f"Similarity Filter (Top {top_n})"
+        self._start(operation_name)
+        query = clean_sequence(query)
+        if not query:
+            return self._rejected(operation_name, "No query sequence given", key="similar_query_empty")
+        if not self.query_sketch_size(query):
+            return self._rejected(operation_name, f"The query ({len(query)} bp) has no sketch k-mers; "
+                                  "use a longer query or the motif filter", key="similar_query_short")
+        nearest = self.nearest_sequences(query, top_n)
+        if nearest.empty:
+            return self._rejected(operation_name, "No active sequence shares k-mers with the query", key="similar_none")
+        kept = np.sort(nearest['Position'].to_numpy())
+        result = self._finish(self._take(kept), operation_name, self._removed_headers(kept.tolist()))
+        result.report_lines = [
+            f"Initial Count: {result.initial_count}",
+            f"Final Count: {result.final_count}",
+            f"Query Length: {len(query)}",
+            "Nearest (Identity est. / Jaccard):",
+        ] + [f"  {header} ({identity:.2%} / {jaccard:.3f})" for header, identity, jaccard
+             in zip(*(nearest[column].head(20) for column in ('Header', 'Identity (est.)', 'Jaccard')))]
+        return result
+
+    def filter_by_motif(self, motif, exclude=False):
+        """Keep (or with `exclude`, drop) records whose sequence contains `motif` (case-insensitive).
+
+        Only records passing the KmerIndex bitmap pre-screen are read and
+        searched.
+        """
+        motif = clean_sequence(motif)
+        operation_name = f"{'Exclude' if exclude else 'Filter by'} Motif ({motif[:30]}{'...' if len(motif) > 30 else ''})"
+        self._start(operation_name)
+        if not motif:
+            return self._rejected(operation_name, "No motif given", key="motif_empty")
+        candidates = self.sequences.kmer_index().motif_candidates(motif)
+        found = np.fromiter((motif in record[1].upper() for record in self._take(candidates).iter_records()),
+                            dtype=bool, count=len(candidates))
+        matched = np.zeros(len(self.sequences), dtype=bool)
+        matched[candidates[found]] = True
+        kept = np.flatnonzero(~matched if exclude else matched)
+        result = self._finish(self._take(kept), operation_name, self._removed_headers(kept.tolist()))
+        result.report_lines = [
+            f"Initial Count: {result.initial_count}",
+            f"Final Count: {result.final_count}",
+            f"Removed: {result.removed_count}",
+            f"Records Containing Motif: {int(matched.sum())}",
+            f"Records Searched: {len(candidates)}",
+        ]
+        return result
+
+    def filter_by_query(self, query):
+        """Keep records matching a query expression (see Query).
+
+        The expression is parsed once and evaluated with array operations
+        over the view's memoized date, length and dictionary-encoded
+        metadata columns, so one query replaces a chain of per-field filters
+        without a per-record pass.
+        """
+        operation_name = f"Query Filter ({query})"
+        self._start(operation_name)
+        try:
+            compiled = query if isinstance(query, Query) else Query(query)
+            keep = compiled.mask(self.sequences)
+        except QueryError as e:
+            return self._rejected(operation_name, f"Invalid query: {e}")
+        removed_headers = [header for (header, _, _), ok in zip(self._records(with_sequence=False), keep) if not ok]
+        result = self._finish(self._take(np.flatnonzero(keep)), operation_name, removed_headers)
+        result.report_lines = [
+            f"Initial Count: {result.initial_count}",
+            f"Final Count: {result.final_count}",
+            f"Removed: {result.removed_count}",
+            f"Query: {compiled.text}",
+        ]
+        return result
+
+
+# ==================== STREAMING OPERATIONS ====================
+class StreamOperation:
+    """Record-at-a-time counterpart of a SequenceAnalyzer operation.
+
+    `feed` returns the record to pass downstream (or None to hold/drop it);
+    `flush` returns any records held back until the end of the stream.
+    Stateless operations can run independently on chunks in worker processes.
+    """
+    name = "Stream Operation"
+    stateless = True
+
+    def feed(self, record):
+        return record
+
+    def flush(self):
+        return []
+
+
+class ConvertHeadersStream(StreamOperation):
+    name = "Convert Headers"
+
+    def feed(self, record):
+        header, seq, metadata = record
+        try:
+            return [FastaConverter.convert_header(metadata), seq, metadata]
+        except Exception:
+            return record
+
+
+class QualityFilterStream(StreamOperation):
+    def __init__(self, min_length=200, max_n_run=100):
+        self.min_length = min_length
+        self.max_n_run = max_n_run
+        self.name = f"Quality Filter (MinLen={min_length}, MaxN={max_n_run})"
+
+    def feed(self, record):
+        return record if passes_quality(record[1], self.min_length, self.max_n_run) else None
+
+
+class SubtypeFilterStream(StreamOperation):
+    def __init__(self, target_subtypes):
+        if isinstance(target_subtypes, str):
+            target_subtypes = target_subtypes.split(',')
+        self.target_set = {s.strip().upper() for s in target_subtypes if s.strip()}
+        if not self.target_set:
+            raise ValueError("filter_by_subtype needs at least one target subtype")
+        self.name = f"Filter by Subtype ({', '.join(sorted(self.target_set))})"
+
+    def feed(self, record):
+        seq_type = str(record[2].get('type', '')).strip().upper()
+        return record if any(target in seq_type for target in self.target_set) else None
+
+
+class ListFilterStream(StreamOperation):
+    """Streaming filter_by_list; values come from the step and/or a list file (`path`, one per line)."""
+    def __init__(self, field='accession', values=(), path=None, exclude=False):
+        values = [values] if isinstance(values, str) else list(values)
+        if path:
+            values += read_value_list(path)
+        if not values:
+            raise ValueError("filter_by_list needs 'values' or a 'path' to a list file")
+        self.field = field
+        self.exclude = exclude
+        self.keys = set(unique_query(values, accession_keys if field == 'accession' else text_keys)[0])
+        self.name = list_filter_name(field, len(self.keys), exclude)
+
+    def feed(self, record):
+        if self.field == 'accession':
+            keys = (match.group().split('.', 1)[0] for match in ACCESSION_PATTERN.finditer(record[0] or ''))
+            hit = any(key in self.keys for key in keys)
+        else:
+            hit = str(record[2].get(self.field, DEFAULT_UNKNOWN)).strip().casefold() in self.keys
+        return record if hit != self.exclude else None
+
+
+class QueryFilterStream(StreamOperation):
+    """Streaming filter_by_query; the expression is parsed once per worker."""
+    def __init__(self, query):
+        self.query = Query(query)
+        self.name = f"Query Filter ({self.query.text})"
+
+    def feed(self, record):
+        return record if self.query.test(record) else None
+
+
+class MotifFilterStream(StreamOperation):
+    """Streaming filter_by_motif (plain substring search per record)."""
+    def __init__(self, motif, exclude=False):
+        self.motif = clean_sequence(motif)
+        if not self.motif:
+            raise ValueError("filter_by_motif needs a 'motif'")
+        self.exclude = exclude
+        self.name = f"{'Exclude' if exclude else 'Filter by'} Motif ({self.motif})"
+
+    def feed(self, record):
+        return record if (self.motif in str(record[1]).upper()) != self.exclude else None
+
+
+class DeduplicateStream(StreamOperation):
+    """Streaming dedup keeping the first occurrence, backed by a DigestIndex.
+
+    With `advanced=True` the subtype is part of the key, mirroring
+    SequenceAnalyzer.deduplicate_advanced (first occurrence in input order is
+    kept rather than the first header in sort order).
+    """
+    stateless = False
+
+    def __init__(self, advanced=False, digest_index=None):
+        self.advanced = advanced
+        self.index = digest_index if digest_index is not None else DigestIndex()
+        self.name = "Advanced Deduplication (Seq + Subtype)" if advanced else "Basic Deduplication (Sequence Only)"
+
+    def seed(self, records):
+        """Mark the sequences of existing records as seen, so only new ones pass.
+
+        Basic dedup reads stored digests where `records` provides
+        `sequence_digests()` (workspaces); advanced dedup hashes each record.
+        """
+        if not self.advanced and hasattr(records, 'sequence_digests'):
+            self.index.update(records.sequence_digests())
+            return
+        for record in records:
+            self.feed(record)
+
+    def feed(self, record):
+        salt = record[2].get('type', DEFAULT_UNKNOWN) if self.advanced else ""
+        return record if self.index.add(sequence_digest(record[1], salt)) else None
+
+
+TEMPORAL_GROUP_MAP = {
+    "location_host_month_clade": ['location', 'host', 'month', 'clade'],
+    "location": ['location'], "host": ['host'], "clade": ['clade'],
+    "location_host": ['location', 'host'], "host_clade": ['host', 'clade'],
+}
+TEMPORAL_SORT_FIELDS = {'date', 'location', 'host', 'clade', 'isolate_id', 'month'}
+
+
+class TemporalFilterStream(StreamOperation):
+    """Streaming enhanced temporal filter.
+
+    Only the current first/last candidate of each group is held, so memory
+    grows with the number of groups rather than the number of records.
+    """
+    stateless = False
+
+    def __init__(self, group_by="location_host", sort_by="date", keep_per_group="both", custom_grouping=None):
+        self.group_by = group_by
+        self.sort_by = sort_by if sort_by in TEMPORAL_SORT_FIELDS else 'date'
+        self.keep_per_group = keep_per_group
+        if group_by == 'custom' and custom_grouping:
+            self.group_keys = list(custom_grouping)
+        elif group_by == 'none':
+            self.group_keys = []
+        else:
+            self.group_keys = TEMPORAL_GROUP_MAP.get(group_by, ['location', 'host', 'month', 'clade'])
+        self.groups = {}
+        self.position = 0
+        self.name = f"Enhanced Temporal Filter (Group={group_by}, Sort={sort_by}, Keep={keep_per_group})"
+
+    @staticmethod
+    def _field(metadata, field):
+        if field == 'month':
+            date_val = metadata.get('collection_date')
+            return str(date_val.month) if date_val else "-1"
+        if field == 'date':
+            return metadata.get('collection_date')
+        value = metadata.get(field, DEFAULT_UNKNOWN)
+        return DEFAULT_UNKNOWN if value is None else str(value)
+
+    def feed(self, record):
+        metadata = record[2]
+        if self.sort_by == 'month':
+            date_val = metadata.get('collection_date')
+            sort_value = date_val.month if date_val else -1
+        else:
+            sort_value = self._field(metadata, self.sort_by)
+        if self.sort_by == 'date' and sort_value is None:
+            return None
+        key = tuple(self._field(metadata, f) for f in self.group_keys)
+        rank = (sort_value, self.position, record)
+        self.position += 1
+        current = self.groups.get(key)
+        if current is None:
+            self.groups[key] = [rank, rank]
+        else:
+            if rank[:2] < current[0][:2]:
+                current[0] = rank
+            if rank[:2] >= current[1][:2]:
+                current[1] = rank
+        return None
+
+    def flush(self):
+        kept = {}
+        for first, last in self.groups.values():
+            if self.keep_per_group in ("first", "both"):
+                kept[first[1]] = first[2]
+            if self.keep_per_group in ("last", "both"):
+                kept[last[1]] = last[2]
+        self.groups = {}
+        return [kept[pos] for pos in sorted(kept)]
+
+
+class CladeMonthlyStream(StreamOperation):
+    """Streaming clade monthly filter (first/last per clade and month)."""
+    stateless = False
+
+    def __init__(self, targets, mode="multiple", keep_strategy="Both (First & Last)", separate=True):
+        if isinstance(targets, str):
+            targets = [t.strip() for t in targets.split(',') if t.strip()]
+        if not targets:
+            raise ValueError("filter_clade_monthly needs at least one target clade")
+        self.targets = set(targets)
+        self.keep_strategy = keep_strategy
+        self.separate = separate and mode == 'multiple'
+        self.groups = {}
+        self.position = 0
+        self.name = f"{mode.capitalize()} Clade Monthly Filter ({len(self.targets)} clades, Keep={keep_strategy})"
+
+    def feed(self, record):
+        metadata = record[2]
+        clade = metadata.get('clade')
+        if clade not in self.targets:
+            return None
+        date_val = metadata.get('collection_date')
+        if not date_val:
+            return record
+        key = (clade if self.separate else '*', date_val.strftime('%Y-%m'))
+        rank = ((date_val, record[0]), self.position, record)
+        self.position += 1
+        current = self.groups.get(key)
+        if current is None:
+            self.groups[key] = [rank, rank]
+        else:
+            if rank[0] < current[0][0]:
+                current[0] = rank
+            if rank[0] >= current[1][0]:
+                current[1] = rank
+        return None
+
+    def flush(self):
+        kept = {}
+        for first, last in self.groups.values():
+            if self.keep_strategy == "Last Only":
+                kept[last[1]] = last[2]
+                continue
+            kept[first[1]] = first[2]
+            if self.keep_strategy != "First Only" and last[2][0] != first[2][0]:
+                kept[last[1]] = last[2]
+        self.groups = {}
+        return [kept[pos] for pos in sorted(kept)]
+
+
+class ReservoirSampleStream(StreamOperation):
+    """Streaming random sample: holds the `size` records with the smallest sample keys seen so far.
+
+    Draws the same records as SequenceAnalyzer.random_sample for the same
+    records and seed; memory is bounded by `size`.
+    """
+    stateless = False
+
+    def __init__(self, size, seed=0):
+        if int(size) < 1:
+            raise ValueError("Sample size must be at least 1")
+        self.size = int(size)
+        self.seed = seed
+        self.position = 0
+        self.heap = []  # (-key, position, record): the largest kept key on top
+        self.name = f"Random Sample (N={size}, Seed={seed})"
+
+    def _offer(self, heap, limit, record):
+        item = (-sample_key(self.position, self.seed), self.position, record)
+        if len(heap) < limit:
+            heapq.heappush(heap, item)
+        elif item[0] > heap[0][0]:
+            heapq.heapreplace(heap, item)
+
+    def feed(self, record):
+        self._offer(self.heap, self.size, record)
+        self.position += 1
+        return None
+
+    def flush(self):
+        kept = sorted((position, record) for _, position, record in self.heap)
+        self.heap = []
+        return [record for _, record in kept]
+
+
+class StratifiedSampleStream(ReservoirSampleStream):
+    """Streaming stratified sample: one bounded reservoir per stratum.
+
+    Only `per_stratum` quotas can be streamed; proportional totals need
+    the stratum sizes up front.
+    """
+    def __init__(self, strata=('location', 'month'), per_stratum=None, total=None, seed=0):
+        if not per_stratum:
+            raise ValueError("Stratified sampling in a pipeline needs 'per_stratum' "
+                             "(proportional 'total' needs all records first)")
+        super().__init__(per_stratum, seed)
+        self.strata = list(strata)
+        self.reservoirs = {}
+        self.name = f"Stratified Sample ({' x '.join(self.strata) or 'none'}, N={per_stratum} per stratum, Seed={seed})"
+
+    def feed(self, record):
+        key = tuple(sample_stratum_value(record[2], field) for field in self.strata)
+        self._offer(self.reservoirs.setdefault(key, []), self.size, record)
+        self.position += 1
+        return None
+
+    def flush(self):
+        kept = sorted((position, record) for heap in self.reservoirs.values() for _, position, record in heap)
+        self.reservoirs = {}
+        return [record for _, record in kept]
+
+
+STREAM_OPERATIONS = {
+    "convert_headers": ConvertHeadersStream,
+    "quality_filter": QualityFilterStream,
+    "filter_by_subtype": SubtypeFilterStream,
+    "filter_by_list": ListFilterStream,
+    "filter_by_query": QueryFilterStream,
+    "filter_by_motif": MotifFilterStream,
+    "deduplicate_basic": lambda **kw: DeduplicateStream(advanced=False, **kw),
+    "deduplicate_advanced": lambda **kw: DeduplicateStream(advanced=True, **kw),
+    "enhanced_temporal_filter": TemporalFilterStream,
+    "filter_clade_monthly": CladeMonthlyStream,
+    "random_sample": ReservoirSampleStream,
+    "stratified_sample": StratifiedSampleStream,
+}
+
+
+def build_stream_operation(step):
+    """Create a StreamOperation from a pipeline step dict like {"op": "quality_filter", ...}."""
+    params = dict(step)
+    op_name = params.pop('op', None)
+    factory = STREAM_OPERATIONS.get(op_name)
+    if factory is None:
+        raise ValueError(f"Unknown pipeline operation '{op_name}'. Available: {', '.join(sorted(STREAM_OPERATIONS))}")
+    try:
+        return factory(**params)
+    except TypeError as e:
+        raise ValueError(f"Invalid parameters for '{op_name}': {e}") from e
+
+
+def write_fasta(sequences, handle):
+    """Write [header, seq, metadata] records to a text handle in FASTA format."""
+    for header, seq, _ in sequences:
+        h = header if isinstance(header, str) else str(header or '')
+        h = h if h.startswith('>') else '>' + h
+        s = seq if isinstance(seq, str) else str(seq or '')
+        handle.write(f"{h}\n{s}\n")
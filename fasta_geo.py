@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_geo.py
+
+Offline location normalization. Free-text locations parsed from headers
+("Usa", "United_states", "Ohio", "Viet nam") are mapped to ISO 3166-1
+alpha-3 country codes through a bundled gazetteer. Normalization runs once
+per distinct location string and is broadcast to records through the
+dictionary-encoded location column, so large datasets cost one array lookup.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from fasta_aggregate import as_view
+
+# ==================== GAZETTEER ====================
+# ISO3|Country name|aliases and sub-national names (lower case, ';'-separated)
+GAZETTEER = """
+AFG|Afghanistan|
+ALB|Albania|
+DZA|Algeria|
+AND|Andorra|
+AGO|Angola|
+ARG|Argentina|buenos aires
+ARM|Armenia|
+AUS|Australia|new south wales;victoria;queensland;western australia;south australia;tasmania;northern territory;sydney;melbourne;brisbane;perth;adelaide
+AUT|Austria|
+AZE|Azerbaijan|
+BHS|Bahamas|the bahamas
+BHR|Bahrain|
+BGD|Bangladesh|dhaka;chittagong
+BRB|Barbados|
+BLR|Belarus|
+BEL|Belgium|
+BLZ|Belize|
+BEN|Benin|
+BTN|Bhutan|
+BOL|Bolivia|
+BIH|Bosnia and Herzegovina|bosnia;bosnia herzegovina
+BWA|Botswana|
+BRA|Brazil|brasil;sao paulo;rio de janeiro;parana;santa catarina;rio grande do sul;minas gerais
+BRN|Brunei|brunei darussalam
+BGR|Bulgaria|
+BFA|Burkina Faso|
+BDI|Burundi|
+CPV|Cabo Verde|cape verde
+KHM|Cambodia|
+CMR|Cameroon|
+CAN|Canada|alberta;british columbia;manitoba;new brunswick;newfoundland;nova scotia;ontario;prince edward island;quebec;saskatchewan;yukon;nunavut;northwest territories;toronto;vancouver;montreal
+CAF|Central African Republic|
+TCD|Chad|
+CHL|Chile|
+CHN|China|anhui;beijing;chongqing;fujian;gansu;guangdong;guangxi;guizhou;hainan;hebei;heilongjiang;henan;hubei;hunan;inner mongolia;jiangsu;jiangxi;jilin;liaoning;ningxia;qinghai;shaanxi;shandong;shanghai;shanxi;sichuan;tianjin;tibet;xinjiang;yunnan;zhejiang;wuhan;shenzhen;guangzhou;nanjing;hangzhou;peoples republic of china;pr china;prc
+COL|Colombia|
+COM|Comoros|
+COG|Congo|republic of the congo;congo brazzaville
+COD|Democratic Republic of the Congo|dr congo;drc;congo kinshasa;democratic republic of congo
+CRI|Costa Rica|
+CIV|Cote d'Ivoire|cote divoire;ivory coast
+HRV|Croatia|
+CUB|Cuba|
+CYP|Cyprus|
+CZE|Czechia|czech republic
+DNK|Denmark|faroe islands
+DJI|Djibouti|
+DOM|Dominican Republic|
+ECU|Ecuador|
+EGY|Egypt|cairo;giza;alexandria
+SLV|El Salvador|
+GNQ|Equatorial Guinea|
+ERI|Eritrea|
+EST|Estonia|
+SWZ|Eswatini|swaziland
+ETH|Ethiopia|
+FJI|Fiji|
+FIN|Finland|
+FRA|France|paris;brittany;bretagne
+GAB|Gabon|
+GMB|Gambia|the gambia
+GEO|Georgia|republic of georgia
+DEU|Germany|deutschland;bavaria;bayern;berlin;lower saxony;niedersachsen;mecklenburg vorpommern
+GHA|Ghana|
+GRC|Greece|
+GRL|Greenland|
+GTM|Guatemala|
+GIN|Guinea|
+GNB|Guinea-Bissau|guinea bissau
+GUY|Guyana|
+HTI|Haiti|
+HND|Honduras|
+HKG|Hong Kong|hongkong;hk
+HUN|Hungary|
+ISL|Iceland|
+IND|India|maharashtra;kerala;west bengal;karnataka;tamil nadu;delhi;new delhi;mumbai;pune
+IDN|Indonesia|java;west java;east java;central java;bali;sumatra;jakarta
+IRN|Iran|islamic republic of iran
+IRQ|Iraq|
+IRL|Ireland|republic of ireland
+ISR|Israel|
+ITA|Italy|lombardy;lombardia;veneto;emilia romagna
+JAM|Jamaica|
+JPN|Japan|hokkaido;aomori;iwate;miyagi;akita;yamagata;fukushima;ibaraki;tochigi;gunma;saitama;chiba;tokyo;kanagawa;niigata;toyama;ishikawa;fukui;yamanashi;nagano;gifu;shizuoka;aichi;mie;shiga;kyoto;osaka;hyogo;nara;wakayama;tottori;shimane;okayama;hiroshima;yamaguchi;tokushima;kagawa;ehime;kochi;fukuoka;saga;nagasaki;kumamoto;oita;miyazaki;kagoshima;okinawa
+JOR|Jordan|
+KAZ|Kazakhstan|
+KEN|Kenya|nairobi
+KWT|Kuwait|
+KGZ|Kyrgyzstan|kyrgyz republic
+LAO|Laos|lao;lao pdr;lao peoples democratic republic
+LVA|Latvia|
+LBN|Lebanon|
+LSO|Lesotho|
+LBR|Liberia|
+LBY|Libya|
+LIE|Liechtenstein|
+LTU|Lithuania|
+LUX|Luxembourg|
+MAC|Macao|macau
+MDG|Madagascar|
+MWI|Malawi|
+MYS|Malaysia|sabah;sarawak;kuala lumpur
+MDV|Maldives|
+MLI|Mali|
+MLT|Malta|
+MRT|Mauritania|
+MUS|Mauritius|
+MEX|Mexico|jalisco;mexico city;ciudad de mexico
+MDA|Moldova|republic of moldova
+MCO|Monaco|
+MNG|Mongolia|ulaanbaatar
+MNE|Montenegro|
+MAR|Morocco|
+MOZ|Mozambique|
+MMR|Myanmar|burma
+NAM|Namibia|
+NPL|Nepal|kathmandu
+NLD|Netherlands|holland;the netherlands
+NZL|New Zealand|
+NIC|Nicaragua|
+NER|Niger|
+NGA|Nigeria|lagos;kano;kaduna;abuja;plateau;ogun
+PRK|North Korea|dprk;democratic peoples republic of korea
+MKD|North Macedonia|macedonia
+NOR|Norway|
+OMN|Oman|
+PAK|Pakistan|punjab;karachi;lahore
+PSE|Palestine|west bank;gaza
+PAN|Panama|
+PNG|Papua New Guinea|
+PRY|Paraguay|
+PER|Peru|lima
+PHL|Philippines|luzon;manila
+POL|Poland|
+PRT|Portugal|
+PRI|Puerto Rico|
+QAT|Qatar|
+ROU|Romania|
+RUS|Russia|russian federation;moscow;saint petersburg;st petersburg;novosibirsk;astrakhan;primorje;primorsky;omsk;tyva;chany;kurgan;tomsk;krasnodar;rostov;kaliningrad;chukotka;sakhalin;khabarovsk;altai;buryatia;yakutia
+RWA|Rwanda|
+SAU|Saudi Arabia|riyadh;jeddah
+SEN|Senegal|
+SRB|Serbia|
+SLE|Sierra Leone|
+SGP|Singapore|
+SVK|Slovakia|slovak republic
+SVN|Slovenia|
+SOM|Somalia|
+ZAF|South Africa|western cape;gauteng;kwazulu natal;eastern cape
+KOR|South Korea|korea;republic of korea;rok;seoul;gyeonggi;gangwon;chungbuk;chungnam;jeonbuk;jeonnam;gyeongbuk;gyeongnam;jeju
+SSD|South Sudan|
+ESP|Spain|catalonia;cataluna;andalusia;madrid;barcelona
+LKA|Sri Lanka|
+SDN|Sudan|
+SUR|Suriname|
+SWE|Sweden|
+CHE|Switzerland|
+SYR|Syria|syrian arab republic
+TWN|Taiwan|taipei;chinese taipei
+TJK|Tajikistan|
+TZA|Tanzania|united republic of tanzania
+THA|Thailand|bangkok
+TLS|Timor-Leste|east timor;timor leste
+TGO|Togo|
+TTO|Trinidad and Tobago|trinidad
+TUN|Tunisia|
+TUR|Turkey|turkiye
+TKM|Turkmenistan|
+UGA|Uganda|
+UKR|Ukraine|
+ARE|United Arab Emirates|uae;dubai;abu dhabi
+GBR|United Kingdom|uk;u k;great britain;britain;england;scotland;wales;northern ireland;london
+USA|United States|usa;u s a;us;u s;united states of america;america;alabama;alaska;arizona;arkansas;california;colorado;connecticut;delaware;district of columbia;washington dc;florida;hawaii;idaho;illinois;indiana;iowa;kansas;kentucky;louisiana;maine;maryland;massachusetts;michigan;minnesota;mississippi;missouri;montana;nebraska;nevada;new hampshire;new jersey;new mexico;new york;new york city;north carolina;north dakota;ohio;oklahoma;oregon;pennsylvania;rhode island;south carolina;south dakota;tennessee;texas;utah;vermont;virginia;washington;west virginia;wisconsin;wyoming
+URY|Uruguay|
+UZB|Uzbekistan|
+VEN|Venezuela|
+VNM|Vietnam|viet nam;hanoi;ha noi;ho chi minh;ho chi minh city;hcmc;quang ninh;dong thap
+YEM|Yemen|
+ZMB|Zambia|
+ZWE|Zimbabwe|
+"""
+LOCATION_SUFFIXES = (' province', ' prefecture', ' state', ' region', ' oblast', ' city', ' county')
+_SEPARATORS = re.compile(r"[\s_\-\.,']+")
+
+
+def _load_gazetteer():
+    """(alias -> ISO3, ISO3 -> country name) from the bundled GAZETTEER table."""
+    aliases, names = {}, {}
+    for line in GAZETTEER.strip().splitlines():
+        iso3, name, extra = line.split('|')
+        names[iso3] = name
+        for alias in [name, iso3] + [a for a in extra.split(';') if a]:
+            aliases.setdefault(_SEPARATORS.sub(' ', alias.lower()).strip(), iso3)
+    return aliases, names
+
+
+LOCATION_ALIASES, COUNTRY_NAMES = _load_gazetteer()
+
+
+@lru_cache(maxsize=None)
+def normalize_location(location):
+    """ISO3 code for a free-text location, or None if it is not in the gazetteer.
+
+    Case, underscores and punctuation are ignored; a trailing administrative
+    word ("Guangdong province") or a trailing part after a comma/slash
+    ("Ohio, USA") is also tried.
+    """
+    if not location:
+        return None
+    key = _SEPARATORS.sub(' ', str(location).lower()).strip()
+    if key in LOCATION_ALIASES:
+        return LOCATION_ALIASES[key]
+    for suffix in LOCATION_SUFFIXES:
+        if key.endswith(suffix) and key[:-len(suffix)] in LOCATION_ALIASES:
+            return LOCATION_ALIASES[key[:-len(suffix)]]
+    parts = [p for p in re.split(r'[,/]', str(location)) if p.strip()]
+    if len(parts) > 1:
+        for part in reversed(parts):
+            iso3 = normalize_location(part)
+            if iso3:
+                return iso3
+    return None
+
+
+def country_codes(sequences):
+    """Location column re-encoded by country: (int64 codes, labels).
+
+    Labels are country names; locations missing from the gazetteer keep
+    their own text. Each distinct location string is normalized once.
+    """
+    codes, labels = as_view(sequences).metadata_codes('location')
+    mapped = np.array([COUNTRY_NAMES.get(normalize_location(label), label) for label in labels], dtype=object)
+    unique, label_codes = np.unique(mapped, return_inverse=True)
+    return label_codes.astype(np.int64)[codes], unique
+
+
+def country_counts(sequences):
+    """Records per country: DataFrame with ISO3, Country and Count columns, largest first.
+
+    Also returns the number of records whose location could not be
+    normalized (including unknown locations).
+    """
+    codes, labels = as_view(sequences).metadata_codes('location')
+    countries = np.array([normalize_location(label) or '' for label in labels], dtype=object)
+    iso_values, label_to_iso = np.unique(countries, return_inverse=True)
+    per_iso = np.bincount(label_to_iso[codes], minlength=len(iso_values)) if len(codes) else np.zeros(len(iso_values), dtype=np.int64)
+    matched = iso_values != ''
+    frame = pd.DataFrame({'ISO3': iso_values[matched],
+                          'Country': [COUNTRY_NAMES[iso3] for iso3 in iso_values[matched]],
+                          'Count': per_iso[matched]})
+    frame = frame[frame['Count'] > 0].sort_values('Count', ascending=False, ignore_index=True)
+    return frame, int(per_iso[~matched].sum())
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_jobs.py
+
+Background job runner for long SequenceAnalyzer operations. Jobs run on a
+thread (default) or process pool outside the Streamlit script thread, report
+progress, can be cancelled, and live in a process-wide runner so they
+survive script reruns. Jobs of the same owner (browser session) run one
+after another, each starting from the previous job's output.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fasta_engine import OperationCancelled, SequenceAnalyzer
+
+# ==================== CONSTANTS ====================
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+JOB_RETENTION = 3600  # Seconds a finished, unclaimed job is kept
+
+_job_ids = itertools.count(1)
+
+
+def run_analyzer_operation(sequences, operation, params, on_progress=None, cancel_event=None):
+    """Run one SequenceAnalyzer method by name. Top-level so process pools can pickle it."""
+    analyzer = SequenceAnalyzer(sequences, on_progress=on_progress, cancel_event=cancel_event)
+    return getattr(analyzer, operation)(**params)
+
+
+class Job:
+    """A queued or running SequenceAnalyzer operation."""
+    def __init__(self, owner, label, operation, params, sequences, input_token):
+        self.id = next(_job_ids)
+        self.owner = owner
+        self.label = label
+        self.operation = operation
+        self.params = dict(params)
+        self.sequences = sequences
+        # Token of the dataset this job reads; results only apply on top of it
+        self.input_token = input_token
+        self._previous = None
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    @property
+    def token(self):
+        """Dataset token produced when this job's result is applied."""
+        return f"job:{self.id}"
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def elapsed(self):
+        if not self.started_at:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def _set_progress(self, fraction):
+        self.progress = fraction
+
+
+class JobRunner:
+    """Thread/process pool executing Jobs in per-owner FIFO order.
+
+    With `executor="process"` jobs run in separate processes: progress is
+    only reported at start/finish and cancellation takes effect for queued
+    jobs (a running job's result is discarded instead).
+    """
+    def __init__(self, max_workers=2, executor="thread"):
+        self.executor_kind = executor
+        pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        self.pool = pool_cls(max_workers=max_workers)
+        self.jobs = OrderedDict()
+        self._queues = defaultdict(list)
+        self._running = {}
+        self._lock = threading.RLock()
+
+    def submit(self, owner, label, operation, params, sequences, input_token):
+        """Queue `SequenceAnalyzer.<operation>(**params)` for an owner and return the Job."""
+        with self._lock:
+            self._prune()
+            pending = self._queues[owner]
+            previous = pending[-1] if pending else self._running.get(owner)
+            # Chained jobs read the previous job's output, not the submit-time snapshot
+            token = previous.token if previous is not None else input_token
+            job = Job(owner, label, operation, params, sequences, token)
+            job._previous = previous
+            self.jobs[job.id] = job
+            pending.append(job)
+            if owner not in self._running:
+                self._start_next(owner)
+            return job
+
+    def cancel(self, job_id):
+        """Request cancellation of a queued or running job."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.cancel_event.set()
+            if job.status == JOB_QUEUED:
+                pending = self._queues[job.owner]
+                position = pending.index(job)
+                pending.remove(job)
+                if position < len(pending):
+                    # The follower now builds on whatever this job would have read
+                    follower = pending[position]
+                    follower._previous = job._previous
+                    follower.input_token = job.input_token
+                self._mark_finished(job, JOB_CANCELLED)
+            return True
+
+    def jobs_for(self, owner):
+        """All known jobs of an owner, oldest first."""
+        with self._lock:
+            return [job for job in self.jobs.values() if job.owner == owner]
+
+    def active_jobs(self, owner):
+        return [job for job in self.jobs_for(owner) if not job.finished]
+
+    def claim(self, job_id):
+        """Remove a finished job once its result has been picked up."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.finished:
+                del self.jobs[job_id]
+                job.sequences = None  # Drop the input snapshot
+            return job
+
+    # --- internals ---
+    def _start_next(self, owner):
+        pending = self._queues[owner]
+        if not pending:
+            self._running.pop(owner, None)
+            return
+        job = pending.pop(0)
+        previous = job._previous
+        job._previous = None
+        if previous is not None:
+            if previous.status == JOB_DONE and previous.result.applied:
+                job.sequences = previous.result.sequences
+            else:
+                # Previous job changed nothing: build on the data it read
+                job.sequences = previous.sequences
+                job.input_token = previous.input_token
+
+        self._running[owner] = job
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        if self.executor_kind == "process":
+            job.future = self.pool.submit(run_analyzer_operation, job.sequences, job.operation, job.params)
+        else:
+            job.future = self.pool.submit(run_analyzer_operation, job.sequences, job.operation, job.params,
+                                          job._set_progress, job.cancel_event)
+        job.future.add_done_callback(lambda future, job=job: self._on_done(job, future))
+
+    def _on_done(self, job, future):
+        with self._lock:
+            try:
+                result = future.result()
+                if job.cancel_event.is_set():
+                    self._mark_finished(job, JOB_CANCELLED)
+                else:
+                    job.result = result
+                    job.progress = 1.0
+                    self._mark_finished(job, JOB_DONE)
+            except OperationCancelled:
+                self._mark_finished(job, JOB_CANCELLED)
+            except Exception as e:
+                job.error = str(e)
+                self._mark_finished(job, JOB_FAILED)
+            self._running.pop(job.owner, None)
+            self._start_next(job.owner)
+
+    def _mark_finished(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self.jobs[job_id]
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_kmer.py
+
+K-mer index over a record list for similarity and motif search. Each
+sequence is reduced to a FracMinHash sketch (the hashes of its k-mers that
+fall in the lowest 1/KMER_SCALE of the hash space), and all sketches form
+one inverted index of sorted keys and owning record positions, so the
+records sharing k-mers with a query are found with binary searches. A small
+per-record k-mer presence bitmap (a Bloom filter) pre-screens motif
+searches so that only likely matches are read and checked.
+
+Sequences are hashed in chunks with array operations. NumPy releases the
+GIL for them, so chunks are spread over a thread pool and building uses all
+cores without copying sequences to worker processes.
+"""
+
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# ==================== CONSTANTS ====================
+KMER_SIZE = 21  # k-mer length of similarity sketches (at most 32)
+KMER_SCALE = 32  # A sketch keeps about one k-mer in KMER_SCALE
+MOTIF_KMER = 12  # k-mer length of the motif pre-screen bitmaps
+MOTIF_BITS = 2048  # Bitmap bits per record (a power of two)
+KMER_CHUNK = 1000  # Sequences hashed per task
+BASE_CODES = np.full(256, 4, dtype=np.uint8)  # A/C/G/T (either case) -> 0..3, anything else -> 4
+BASE_CODES[np.frombuffer(b"ACGTacgt", dtype=np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+KEY_MASK = np.uint64(0xFFFFFFFF)
+
+
+# ==================== HASHING ====================
+def encode_sequences(sequences):
+    """2-bit base codes (4 = not ACGT) of sequences joined by a separator, and the sequence of each position."""
+    joined = "\0".join(sequences).encode('ascii', errors='replace')
+    codes = BASE_CODES[np.frombuffer(joined, dtype=np.uint8)]
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    owners = np.repeat(np.arange(len(sequences), dtype=np.int64), lengths + 1)[:len(codes)]
+    return codes, owners
+
+def kmer_values(codes, k, blocks=None):
+    """(start position, 2-bit packed value) of every k-mer made only of A/C/G/T.
+
+    Values are assembled from packed blocks of 1, 2, 4, 8... bases (each
+    built from two of the previous width), so a k-mer costs about log2(k)
+    array passes instead of k. Pass the same `blocks` dict for several k
+    over the same codes to share them.
+    """
+    count = len(codes) - k + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+    blocks = {} if blocks is None else blocks
+    if 1 not in blocks:
+        blocks[1] = (codes & 3).astype(np.uint64)  # Invalid bases are masked out below
+    width = 1
+    while width * 2 <= k:
+        if width * 2 not in blocks:
+            previous = blocks[width]
+            blocks[width * 2] = (previous[:len(previous) - width] << np.uint64(2 * width)) | previous[width:]
+        width *= 2
+    values, offset = None, 0
+    while offset < k:
+        while offset + width > k:
+            width //= 2
+        part = blocks[width][offset:offset + count]
+        values = part.copy() if values is None else (values << np.uint64(2 * width)) | part
+        offset += width
+    if 'invalid' not in blocks:
+        blocks['invalid'] = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(codes > 3, out=blocks['invalid'][1:])
+    invalid = blocks['invalid']
+    valid = invalid[k:k + count] == invalid[:count]
+    return np.flatnonzero(valid), values[valid]
+
+def mix_hash(values):
+    """splitmix64 finalizer: spreads packed k-mers evenly over the uint64 range."""
+    values = values ^ (values >> np.uint64(30))
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+def _sketch_pairs(codes, owners, k, scale, blocks=None):
+    """Sorted unique (owner << 32 | key) pairs of the sketch k-mers of encoded sequences."""
+    positions, values = kmer_values(codes, k, blocks)
+    hashes = mix_hash(values)
+    kept = hashes < np.uint64((1 << 64) // scale)
+    keys = (hashes[kept] * np.uint64(scale)) >> np.uint64(32)  # The kept range, rescaled to 32 bits
+    return np.unique((owners[positions[kept]].astype(np.uint64) << np.uint64(32)) | keys)
+
+def _motif_bitmaps(codes, owners, count, blocks=None):
+    """Packed MOTIF_BITS k-mer presence bits per sequence, shape (count, MOTIF_BITS // 8)."""
+    positions, values = kmer_values(codes, MOTIF_KMER, blocks)
+    present = np.zeros(count * MOTIF_BITS, dtype=bool)
+    bits = (mix_hash(values) >> np.uint64(64 - MOTIF_BITS.bit_length() + 1)).astype(np.int64)
+    present[owners[positions] * MOTIF_BITS + bits] = True
+    return np.packbits(present.reshape(count, MOTIF_BITS), axis=1)
+
+def _index_chunk(sequences, k, scale):
+    """Sketch pairs (chunk-local owners) and motif bitmaps of one chunk of sequences."""
+    codes, owners = encode_sequences(sequences)
+    blocks = {}
+    return _sketch_pairs(codes, owners, k, scale, blocks), _motif_bitmaps(codes, owners, len(sequences), blocks)
+
+def clean_sequence(text):
+    """Bases of a pasted query: FASTA header lines and whitespace removed, upper-cased."""
+    lines = [line for line in str(text).splitlines() if not line.startswith('>')]
+    return "".join("".join(lines).split()).upper()
+
+def mash_identity(jaccard, k=KMER_SIZE):
+    """Estimated sequence identity from a k-mer Jaccard index (Mash distance); 0 where jaccard is 0."""
+    jaccard = np.asarray(jaccard, dtype=np.float64)
+    identity = np.zeros(len(jaccard))
+    shared = jaccard > 0
+    identity[shared] = 1 + np.log(2 * jaccard[shared] / (1 + jaccard[shared])) / k
+    return identity
+
+
+# ==================== INDEX ====================
+class KmerIndex:
+    """FracMinHash inverted index plus motif bitmaps of a record list.
+
+    `keys` (uint32, sorted) and `owners` (int32 record positions) list every
+    sketch k-mer of every record; `sizes` is each record's sketch size and
+    `bitmaps` its packed motif pre-screen bits.
+    """
+    def __init__(self, keys, owners, sizes, bitmaps, k=KMER_SIZE, scale=KMER_SCALE):
+        self.keys = keys
+        self.owners = owners
+        self.sizes = sizes
+        self.bitmaps = bitmaps
+        self.k = k
+        self.scale = scale
+
+    @classmethod
+    def build(cls, sequences, k=KMER_SIZE, scale=KMER_SCALE, workers=None):
+        """Index an iterable of sequence strings, KMER_CHUNK at a time on `workers` threads."""
+        if not 0 < k <= 32:
+            raise ValueError("k-mer size must be between 1 and 32")
+        if scale < 2:
+            raise ValueError("k-mer scale must be at least 2")
+        workers = workers or os.cpu_count() or 1
+        sequences = iter(sequences)
+        results = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            while True:
+                chunk = list(itertools.islice(sequences, KMER_CHUNK))
+                if not chunk:
+                    break
+                pending.append((len(chunk), pool.submit(_index_chunk, chunk, k, scale)))
+                if len(pending) > 2 * workers:
+                    count, future = pending.popleft()
+                    results.append((count, *future.result()))
+            results.extend((count, *future.result()) for count, future in pending)
+
+        pairs, bitmaps, base = [np.empty(0, dtype=np.uint64)], [np.zeros((0, MOTIF_BITS // 8), dtype=np.uint8)], 0
+        for count, chunk_pairs, chunk_bitmaps in results:
+            pairs.append(chunk_pairs + (np.uint64(base) << np.uint64(32)))
+            bitmaps.append(chunk_bitmaps)
+            base += count
+        pairs = np.concatenate(pairs)
+        owners = (pairs >> np.uint64(32)).astype(np.int32)
+        sizes = np.bincount(owners, minlength=base)
+        pairs = ((pairs & KEY_MASK) << np.uint64(32)) | (pairs >> np.uint64(32))
+        pairs.sort()  # By key, then owner
+        return cls((pairs >> np.uint64(32)).astype(np.uint32), (pairs & KEY_MASK).astype(np.int32),
+                   sizes, np.concatenate(bitmaps), k, scale)
+
+    @classmethod
+    def from_records(cls, records, workers=None, **params):
+        """Index the sequences of a record list (RecordView, workspace or list)."""
+        if hasattr(records, 'iter_records'):
+            records = records.iter_records()
+        return cls.build((record[1] or '' for record in records), workers=workers, **params)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __repr__(self):
+        return f"KmerIndex({len(self)} records, {len(self.keys)} sketch k-mers, k={self.k}, scale={self.scale})"
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.owners.nbytes + self.sizes.nbytes + self.bitmaps.nbytes
+
+    def sketch(self, seq):
+        """Sorted sketch keys of one sequence."""
+        codes, owners = encode_sequences([seq])
+        return (_sketch_pairs(codes, owners, self.k, self.scale) & KEY_MASK).astype(np.uint32)
+
+    def shared_counts(self, seq):
+        """(query sketch size, sketch k-mers each record shares with `seq`)."""
+        query = self.sketch(seq)
+        lo = np.searchsorted(self.keys, query, side='left')
+        hi = np.searchsorted(self.keys, query, side='right')
+        owners = [self.owners[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a]
+        owners = np.concatenate(owners) if owners else np.empty(0, dtype=np.int32)
+        return len(query), np.bincount(owners, minlength=len(self))
+
+    def nearest(self, seq, top_n=10):
+        """(positions, Jaccard estimates, shared k-mers) of the top_n records most similar to `seq`.
+
+        Best first; only records sharing at least one sketch k-mer are
+        returned. Ties keep record order.
+        """
+        query_size, shared = self.shared_counts(seq)
+        candidates = np.flatnonzero(shared)
+        union = self.sizes[candidates] + query_size - shared[candidates]
+        jaccard = shared[candidates] / np.maximum(union, 1)
+        best = np.argsort(-jaccard, kind='stable')[:top_n]
+        return candidates[best], jaccard[best], shared[candidates][best]
+
+    def motif_candidates(self, motif):
+        """Positions of records whose bitmaps hold every k-mer of `motif`.
+
+        A superset of the records containing the motif (Bloom filter false
+        positives); motifs shorter than MOTIF_KMER screen nothing out.
+        """
+        codes, owners = encode_sequences([motif])
+        query = _motif_bitmaps(codes, owners, 1)[0]
+        needed = np.flatnonzero(query)
+        if not len(needed):
+            return np.arange(len(self))
+        return np.flatnonzero(((self.bitmaps[:, needed] & query[needed]) == query[needed]).all(axis=1))
+
+    def take(self, positions):
+        """Index of the records at strictly increasing `positions` (None for other selections)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) > 1 and not (np.diff(positions) > 0).all():
+            return None
+        rank = np.full(len(self), -1, dtype=np.int64)
+        rank[positions] = np.arange(len(positions))
+        owners = rank[self.owners]
+        kept = owners >= 0
+        return KmerIndex(self.keys[kept], owners[kept].astype(np.int32), self.sizes[positions],
+                         self.bitmaps[positions], self.k, self.scale)
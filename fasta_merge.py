@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_merge.py
+
+Cross-file merge with deduplication. Files are fed one at a time (or chunk
+by chunk) into a shared DigestIndex, so a merge holds 8-byte sequence
+digests rather than the records of every file at once. The first occurrence
+of each sequence is kept. Each file's unique digests are also kept, so
+provenance (which files a kept sequence appeared in) and the pairwise
+overlap matrix can be reported afterwards.
+"""
+
+import numpy as np
+import pandas as pd
+
+from fasta_engine import DigestIndex, RecordView
+
+# ==================== CONSTANTS ====================
+PROVENANCE_SEPARATOR = "; "
+
+
+class DatasetMerge:
+    """Shared digest index plus per-file digest sets for one merge."""
+    def __init__(self):
+        self.index = DigestIndex()
+        self.names = []
+        self.records_seen = {}
+        self.records_kept = {}
+        self._digests = {}  # name -> sorted unique digests (chunks until first use)
+
+    def add(self, name, digests):
+        """Feed the sequence digests of the next records of file `name`.
+
+        Returns a boolean mask of the records to keep: sequences not seen in
+        this or any earlier file.
+        """
+        digests = np.asarray(digests, dtype=np.int64)
+        if name not in self._digests:
+            self.names.append(name)
+            self._digests[name] = []
+            self.records_seen[name] = self.records_kept[name] = 0
+        self._digests[name].append(np.unique(digests))
+        keep = self.index.add_many(digests)
+        self.records_seen[name] += len(digests)
+        self.records_kept[name] += int(keep.sum())
+        return keep
+
+    def file_digests(self, name):
+        """Sorted unique digests of file `name`."""
+        parts = self._digests[name]
+        if isinstance(parts, list):
+            parts = self._digests[name] = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        return parts
+
+    def overlap(self):
+        """Unique sequences shared by each pair of files (diagonal: unique sequences per file)."""
+        digests = [self.file_digests(name) for name in self.names]
+        matrix = np.zeros((len(digests), len(digests)), dtype=np.int64)
+        for i, first in enumerate(digests):
+            matrix[i, i] = len(first)
+            for j in range(i + 1, len(digests)):
+                matrix[i, j] = matrix[j, i] = len(np.intersect1d(first, digests[j], assume_unique=True))
+        return pd.DataFrame(matrix, index=self.names, columns=self.names)
+
+    def provenance(self, digests):
+        """Boolean matrix (one row per digest, one column per file): whether the file contains it."""
+        digests = np.asarray(digests, dtype=np.int64)
+        columns = [np.isin(digests, self.file_digests(name), kind='sort') for name in self.names]
+        return np.column_stack(columns) if columns else np.zeros((len(digests), 0), dtype=bool)
+
+    def summary(self):
+        """Per-file counts: records read, records kept (new sequences) and unique sequences."""
+        return pd.DataFrame({
+            'Records': [self.records_seen[name] for name in self.names],
+            'Kept': [self.records_kept[name] for name in self.names],
+            'Unique': [len(self.file_digests(name)) for name in self.names],
+        }, index=pd.Index(self.names, name='File'))
+
+
+def merge_datasets(named_sources):
+    """Merge {name: records} into one deduplicated RecordView, file by file.
+
+    Sources are read in order through their digest columns (packed and
+    on-disk records hash without building strings); records are not copied
+    and the result shares their storage. Returns (view, DatasetMerge).
+    """
+    merge = DatasetMerge()
+    bases, selected, offset = [], [np.empty(0, dtype=np.int64)], 0
+    for name, records in named_sources.items():
+        keep = merge.add(name, RecordView([records]).sequence_digests())
+        selected.append(np.flatnonzero(keep) + offset)
+        bases.append(records)
+        offset += len(records)
+    return RecordView(bases, np.concatenate(selected)), merge
+
+
+def provenance_table(view, merge):
+    """Header, source count and source files of every record of a merged view."""
+    presence = merge.provenance(view.sequence_digests())
+    names = np.array(merge.names, dtype=object)
+    headers = [record[0] for record in view.iter_records(with_sequence=False)]
+    return pd.DataFrame({
+        'Header': headers,
+        'Files': presence.sum(axis=1),
+        'Sources': [PROVENANCE_SEPARATOR.join(names[row]) for row in presence],
+    })
@@ -0,0 +1,977 @@
+# -*- coding: utf-8 -*-
+"""
+fasta_store.py
+
+Process-wide registry of parsed datasets shared by all sessions. Identical
+uploads (same content digest) are parsed once and held once; each session
+keeps a DatasetLease on the datasets it uses plus its own RecordView
+selections. Datasets nobody references stay cached for re-use and are
+evicted least-recently-used first when the memory ceiling is reached.
+
+Also defines the on-disk workspace format used for datasets larger than
+RAM: sequences and headers concatenated in flat files with offset arrays,
+metadata as one column file per field, all opened with mmap. A partitioned workspace holds one such workspace per
+segment (or segment and subtype), so work on one partition never reads the
+others.
+"""
+
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import weakref
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+import pandas as pd
+
+from fasta_engine import (DEFAULT_UNKNOWN, DigestIndex, RecordView, collection_day, date_order, iter_fasta_records,
+                          merge_date_orders, parse_fasta_content, sequence_digest)
+
+# ==================== CONSTANTS ====================
+DEFAULT_MEMORY_LIMIT = 2 * 1024 ** 3  # Bytes of parsed records kept in memory
+SIZE_SAMPLE = 200  # Records sampled when estimating a dataset's size
+WORKSPACE_FORMAT = 1
+WORKSPACE_MANIFEST = "workspace.json"
+WORKSPACE_CHUNK = 4096  # Records decoded per batch when iterating a workspace
+TEXT_FIELDS = ('isolate_name', 'isolate_id')  # Stored as string heaps (mostly unique)
+CATEGORY_FIELDS = ('type', 'segment', 'clade', 'host', 'location')  # Stored as int32 codes
+NO_DATE = np.iinfo(np.int64).min  # collection_date sentinel (days since epoch)
+MAX_STORED_ERRORS = 100
+DEFAULT_SPILL_BYTES = 256 * 1024 ** 2  # Content size from which datasets are kept on disk
+PARTITION_MANIFEST = "partitions.json"
+PARTITION_FIELDS = ('segment', 'type')  # Category fields a workspace can be partitioned by
+
+
+def content_digest(content_string):
+    """Hex digest identifying a file's content."""
+    return hashlib.blake2b(content_string.encode('utf-8', errors='replace'), digest_size=16).hexdigest()
+
+def estimate_records_nbytes(records):
+    """Approximate memory held by a record list, from a sample of records."""
+    if not records:
+        return sys.getsizeof(records)
+    sample = records[::max(1, len(records) // SIZE_SAMPLE)]
+    sampled = 0
+    for record in sample:
+        header, seq, metadata = record
+        sampled += sys.getsizeof(record) + sys.getsizeof(header) + sys.getsizeof(seq) + sys.getsizeof(metadata)
+        sampled += sum(sys.getsizeof(value) for value in metadata.values())
+    return sys.getsizeof(records) + int(sampled / len(sample) * len(records))
+
+
+# ==================== PACKED SEQUENCES ====================
+# 4-bit IUPAC codes: one bit per base, ambiguity codes are their OR; 0 marks an exception
+NUCLEOTIDE_CODES = {'A': 1, 'C': 2, 'G': 4, 'T': 8, 'M': 3, 'R': 5, 'W': 9, 'S': 6,
+                    'Y': 10, 'K': 12, 'V': 7, 'H': 11, 'D': 13, 'B': 14, 'N': 15}
+N_CODE = 15
+GC_CODES = (2, 4, 6)  # C, G, S
+PACK_CHUNK = 20000  # Sequences encoded/decoded per numpy batch
+
+_ENCODE = np.zeros(256, dtype=np.uint8)
+_DECODE = np.zeros(16, dtype=np.uint8)
+for _base, _code in NUCLEOTIDE_CODES.items():
+    _ENCODE[ord(_base)] = _code
+    _DECODE[_code] = ord(_base)
+_IS_GC = np.isin(np.arange(16), GC_CODES)
+
+
+def _concat_ranges(starts, ends):
+    """Concatenation of arange(start, end) for each pair, vectorized."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return shifts + np.arange(total, dtype=np.int64)
+
+
+class PackedSequences:
+    """Nucleotide sequences packed two bases per byte as 4-bit IUPAC codes.
+
+    Every sequence starts on a byte boundary. Characters outside the IUPAC
+    alphabet (gaps, U, stray symbols) are stored as code 0 plus an entry in
+    an exception list, so decoding is lossless for ASCII sequences. Length,
+    N-run, GC and digest computations run on the codes without building
+    Python strings.
+    """
+    def __init__(self, sequences=()):
+        data_parts, length_parts = [], []
+        exc_seq, exc_pos, exc_char = [], [], []
+        count = 0
+        batch = []
+        for seq in itertools.chain(sequences, [None]):
+            if seq is not None:
+                batch.append(seq)
+                if len(batch) < PACK_CHUNK:
+                    continue
+            if batch:
+                packed, lengths, exceptions = self._encode(batch)
+                data_parts.append(packed)
+                length_parts.append(lengths)
+                exc_seq.append(exceptions[0] + count)
+                exc_pos.append(exceptions[1])
+                exc_char.append(exceptions[2])
+                count += len(batch)
+                batch = []
+
+        self.data = np.concatenate(data_parts) if data_parts else np.empty(0, dtype=np.uint8)
+        self.lengths = np.concatenate(length_parts) if length_parts else np.empty(0, dtype=np.int64)
+        self.starts = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum((self.lengths + 1) // 2, out=self.starts[1:])
+        self.exc_seq = np.concatenate(exc_seq) if exc_seq else np.empty(0, dtype=np.int64)
+        self.exc_pos = np.concatenate(exc_pos) if exc_pos else np.empty(0, dtype=np.int64)
+        self.exc_char = np.concatenate(exc_char) if exc_char else np.empty(0, dtype=np.uint8)
+        self._digests = None
+
+    @staticmethod
+    def _encode(batch):
+        lengths = np.fromiter(map(len, batch), dtype=np.int64, count=len(batch))
+        padded = "".join(seq + "\x00" if len(seq) % 2 else seq for seq in batch)
+        raw = np.frombuffer(padded.encode('ascii', errors='replace'), dtype=np.uint8)
+        codes = _ENCODE[raw]
+        nibble_starts = np.concatenate(([0], np.cumsum(lengths + lengths % 2)[:-1]))
+        bad = np.flatnonzero((codes == 0) & (raw != 0))
+        seq_ids = np.searchsorted(nibble_starts, bad, side='right') - 1
+        exceptions = (seq_ids.astype(np.int64), bad - nibble_starts[seq_ids], raw[bad])
+        return (codes[0::2] << 4) | codes[1::2], lengths, exceptions
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def nbytes(self):
+        arrays = (self.data, self.lengths, self.starts, self.exc_seq, self.exc_pos, self.exc_char, self._digests)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def _codes(self, positions):
+        """Unpacked codes of the sequences at `positions` plus each one's start in them."""
+        byte_starts, byte_ends = self.starts[positions], self.starts[positions + 1]
+        if len(positions) and positions[-1] - positions[0] == len(positions) - 1 and (np.diff(positions) == 1).all():
+            packed = self.data[byte_starts[0]:byte_ends[-1]]  # Contiguous run: plain slice
+        else:
+            packed = self.data[_concat_ranges(byte_starts, byte_ends)]
+        codes = np.empty(len(packed) * 2, dtype=np.uint8)
+        codes[0::2] = packed >> 4
+        codes[1::2] = packed & 0x0F
+        nibble_starts = np.concatenate(([0], np.cumsum(2 * (byte_ends - byte_starts))[:-1])).astype(np.int64)
+        return codes, nibble_starts
+
+    def _decode(self, positions):
+        """ASCII bytes of the sequences at `positions` (padded) and each one's start."""
+        codes, nibble_starts = self._codes(positions)
+        buffer = _DECODE[codes]
+        if len(self.exc_seq):
+            hits = np.flatnonzero(np.isin(self.exc_seq, positions))
+            if len(hits):
+                # Every slot reading a sequence gets its exceptions (positions may repeat)
+                order = np.argsort(positions, kind='stable')
+                lo = np.searchsorted(positions[order], self.exc_seq[hits], side='left')
+                hi = np.searchsorted(positions[order], self.exc_seq[hits], side='right')
+                hits = np.repeat(hits, hi - lo)
+                slots = order[_concat_ranges(lo, hi)]
+                buffer[nibble_starts[slots] + self.exc_pos[hits]] = self.exc_char[hits]
+        return buffer, nibble_starts
+
+    def _batches(self, positions):
+        positions = np.arange(len(self), dtype=np.int64) if positions is None else np.asarray(positions, dtype=np.int64)
+        for start in range(0, len(positions), PACK_CHUNK):
+            yield positions[start:start + PACK_CHUNK]
+
+    def iter_decoded(self, positions=None):
+        """Yield the sequences at `positions` as strings."""
+        for batch in self._batches(positions):
+            buffer, nibble_starts = self._decode(batch)
+            data = buffer.tobytes()
+            for start, length in zip(nibble_starts.tolist(), self.lengths[batch].tolist()):
+                yield data[start:start + length].decode('ascii')
+
+    def __getitem__(self, i):
+        return next(self.iter_decoded([i if i >= 0 else i + len(self)]))
+
+    def sequence_lengths(self, positions=None):
+        return self.lengths if positions is None else self.lengths[np.asarray(positions, dtype=np.int64)]
+
+    def longest_n_runs(self, positions=None):
+        """Longest run of N per sequence, from the codes."""
+        parts = [np.empty(0, dtype=np.int64)]
+        for batch in self._batches(positions):
+            codes, nibble_starts = self._codes(batch)
+            n_at = np.flatnonzero(codes == N_CODE)
+            longest = np.zeros(len(batch), dtype=np.int64)
+            if len(n_at):
+                # Runs break at gaps between N positions and at sequence starts
+                breaks = np.flatnonzero((np.diff(n_at) != 1) | np.isin(n_at[1:], nibble_starts)) + 1
+                run_starts = np.concatenate(([0], breaks))
+                run_lengths = np.diff(np.concatenate((run_starts, [len(n_at)])))
+                run_seqs = np.searchsorted(nibble_starts, n_at[run_starts], side='right') - 1
+                np.maximum.at(longest, run_seqs, run_lengths)
+            parts.append(longest)
+        return np.concatenate(parts)
+
+    def gc_fractions(self, positions=None):
+        """Share of G/C/S codes per sequence (same as fasta_engine.gc_fraction)."""
+        parts = [np.empty(0, dtype=np.float64)]
+        for batch in self._batches(positions):
+            codes, nibble_starts = self._codes(batch)
+            gc = np.add.reduceat(_IS_GC[codes].astype(np.int64), nibble_starts) if len(codes) else np.zeros(len(batch))
+            lengths = self.lengths[batch]
+            parts.append(np.divide(gc, lengths, out=np.zeros(len(batch)), where=lengths > 0))
+        return np.concatenate(parts)
+
+    def sequence_digests(self, positions=None):
+        """fasta_engine.sequence_digest() per sequence (computed once, then cached)."""
+        if self._digests is None:
+            self._digests = self._compute_digests()
+        return self._digests if positions is None else self._digests[np.asarray(positions, dtype=np.int64)]
+
+    def _compute_digests(self):
+        """Hash every sequence from decoded bytes, without building strings."""
+        digests = []
+        for batch in self._batches(None):
+            buffer, nibble_starts = self._decode(batch)
+            view = memoryview(buffer)
+            for start, length in zip(nibble_starts.tolist(), self.lengths[batch].tolist()):
+                digest = hashlib.blake2b(view[start:start + length], digest_size=8).digest()
+                digests.append(int.from_bytes(digest, 'little', signed=True))
+        return np.array(digests, dtype=np.int64)
+
+
+class PackedRecords:
+    """In-memory record list whose sequences are held in a PackedSequences store.
+
+    Headers and metadata stay as Python objects; sequence strings are only
+    built when a record is read with its sequence. Collection days are
+    collected into a column while loading, and the date order is sorted
+    once, on first use.
+    """
+    def __init__(self, records):
+        self.headers = []
+        self.metadata = []
+        self.days = array('q')
+        self._date_order = None
+
+        def sequences():
+            for header, seq, metadata in records:
+                self.headers.append(header)
+                self.metadata.append(metadata)
+                self.days.append(collection_day(metadata))
+                yield seq
+
+        self.sequences = PackedSequences(sequences())
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __getitem__(self, i):
+        return [self.headers[i], self.sequences[i], self.metadata[i]]
+
+    def __iter__(self):
+        return self.iter_records()
+
+    @property
+    def nbytes(self):
+        sample = list(range(0, len(self.headers), max(1, len(self.headers) // SIZE_SAMPLE)))
+        if not sample:
+            return self.sequences.nbytes
+        sampled = sum(sys.getsizeof(self.headers[i]) + sys.getsizeof(self.metadata[i])
+                      + sum(sys.getsizeof(v) for v in self.metadata[i].values()) for i in sample)
+        return self.sequences.nbytes + int(sampled / len(sample) * len(self.headers)) + 16 * len(self.headers)
+
+    def iter_records(self, positions=None, with_sequence=True):
+        if positions is None:
+            positions = np.arange(len(self), dtype=np.int64)
+        headers, metadata = self.headers, self.metadata
+        if with_sequence:
+            for i, seq in zip(np.asarray(positions).tolist(), self.sequences.iter_decoded(positions)):
+                yield [headers[i], seq, metadata[i]]
+        else:
+            for i in np.asarray(positions).tolist():
+                yield [headers[i], None, metadata[i]]
+
+    def sequence_lengths(self, positions):
+        return self.sequences.sequence_lengths(positions)
+
+    def longest_n_runs(self, positions):
+        return self.sequences.longest_n_runs(positions)
+
+    def gc_fractions(self, positions):
+        return self.sequences.gc_fractions(positions)
+
+    def sequence_digests(self, positions):
+        return self.sequences.sequence_digests(positions)
+
+    def collection_dates(self, positions):
+        return np.frombuffer(self.days, dtype=np.int64)[np.asarray(positions, dtype=np.int64)].view('datetime64[D]')
+
+    def date_order(self):
+        """Record positions in collection-date order (memoized; see fasta_engine.DateIndex)."""
+        if self._date_order is None:
+            self._date_order = date_order(np.frombuffer(self.days, dtype=np.int64))
+        return self._date_order
+
+
+# ==================== ON-DISK WORKSPACES ====================
+class _StringHeap:
+    """Strings concatenated in `<name>.bin` with int64 offsets in `<name>_offsets.npy`."""
+    def __init__(self, path, name, encoding='utf-8'):
+        self.encoding = encoding
+        self.offsets = np.load(os.path.join(path, f"{name}_offsets.npy"), mmap_mode='r')
+        with open(os.path.join(path, f"{name}.bin"), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def get(self, i):
+        return self.data[int(self.offsets[i]):int(self.offsets[i + 1])].decode(self.encoding, errors='replace')
+
+    def get_many(self, positions):
+        starts = self.offsets[positions].tolist()
+        ends = self.offsets[positions + 1].tolist()
+        data, encoding = self.data, self.encoding
+        return [data[a:b].decode(encoding, errors='replace') for a, b in zip(starts, ends)]
+
+    def lengths(self, positions):
+        return self.offsets[positions + 1] - self.offsets[positions]
+
+
+def _save_array(path, values):
+    """np.save through a temporary file and rename, so open memory maps keep reading the old file."""
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, values)
+    os.replace(path + ".tmp", path)
+
+
+class _HeapWriter:
+    """Writes a _StringHeap; with `count`, appends after the first `count` strings already on disk."""
+    def __init__(self, path, name, encoding='utf-8', count=None):
+        self.path, self.name, self.encoding = path, name, encoding
+        data_path = os.path.join(path, f"{name}.bin")
+        self.offsets = array('q', [0])
+        if count is None:
+            self.handle = open(data_path, 'wb')
+        else:
+            stored = np.load(os.path.join(path, f"{name}_offsets.npy"), mmap_mode='r')
+            self.offsets = array('q', np.asarray(stored[:count + 1], dtype=np.int64).tobytes())
+            self.handle = open(data_path, 'r+b')
+            self.handle.truncate(self.offsets[-1])  # Drop bytes left by an interrupted append
+            self.handle.seek(0, os.SEEK_END)
+
+    def add(self, text):
+        data = text.encode(self.encoding, errors='replace')
+        self.handle.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self.handle.close()
+        _save_array(os.path.join(self.path, f"{self.name}_offsets.npy"), np.frombuffer(self.offsets, dtype=np.int64))
+
+
+class WorkspaceWriter:
+    """Stream [header, seq, metadata] records into a workspace directory.
+
+    With `append=True` and an existing workspace at `path`, records are
+    added after the stored ones: flat files are appended to, column files
+    are rewritten through a rename, and the manifest is replaced last, so
+    readers keep seeing the old records until the append completes. The
+    existing workspace is available as `base`.
+    """
+    def __init__(self, path, append=False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.base = Workspace(path) if append and is_workspace(path) else None
+        self.count = 0
+        self.errors = list(self.base.errors) if self.base is not None else []
+        existing = self.base.count if self.base is not None else None
+        self.sequences = _HeapWriter(path, "sequences", encoding='ascii', count=existing)
+        self.headers = _HeapWriter(path, "headers", count=existing)
+        self.text = {field: _HeapWriter(path, field, count=existing) for field in TEXT_FIELDS}
+        self.codes = {field: array('i') for field in CATEGORY_FIELDS}
+        self.categories = {field: {} for field in CATEGORY_FIELDS}
+        if self.base is not None:
+            for field in CATEGORY_FIELDS:
+                self.categories[field] = {value: code for code, value in enumerate(self.base.categories[field])}
+        self.dates = array('q')
+        self.digests = array('q')
+
+    def add(self, record):
+        header, seq, metadata = record
+        self.sequences.add(seq)
+        self.headers.add(header)
+        for field in TEXT_FIELDS:
+            self.text[field].add(str(metadata.get(field, DEFAULT_UNKNOWN)))
+        for field in CATEGORY_FIELDS:
+            lookup = self.categories[field]
+            value = str(metadata.get(field, DEFAULT_UNKNOWN))
+            self.codes[field].append(lookup.setdefault(value, len(lookup)))
+        date_val = metadata.get('collection_date')
+        self.dates.append((date_val - datetime(1970, 1, 1)).days if date_val else NO_DATE)
+        self.digests.append(sequence_digest(seq))
+        self.count += 1
+
+    def _stored_column(self, name):
+        if name in CATEGORY_FIELDS:
+            return self.base.codes[name]
+        return self.base.dates if name == "collection_date" else self.base.sequence_digests()
+
+    def close(self, errors=None):
+        """Finish writing and return the opened Workspace."""
+        for heap in (self.sequences, self.headers, *self.text.values()):
+            heap.close()
+        columns = {field: (self.codes[field], np.int32) for field in CATEGORY_FIELDS}
+        columns["collection_date"] = (self.dates, np.int64)
+        columns["digests"] = (self.digests, np.int64)
+        for name, (new, dtype) in columns.items():
+            values = np.frombuffer(new, dtype=dtype)
+            if self.base is not None:
+                values = np.concatenate([np.asarray(self._stored_column(name)[:self.base.count], dtype=dtype), values])
+            _save_array(os.path.join(self.path, f"{name}.npy"), values)
+            if name == "collection_date":
+                days = values
+        # Date order for DateIndex: the stored order is merged with the new records' order
+        if self.base is not None:
+            new_order = date_order(days[self.base.count:]) + self.base.count
+            order = merge_date_orders(days, [np.asarray(self.base.date_order(), dtype=np.int64), new_order])
+        else:
+            order = date_order(days)
+        _save_array(os.path.join(self.path, "date_order.npy"), order)
+        manifest = {
+            "format": WORKSPACE_FORMAT,
+            "count": self.count + (self.base.count if self.base is not None else 0),
+            "categories": {field: list(lookup) for field, lookup in self.categories.items()},
+            "errors": (self.errors + list(errors or []))[:MAX_STORED_ERRORS],
+        }
+        # Written last: a directory with a manifest is a complete workspace
+        manifest_path = os.path.join(self.path, WORKSPACE_MANIFEST)
+        with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        return Workspace(self.path)
+
+
+def build_workspace(path, records, errors=None):
+    """Write an iterable of records to a workspace directory and open it."""
+    writer = WorkspaceWriter(path)
+    for record in records:
+        writer.add(record)
+    return writer.close(errors)
+
+
+def append_to_workspace(path, records, errors=None, skip_duplicates=True):
+    """Append records to the workspace at `path` (created if missing).
+
+    Partitioned workspaces route each record to its partition; duplicates
+    are checked against all partitions.
+
+    With `skip_duplicates`, each incoming sequence is checked only against
+    the workspace's stored digest column (and the records appended before
+    it); existing records are not re-read. Returns (workspace, added, skipped).
+    """
+    if is_partitioned_workspace(path):
+        writer = PartitionedWorkspaceWriter(path, append=True)
+    else:
+        writer = WorkspaceWriter(path, append=True)
+    index = DigestIndex()
+    if writer.base is not None and skip_duplicates:
+        index.update(writer.base.sequence_digests())
+    skipped = 0
+    for record in records:
+        if skip_duplicates and not index.add(sequence_digest(record[1])):
+            skipped += 1
+            continue
+        writer.add(record)
+    return writer.close(errors), writer.count, skipped
+
+def is_workspace(path):
+    return os.path.isfile(os.path.join(path, WORKSPACE_MANIFEST))
+
+
+class Workspace:
+    """Read-only, memory-mapped record list backed by a workspace directory.
+
+    Behaves like a list of [header, seq, metadata] records; records are
+    decoded on access, and `iter_records(..., with_sequence=False)` reads
+    only headers and metadata columns, leaving sequence bytes untouched.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, WORKSPACE_MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("format") != WORKSPACE_FORMAT:
+            raise ValueError(f"Unsupported workspace format in {path}")
+        self.count = manifest["count"]
+        self.errors = manifest.get("errors", [])
+        self.categories = {field: np.array(values, dtype=object) for field, values in manifest["categories"].items()}
+        self.sequences = _StringHeap(path, "sequences", encoding='ascii')
+        self.headers = _StringHeap(path, "headers")
+        self.text = {field: _StringHeap(path, field) for field in TEXT_FIELDS}
+        self.codes = {field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode='r') for field in CATEGORY_FIELDS}
+        self.dates = np.load(os.path.join(path, "collection_date.npy"), mmap_mode='r')
+        self._digests = None
+        self._date_order = None
+
+    def __getstate__(self):
+        return {"path": self.path}  # mmaps are reopened, not pickled
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("workspace index out of range")
+        return next(self.iter_records(np.array([i], dtype=np.int64)))
+
+    def __iter__(self):
+        return self.iter_records()
+
+    @property
+    def nbytes(self):
+        """Approximate resident memory (category tables); record data stays on disk."""
+        return sum(sys.getsizeof(value) for values in self.categories.values() for value in values)
+
+    @property
+    def disk_bytes(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+
+    def sequence_lengths(self, positions=None):
+        """Sequence lengths straight from the offsets array."""
+        positions = np.arange(self.count, dtype=np.int64) if positions is None else np.asarray(positions, dtype=np.int64)
+        return self.sequences.lengths(positions)
+
+    def sequence_digests(self, positions=None):
+        """fasta_engine.sequence_digest() per sequence, from the stored digest column.
+
+        Workspaces written before the column existed hash their sequence
+        bytes once, without building strings.
+        """
+        if self._digests is None:
+            digest_path = os.path.join(self.path, "digests.npy")
+            stored = np.load(digest_path, mmap_mode='r') if os.path.exists(digest_path) else ()
+            self._digests = stored[:self.count] if len(stored) >= self.count else self._compute_digests()
+        return np.asarray(self._digests if positions is None else self._digests[np.asarray(positions, dtype=np.int64)])
+
+    def _compute_digests(self):
+        data, offsets = memoryview(self.sequences.data), self.sequences.offsets[:self.count + 1].tolist()
+        return np.fromiter((int.from_bytes(hashlib.blake2b(data[a:b], digest_size=8).digest(), 'little', signed=True)
+                            for a, b in zip(offsets, offsets[1:])), dtype=np.int64, count=self.count)
+
+    def date_order(self):
+        """Record positions in collection-date order, as stored when the workspace was written.
+
+        Workspaces written before the order was stored sort their date
+        column once.
+        """
+        if self._date_order is None:
+            order_path = os.path.join(self.path, "date_order.npy")
+            stored = np.load(order_path, mmap_mode='r') if os.path.exists(order_path) else ()
+            self._date_order = stored if len(stored) == self.count else date_order(self.dates[:self.count])
+        return self._date_order
+
+    def collection_dates(self, positions):
+        """datetime64[D] dates from the stored day numbers (NO_DATE is NaT's bit pattern)."""
+        return np.asarray(self.dates[np.asarray(positions, dtype=np.int64)]).astype('datetime64[D]')
+
+    def metadata_fields(self, positions=None):
+        """Metadata keys of every stored record."""
+        return ('original_header', 'collection_date') + TEXT_FIELDS + CATEGORY_FIELDS
+
+    def metadata_codes(self, field, positions):
+        """(codes, labels) for a metadata field; category columns need no decoding."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if field in CATEGORY_FIELDS:
+            return np.asarray(self.codes[field][positions], dtype=np.int64), self.categories[field]
+        heap = self.text.get(field, self.headers if field == 'original_header' else None)
+        if heap is None:
+            return np.zeros(len(positions), dtype=np.int64), np.array([DEFAULT_UNKNOWN], dtype=object)
+        labels, codes = np.unique(np.array(heap.get_many(positions), dtype=object), return_inverse=True)
+        return codes.astype(np.int64), labels
+
+    def iter_records(self, positions=None, with_sequence=True):
+        """Yield records at `positions` (default: all) in batches of WORKSPACE_CHUNK."""
+        if positions is None:
+            positions = np.arange(self.count, dtype=np.int64)
+        for start in range(0, len(positions), WORKSPACE_CHUNK):
+            chunk = np.asarray(positions[start:start + WORKSPACE_CHUNK], dtype=np.int64)
+            headers = self.headers.get_many(chunk)
+            seqs = self.sequences.get_many(chunk) if with_sequence else [None] * len(chunk)
+            text = {field: heap.get_many(chunk) for field, heap in self.text.items()}
+            cats = {field: self.categories[field][np.asarray(self.codes[field][chunk])] for field in CATEGORY_FIELDS}
+            days = np.asarray(self.dates[chunk])
+            dates = np.where(days == NO_DATE, 0, days).astype('datetime64[D]').astype('datetime64[us]').astype(object)
+            for j, header in enumerate(headers):
+                metadata = {"original_header": header}
+                for field in TEXT_FIELDS:
+                    metadata[field] = text[field][j]
+                for field in CATEGORY_FIELDS:
+                    metadata[field] = cats[field][j]
+                metadata["collection_date"] = dates[j] if days[j] != NO_DATE else None
+                yield [header, seqs[j], metadata]
+
+
+# ==================== PARTITIONED WORKSPACES ====================
+def partition_key(values):
+    """Directory name of the partition holding records with metadata `values` (e.g. "HA" or "HA_H5N1")."""
+    parts = [re.sub(r'[^\w.-]+', '-', str(value)).strip('-.') or DEFAULT_UNKNOWN for value in values]
+    return "_".join(parts)
+
+def partition_stats(workspace):
+    """Summary of one partition's records, read from its column files only."""
+    count = workspace.count
+    days = np.asarray(workspace.dates[:count])
+    dated = days[days != NO_DATE]
+    lengths = workspace.sequence_lengths()
+    return {
+        "records": count,
+        "unique": int(len(np.unique(workspace.sequence_digests()))),
+        "dated": int(len(dated)),
+        "first": str(np.datetime64(int(dated.min()), 'D')) if len(dated) else None,
+        "last": str(np.datetime64(int(dated.max()), 'D')) if len(dated) else None,
+        "mean_length": float(lengths.mean()) if count else 0.0,
+        "subtypes": int(len(np.unique(np.asarray(workspace.codes['type'][:count])))),
+    }
+
+
+class PartitionedWorkspaceWriter:
+    """Stream records into one workspace per partition under `path`.
+
+    Records are routed by the values of `fields` (see PARTITION_FIELDS);
+    partition workspaces are created on first use. With `append=True` and
+    an existing partitioned workspace, records are appended to their
+    partitions (new ones are added) and `fields` defaults to the stored
+    ones. `partitions.json` is replaced last, as for single workspaces.
+    """
+    def __init__(self, path, fields=None, append=False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.base = PartitionedWorkspace(path) if append and is_partitioned_workspace(path) else None
+        stored = tuple(self.base.fields) if self.base is not None else None
+        self.fields = tuple(fields) if fields else stored or ('segment',)
+        unknown = [field for field in self.fields if field not in PARTITION_FIELDS]
+        if unknown:
+            raise ValueError(f"Cannot partition by {', '.join(unknown)} (use {', '.join(PARTITION_FIELDS)})")
+        if stored is not None and stored != self.fields:
+            raise ValueError(f"Workspace {path} is partitioned by {', '.join(stored)}, not {', '.join(self.fields)}")
+        self.entries = OrderedDict()  # key -> manifest entry
+        if self.base is not None:
+            self.entries.update((entry["key"], entry) for entry in self.base.entries)
+        self.keys = {tuple(entry["values"][field] for field in self.fields): key for key, entry in self.entries.items()}
+        self.writers = {}
+        self.count = 0
+        self.errors = list(self.base.errors) if self.base is not None else []
+
+    def _writer(self, values):
+        key = self.keys.get(values)
+        if key is None:
+            key, suffix = partition_key(values), 1
+            while key in self.entries:  # Different values with the same directory name
+                suffix += 1
+                key = f"{partition_key(values)}-{suffix}"
+            self.keys[values] = key
+            self.entries[key] = {"key": key, "values": dict(zip(self.fields, values))}
+        writer = self.writers.get(key)
+        if writer is None:
+            writer = self.writers[key] = WorkspaceWriter(os.path.join(self.path, key), append=self.base is not None)
+        return writer
+
+    def add(self, record):
+        metadata = record[2]
+        self._writer(tuple(str(metadata.get(field, DEFAULT_UNKNOWN)) for field in self.fields)).add(record)
+        self.count += 1
+
+    def close(self, errors=None):
+        """Finish every partition written to and return the opened PartitionedWorkspace."""
+        for key, writer in self.writers.items():
+            self.entries[key]["stats"] = partition_stats(writer.close())
+        manifest = {
+            "format": WORKSPACE_FORMAT,
+            "fields": list(self.fields),
+            "partitions": sorted(self.entries.values(), key=lambda entry: entry["key"]),
+            "errors": (self.errors + list(errors or []))[:MAX_STORED_ERRORS],
+        }
+        manifest_path = os.path.join(self.path, PARTITION_MANIFEST)
+        with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        return PartitionedWorkspace(self.path)
+
+
+def build_partitioned_workspace(path, records, fields=('segment',), errors=None):
+    """Write an iterable of records to a workspace partitioned by `fields` and open it."""
+    writer = PartitionedWorkspaceWriter(path, fields)
+    for record in records:
+        writer.add(record)
+    return writer.close(errors)
+
+def is_partitioned_workspace(path):
+    return os.path.isfile(os.path.join(path, PARTITION_MANIFEST))
+
+
+class PartitionedWorkspace:
+    """Workspaces of one dataset split by segment (and optionally subtype).
+
+    `partitions` maps each partition key to its Workspace; `view(keys)`
+    selects records from the chosen partitions only. Iterating or taking
+    `sequence_digests()` covers all partitions, so it can stand in for a
+    single workspace as a dedup base.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, PARTITION_MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("format") != WORKSPACE_FORMAT:
+            raise ValueError(f"Unsupported workspace format in {path}")
+        self.fields = manifest["fields"]
+        self.entries = manifest["partitions"]
+        self.errors = manifest.get("errors", [])
+        self.partitions = OrderedDict((entry["key"], Workspace(os.path.join(path, entry["key"])))
+                                      for entry in self.entries)
+
+    def __len__(self):
+        return sum(len(workspace) for workspace in self.partitions.values())
+
+    def __iter__(self):
+        return self.view().iter_records()
+
+    def find(self, **values):
+        """Keys of the partitions whose values match, e.g. find(segment='HA')."""
+        return [entry["key"] for entry in self.entries
+                if all(entry["values"].get(field) == str(value) for field, value in values.items())]
+
+    def view(self, keys=None):
+        """RecordView over the partitions named in `keys` (default: all)."""
+        keys = list(self.partitions) if keys is None else keys
+        return RecordView([self.partitions[key] for key in keys])
+
+    def sequence_digests(self):
+        return self.view().sequence_digests()
+
+    def stats(self):
+        """Per-partition statistics stored at write time, one row per partition."""
+        rows = []
+        for entry in self.entries:
+            stats = entry.get("stats") or partition_stats(self.partitions[entry["key"]])
+            rows.append({
+                'Partition': entry["key"],
+                **{field.capitalize(): entry["values"][field] for field in self.fields},
+                'Records': stats["records"],
+                'Unique': stats["unique"],
+                'Dated': stats["dated"],
+                'First': stats["first"],
+                'Last': stats["last"],
+                'Mean length': round(stats["mean_length"], 1),
+                'Subtypes': stats["subtypes"],
+            })
+        return pd.DataFrame(rows)
+
+
+class DatasetRegistryFull(Exception):
+    """Raised when a dataset does not fit under the registry's memory or disk ceiling."""
+
+
+class Dataset:
+    """A parsed, read-only dataset held by the registry.
+
+    `records` is a list, PackedRecords, or a Workspace when the dataset
+    lives on disk; `owned_path` is set for workspaces the registry created
+    and may delete.
+    """
+    def __init__(self, digest, name, records, errors, owned_path=None):
+        self.digest = digest
+        self.name = name
+        self.records = records
+        self.errors = errors
+        self.owned_path = owned_path
+        self.nbytes = records.nbytes if hasattr(records, 'nbytes') else estimate_records_nbytes(records)
+        self.disk_bytes = records.disk_bytes if owned_path else 0
+        self.refcount = 0
+        self.last_used = time.time()
+
+
+class DatasetRegistry:
+    """Shared datasets keyed by content digest, with reference counting.
+
+    `acquire()` returns a Dataset holding one new reference; every acquire
+    must be matched by a `release()` of its digest (DatasetLease does this
+    bookkeeping per session). With a `workspace_dir`, content of at least
+    `spill_bytes` is parsed straight into an on-disk Workspace instead of
+    memory; `disk_limit` caps the space those workspaces may use. With
+    `pack_sequences`, in-memory datasets keep their sequences 4-bit packed.
+    """
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, workspace_dir=None,
+                 spill_bytes=DEFAULT_SPILL_BYTES, disk_limit=None, pack_sequences=False):
+        self.memory_limit = memory_limit
+        self.pack_sequences = pack_sequences
+        self.workspace_dir = workspace_dir
+        self.spill_bytes = spill_bytes
+        self.disk_limit = disk_limit
+        self._datasets = OrderedDict()  # Least recently used first
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, content_string, name, parser=None):
+        """Referenced Dataset for `content_string`, parsing it only on first use."""
+        digest = content_digest(content_string)
+        return self._acquire(digest, lambda: self._parse(digest, name, content_string, parser))
+
+    def acquire_workspace(self, path, name):
+        """Referenced Dataset for an existing workspace directory."""
+        digest = "workspace:" + os.path.realpath(path)
+        return self._acquire(digest, lambda: Dataset(digest, name, Workspace(path), []))
+
+    def release(self, digest):
+        """Drop one reference; unreferenced datasets stay cached until space is needed."""
+        with self._lock:
+            dataset = self._datasets.get(digest)
+            if dataset is not None and dataset.refcount > 0:
+                dataset.refcount -= 1
+                self._make_room(0, 0)
+
+    def release_many(self, files):
+        """Release every digest in a {name: digest} mapping and clear it."""
+        for digest in list(files.values()):
+            self.release(digest)
+        files.clear()
+
+    @property
+    def nbytes(self):
+        return sum(dataset.nbytes for dataset in self._datasets.values())
+
+    @property
+    def disk_bytes(self):
+        return sum(dataset.disk_bytes for dataset in self._datasets.values())
+
+    def stats(self):
+        """Summary counters for display."""
+        with self._lock:
+            return {
+                "datasets": len(self._datasets),
+                "referenced": sum(1 for d in self._datasets.values() if d.refcount),
+                "on_disk": sum(1 for d in self._datasets.values() if isinstance(d.records, Workspace)),
+                "nbytes": self.nbytes,
+                "disk_bytes": self.disk_bytes,
+                "memory_limit": self.memory_limit,
+            }
+
+    # --- internals ---
+    def _acquire(self, digest, load):
+        while True:
+            with self._lock:
+                dataset = self._datasets.get(digest)
+                if dataset is not None:
+                    self._touch(dataset)
+                    dataset.refcount += 1
+                    return dataset
+                pending = self._loading.get(digest)
+                if pending is None:
+                    self._loading[digest] = threading.Event()
+                    break
+            pending.wait()  # Another session is loading the same content
+
+        try:
+            dataset = load()
+            with self._lock:
+                try:
+                    self._make_room(dataset.nbytes, dataset.disk_bytes)
+                except DatasetRegistryFull:
+                    self._discard(dataset)
+                    raise
+                dataset.refcount = 1
+                self._datasets[digest] = dataset
+            return dataset
+        finally:
+            with self._lock:
+                self._loading.pop(digest).set()
+
+    def _parse(self, digest, name, content_string, parser):
+        if self.workspace_dir is None or len(content_string) < self.spill_bytes:
+            if self.pack_sequences:
+                errors = []
+                records = PackedRecords(iter_fasta_records(io.StringIO(content_string), parser=parser, errors=errors))
+            else:
+                records, errors = parse_fasta_content(content_string, parser=parser)
+            return Dataset(digest, name, records, errors)
+        path = os.path.join(self.workspace_dir, digest)
+        if is_workspace(path):
+            workspace = Workspace(path)  # Left by an earlier run
+        else:
+            errors = []
+            records = iter_fasta_records(io.StringIO(content_string), parser=parser, errors=errors)
+            workspace = build_workspace(path, records, errors)
+        return Dataset(digest, name, workspace, workspace.errors, owned_path=path)
+
+    def _touch(self, dataset):
+        dataset.last_used = time.time()
+        self._datasets.move_to_end(dataset.digest)
+
+    def _discard(self, dataset):
+        if dataset.owned_path:
+            shutil.rmtree(dataset.owned_path, ignore_errors=True)
+
+    def _make_room(self, incoming, incoming_disk):
+        """Evict unreferenced datasets (LRU first) until the incoming bytes fit."""
+        disk_limit = self.disk_limit if self.disk_limit is not None else float('inf')
+        used, used_disk = self.nbytes, self.disk_bytes
+        referenced = [d for d in self._datasets.values() if d.refcount]
+        in_use = sum(d.nbytes for d in referenced)
+        in_use_disk = sum(d.disk_bytes for d in referenced)
+        if (incoming and in_use + incoming > self.memory_limit) or (incoming_disk and in_use_disk + incoming_disk > disk_limit):
+            raise DatasetRegistryFull(
+                f"Dataset needs {incoming / 1024 ** 2:.0f} MB "
+                f"({incoming_disk / 1024 ** 2:.0f} MB on disk); "
+                f"{in_use / 1024 ** 2:.0f} of {self.memory_limit / 1024 ** 2:.0f} MB are in use by open sessions.")
+        for digest in list(self._datasets):
+            if used + incoming <= self.memory_limit and used_disk + incoming_disk <= disk_limit:
+                return
+            dataset = self._datasets[digest]
+            if dataset.refcount == 0:
+                del self._datasets[digest]
+                self._discard(dataset)
+                used -= dataset.nbytes
+                used_disk -= dataset.disk_bytes
+
+
+class DatasetLease:
+    """One session's references to registry datasets, by file name.
+
+    References are released by `release()`/`release_all()`, or automatically
+    when the lease is garbage-collected together with its session.
+    """
+    def __init__(self, registry):
+        self.registry = registry
+        self.files = {}
+        self._finalizer = weakref.finalize(self, registry.release_many, self.files)
+
+    def load(self, name, content_string, parser=None):
+        """Acquire the dataset for `content_string` under `name`."""
+        return self._hold(name, self.registry.acquire(content_string, name, parser=parser))
+
+    def open_workspace(self, name, path):
+        """Acquire an existing on-disk workspace under `name`."""
+        return self._hold(name, self.registry.acquire_workspace(path, name))
+
+    def _hold(self, name, dataset):
+        self.release(name)
+        self.files[name] = dataset.digest
+        return dataset
+
+    def release(self, name):
+        digest = self.files.pop(name, None)
+        if digest is not None:
+            self.registry.release(digest)
+
+    def release_all(self):
+        self.registry.release_many(self.files)
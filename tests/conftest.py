@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures: a small inline FASTA dataset in the Vir-Seq-Sift pipe format."""
+
+import numpy as np
+import pytest
+
+from fasta_engine import RecordView, parse_fasta_content
+
+# name | type | segment | date | id | clade | host | location; records 3 and 6 repeat record 0's sequence
+PIPE_FASTA = """\
+>A/chicken/Egypt/1/2023(H5N1)|A_/_H5N1|HA|2023-01-15|EPI_ISL_1001|2.3.4.4b|Chicken|Egypt
+ACGTACGTACGTGGCCAATT
+>A/duck/Egypt/2/2023(H5N1)|A_/_H5N1|HA|2023-01-20|EPI_ISL_1002|2.3.4.4b|Duck|Egypt
+ACGTACGTACGTGGCCAATA
+>A/chicken/Egypt/3/2023(H5N1)|A_/_H5N1|NA|2023-03-02|EPI_ISL_1003|2.2.1|Chicken|Egypt
+ACGTACGTTTTTGGCCAATT
+>A/chicken/Viet Nam/4/2023(H5N1)|A_/_H5N1|HA|2023-03-09|EPI_ISL_1004|2.3.4.4b|Chicken|Viet Nam
+ACGTACGTACGTGGCCAATT
+>A/duck/Viet Nam/5/2022(H5N6)|A_/_H5N6|HA|2022-11-30|EPI_ISL_1005|2.3.4.4h|Duck|Viet Nam
+GGGGCCCCACGTACGTAAAA
+>A/swan/Poland/6/2022(H5N1)|A_/_H5N1|HA||EPI_ISL_1006|2.3.4.4b|Swan|Poland
+ACGTNNNNACGTGGCCAATT
+>A/chicken/Poland/7/2023(H5N1)|A_/_H5N1|NA|2023-01-02|EPI_ISL_1007|2.3.4.4b|Chicken|Poland
+ACGTACGTACGTGGCCAATT
+>A/goose/Egypt/8/2021(H5N8)|A_/_H5N8|HA|2021-06-11|EPI_ISL_1008|2.3.4.4b|Goose|Egypt
+TTGGCCAAACGTACGTACGT
+"""
+
+
+@pytest.fixture
+def records():
+    sequences, errors = parse_fasta_content(PIPE_FASTA)
+    assert not errors
+    return sequences
+
+
+@pytest.fixture
+def view(records):
+    return RecordView([records])
+
+
+def random_sequences(count, length, seed=0, mutations=0):
+    """`count` random sequences, or with `mutations`, point mutants of one random sequence."""
+    rng = np.random.default_rng(seed)
+    base = rng.choice(list("ACGT"), length)
+    sequences = []
+    for _ in range(count):
+        seq = base.copy() if mutations else rng.choice(list("ACGT"), length)
+        if mutations:
+            sites = rng.integers(0, length, mutations)
+            seq[sites] = rng.choice(list("ACGT"), mutations)
+        sequences.append("".join(seq))
+    return sequences
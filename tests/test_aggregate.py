@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from fasta_aggregate import crosstab, crosstab_frame, field_codes, temporal_counts
+from fasta_geo import country_counts, normalize_location
+
+
+def test_monthly_counts_fill_gaps(view):
+    counts = temporal_counts(view, 'month')
+    assert str(counts.index[0]) == '2021-06' and str(counts.index[-1]) == '2023-03'
+    assert len(counts) == 22  # Every month in between, zeros included
+    assert counts['Count'].sum() == 7  # The undated record is not counted
+    assert counts.loc['2023-01', 'Count'] == 3
+    assert counts.loc['2022-01', 'Count'] == 0
+
+
+def test_counts_by_field_sum_to_bucket_counts(view):
+    for interval in ('month', 'quarter', 'year'):
+        total = temporal_counts(view, interval)['Count']
+        by_host = temporal_counts(view, interval, by='host')
+        assert (by_host.sum(axis=1) == total).all()
+        assert 'Swan' not in by_host.columns  # Only seen on the undated record
+    assert temporal_counts(view, 'year').loc['2023', 'Count'] == 5
+
+
+def test_temporal_counts_of_empty_input():
+    assert temporal_counts([], 'month').empty
+    assert temporal_counts([], 'month', by='host').empty
+
+
+def test_date_field_codes(view):
+    codes, labels = field_codes(view, 'year')
+    assert [labels[c] for c in codes] == ['2023', '2023', '2023', '2023', '2022', 'Unknown', '2023', '2021']
+
+
+def test_crosstab_counts_combinations(view):
+    counts, (hosts, locations) = crosstab(view, ['host', 'location'])
+    assert counts.sum() == 8
+    frame = crosstab_frame(view, 'host', 'location')
+    assert frame.loc['Chicken', 'Egypt'] == 2
+    assert frame.loc['Duck', 'Viet Nam'] == 1
+    assert list(hosts) == list(frame.index)
+
+
+def test_location_normalization(view):
+    assert normalize_location("Viet Nam") == normalize_location("viet_nam") == 'VNM'
+    assert normalize_location("Guangdong province, China") == 'CHN'
+    assert normalize_location("Atlantis") is None
+    frame, unmatched = country_counts(view)
+    assert dict(zip(frame['ISO3'], frame['Count'])) == {'EGY': 4, 'VNM': 2, 'POL': 2}
+    assert unmatched == 0
+    assert np.issubdtype(frame['Count'].dtype, np.integer)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from fasta_batch import BatchRunner, load_pipeline_spec, main
+from fasta_engine import RecordView, SequenceAnalyzer, parse_fasta_content
+from fasta_store import Workspace
+
+from tests.conftest import PIPE_FASTA
+
+STEPS = [
+    {'op': 'quality_filter', 'min_length': 10, 'max_n_run': 3},
+    {'op': 'deduplicate_basic'},
+    {'op': 'stratified_sample', 'strata': ['location'], 'per_stratum': 1, 'seed': 4},
+]
+
+
+def run(paths, steps, **params):
+    runner = BatchRunner(steps, progress=False, **params)
+    kept = []
+    runner.run([str(path) for path in paths], kept.extend)
+    return runner, kept
+
+
+@pytest.fixture
+def fasta_file(tmp_path):
+    path = tmp_path / "input.fasta"
+    path.write_text(PIPE_FASTA)
+    return path
+
+
+def test_pipeline_matches_app_operations(fasta_file, records):
+    analyzer = SequenceAnalyzer(RecordView([records]))
+    analyzer = SequenceAnalyzer(analyzer.quality_filter(10, 3).sequences)
+    analyzer = SequenceAnalyzer(analyzer.deduplicate_basic().sequences)
+    expected = analyzer.stratified_sample(('location',), per_stratum=1, seed=4).sequences
+    for workers, chunk_size in ((1, 5000), (2, 3)):
+        _, kept = run([fasta_file], STEPS, workers=workers, chunk_size=chunk_size)
+        assert sorted(r[0] for r in kept) == sorted(r[0] for r in expected)
+
+
+def test_chunks_use_the_schema_detected_for_their_file(tmp_path):
+    # The second chunk alone would be detected as name-only headers
+    lines = PIPE_FASTA.splitlines()[:2] + [">A/duck/Egypt/9/2024(H5N1)", "ACGTACGTACGTACGTACGT"]
+    path = tmp_path / "mixed.fasta"
+    path.write_text("\n".join(lines) + "\n")
+    _, kept = run([path], [], workers=1, chunk_size=1)
+    expected, _ = parse_fasta_content(path.read_text())
+    assert [r[2] for r in kept] == [r[2] for r in expected]
+
+
+def test_overlap_is_tracked_per_file(tmp_path, fasta_file):
+    copy = tmp_path / "copy.fasta"
+    copy.write_text(PIPE_FASTA)
+    runner, kept = run([fasta_file, copy], [{'op': 'deduplicate_basic'}], workers=1, track_overlap=True)
+    assert len(kept) == 6
+    assert runner.merge.overlap().loc[str(fasta_file), str(copy)] == 6
+
+
+def test_spec_validation(tmp_path):
+    spec = tmp_path / "spec.json"
+    spec.write_text(json.dumps([{'op': 'quality_filter'}]))
+    assert load_pipeline_spec(str(spec))['steps'] == [{'op': 'quality_filter'}]
+    spec.write_text(json.dumps({'steps': [{'op': 'no_such_step'}]}))
+    with pytest.raises(ValueError):
+        load_pipeline_spec(str(spec))
+    spec.write_text(json.dumps({'steps': [], 'header_schema': 'missing'}))
+    with pytest.raises(ValueError):
+        load_pipeline_spec(str(spec))
+
+
+def test_cli_append_only_writes_new_sequences(tmp_path, fasta_file):
+    spec = tmp_path / "dedup.json"
+    spec.write_text(json.dumps({'steps': [{'op': 'deduplicate_basic'}]}))
+    out, workspace = tmp_path / "out", tmp_path / "ws"
+    common = ['-p', str(spec), '-o', str(out), '--prefix', 'run', '-w', str(workspace), '-j', '1', '-q']
+    assert main([str(fasta_file)] + common) == 0
+    assert len(Workspace(str(workspace))) == 6
+    extra = tmp_path / "extra.fasta"
+    extra.write_text(PIPE_FASTA.split('\n>', 1)[0] + "\n>new|A_/_H5N1|HA\nTTTTTTTTTTGGGGGGGGGG\n")
+    assert main([str(extra)] + common + ['--append']) == 0
+    assert len(Workspace(str(workspace))) == 7
+    assert (out / "run.fasta").read_text().count('>') == 7
+    sample_spec = tmp_path / "sample.json"
+    sample_spec.write_text(json.dumps({'steps': [{'op': 'random_sample', 'size': 2}]}))
+    assert main([str(extra), '-p', str(sample_spec), '-o', str(out), '-w', str(workspace), '--append', '-q']) == 2
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from fasta_browse import RecordBrowser, search_mask, sort_order
+
+
+def test_search_by_text_accession_and_query(view):
+    assert search_mask(view, "viet").nonzero()[0].tolist() == [3, 4]
+    assert search_mask(view, "EPI_ISL_1005").nonzero()[0].tolist() == [4]
+    assert search_mask(view, "host == goose").nonzero()[0].tolist() == [7]
+    assert search_mask(view, "hots == goose").sum() == 0  # Not a valid query: searched as text
+
+
+def test_sort_orders(view):
+    assert sort_order(view, 'collection_date').tolist() == [7, 4, 6, 0, 1, 2, 3, 5]
+    assert sort_order(view, 'collection_date', descending=True).tolist() == [3, 2, 1, 0, 6, 4, 7, 5]
+    assert sort_order(view, 'host').tolist()[:4] == [0, 2, 3, 6]
+    assert sort_order(view, 'position', descending=True).tolist() == list(range(7, -1, -1))
+
+
+def test_pages_read_only_the_selection(view):
+    browser = RecordBrowser(view)
+    positions = browser.select("egypt", sort_by='collection_date')
+    assert positions.tolist() == [7, 0, 1, 2]
+    assert browser.select("egypt", sort_by='collection_date') is positions  # Memoized
+    page = browser.page(positions, 1, size=3)
+    assert page['#'].tolist() == [3]
+    assert page.loc[0, 'Date'] == '2023-03-02'
+    assert page.loc[0, 'Length'] == 20
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from fasta_consensus import consensus_fasta, profile_groups, stack_sequences, variability_summary
+from fasta_engine import RecordView
+
+ALIGNED = ["ACGTA", "ACGTT", "ACCTA", "A-GTN"]
+
+
+def grouped_records():
+    clades = ['x', 'x', 'x', 'x', 'y']
+    return [[f">r{i}", seq, {'clade': clade}] for i, (seq, clade) in enumerate(zip(ALIGNED + ["GGGG"], clades))]
+
+
+def test_stack_pads_shorter_sequences():
+    matrix = stack_sequences(["ACGT", "AC"])
+    assert matrix.shape == (2, 4)
+    assert matrix[1, 2:].tolist() == [6, 6]  # PAD
+
+
+def test_column_counts_consensus_and_entropy():
+    profile = profile_groups([[f">r{i}", seq, {}] for i, seq in enumerate(ALIGNED)])['All']
+    assert profile.records == 4 and profile.aligned
+    assert profile.counts[1].tolist() == [0, 3, 0, 0, 1, 0]  # C x3, gap x1
+    assert profile.consensus() == "ACGTA"
+    assert profile.consensus(min_fraction=0.9) == "ANNTN"
+    entropy = profile.entropy()
+    assert entropy[0] == 0.0
+    assert np.isclose(entropy[4], -(2 / 3 * np.log2(2 / 3) + 1 / 3 * np.log2(1 / 3)))  # N is not counted
+
+
+def test_profiles_per_group_independent_of_chunking():
+    view = RecordView([grouped_records()])
+    whole = profile_groups(view, ['clade'])
+    chunked = profile_groups(view, ['clade'], chunk_size=2)
+    assert list(whole) == ['x', 'y']
+    for label in whole:
+        assert np.array_equal(whole[label].counts, chunked[label].counts)
+    assert list(profile_groups(view, ['clade'], min_records=2)) == ['x']
+
+
+def test_summary_and_fasta_output():
+    profiles = profile_groups(RecordView([grouped_records()]), ['clade'])
+    summary = variability_summary(profiles)
+    assert summary['Sequences'].tolist() == [4, 1]
+    assert summary['Variable Sites'].tolist() == [3, 0]
+    assert consensus_fasta(profiles).splitlines() == [">consensus|x|n=4", "ACGTA", ">consensus|y|n=1", "GGGG"]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from fasta_diversity import (HAMMING, JACCARD, diverse_representatives, farthest_point_sample, hamming_rows,
+                             pairwise_distances, stack_bases, thin_candidates)
+from fasta_engine import RecordView, SequenceAnalyzer
+
+from tests.conftest import random_sequences
+
+
+def test_hamming_ignores_ambiguous_sites():
+    row = hamming_rows(stack_bases(["ACGT", "ACGA", "NCGA"]))
+    assert row(0).tolist() == [0.0, 0.25, 1 / 3]
+
+
+def test_pairwise_distances_pick_the_method_by_length():
+    method, matrix = pairwise_distances(["ACGT", "ACGA"])
+    assert method == HAMMING and np.allclose(matrix, matrix.T)
+    method, _ = pairwise_distances(random_sequences(2, 300) + random_sequences(1, 200))
+    assert method == JACCARD
+
+
+def test_farthest_point_sample_spreads_picks():
+    points = np.array([0.0, 0.1, 0.2, 5.0, 10.0])
+    picks = farthest_point_sample(len(points), lambda i: np.abs(points - points[i]), 3)
+    assert picks == [0, 3, 4]
+    same = np.zeros(4)
+    assert farthest_point_sample(4, lambda i: same, 3) == [0]  # Stops once everything is covered
+
+
+def test_large_groups_are_thinned_evenly():
+    assert thin_candidates(5, 10).tolist() == [0, 1, 2, 3, 4]
+    candidates = thin_candidates(100, 10)
+    assert len(candidates) == 10 and candidates[0] == 0 and candidates[-1] == 99
+    sequences = random_sequences(50, 100, seed=4, mutations=5)
+    picks, method = diverse_representatives(sequences, 3, max_group=10)
+    assert method == HAMMING and set(picks) <= set(thin_candidates(50, 10).tolist())
+
+
+def test_diversity_filter_keeps_per_group():
+    sequences = random_sequences(30, 200, seed=2, mutations=10)
+    records = [[f">r{i}", seq, {'clade': 'a' if i < 20 else 'b'}] for i, seq in enumerate(sequences)]
+    result = SequenceAnalyzer(RecordView([records])).diversity_filter('clade', per_group=4, workers=2)
+    kept = [record[2]['clade'] for record in result.sequences]
+    assert kept.count('a') == 4 and kept.count('b') == 4
+    again = SequenceAnalyzer(RecordView([records])).diversity_filter('clade', per_group=4, workers=1)
+    assert [r[0] for r in again.sequences] == [r[0] for r in result.sequences]
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from fasta_engine import (NO_DAY, PER_RECORD_SCHEMA, DateIndex, DigestIndex, FastaParser, Query, QueryError,
+                          RecordView, SequenceAnalyzer, build_stream_operation, gc_fraction, iter_fasta_records,
+                          parse_fasta_content, proportional_quotas, sample_headers, sequence_digest)
+
+from tests.conftest import PIPE_FASTA
+
+
+# ==================== PARSING ====================
+def test_pipe_headers_are_parsed(records):
+    metadata = records[0][2]
+    assert metadata['isolate_id'] == 'EPI_ISL_1001'
+    assert metadata['clade'] == '2.3.4.4b'
+    assert metadata['collection_date'].strftime('%Y-%m-%d') == '2023-01-15'
+    assert records[5][2]['collection_date'] is None
+
+
+def test_schema_is_detected_once_per_file():
+    lines = PIPE_FASTA.splitlines()
+    parser = FastaParser()
+    assert parser.file_schema(sample_headers(lines)) == 'vir_seq_sift'
+    assert parser.file_schema([]) == PER_RECORD_SCHEMA
+    # A later chunk without its file's sample is parsed with the schema named for the file
+    tail = lines[-2:]
+    named = list(iter_fasta_records(tail, parser=parser, schema='vir_seq_sift'))
+    assert named[0][2]['host'] == 'Goose'
+
+
+def test_name_only_headers_derive_host_and_location():
+    sequences, errors = parse_fasta_content(">A/duck/Viet Nam/2/2022(H5N6)\nACGT\n")
+    assert not errors
+    assert sequences[0][2]['host'] == 'Duck'
+    assert sequences[0][2]['type'] == 'H5N6'
+
+
+# ==================== DIGESTS ====================
+def test_digest_index_add_and_add_many():
+    index = DigestIndex(flush_size=2)
+    assert index.add(1) and index.add(2) and not index.add(1)
+    new = index.add_many([3, 2, 3, 4])
+    assert new.tolist() == [True, False, False, True]
+    index.update([10, 11])
+    assert 11 in index and 5 not in index
+    assert len(index) == 6
+
+
+def test_sequence_digest_salt_changes_digest():
+    assert sequence_digest("ACGT") == sequence_digest("ACGT")
+    assert sequence_digest("ACGT", "H5N1") != sequence_digest("ACGT")
+
+
+# ==================== DATE INDEX ====================
+def test_date_index_orders_and_buckets():
+    days = np.array([30, 10, NO_DAY, 10, 45], dtype=np.int64)
+    index = DateIndex(days)
+    assert index.order.tolist() == [1, 3, 0, 4, 2]
+    assert index.undated().tolist() == [2]
+    assert index.between(10, 31).tolist() == [1, 3, 0]
+    assert index.month('1970-02').tolist() == [4]
+    assert index.month_counts().tolist() == [3, 1]
+
+
+def test_date_index_take_and_extend_match_rebuilt_index():
+    days = np.array([30, 10, NO_DAY, 10, 45, 5], dtype=np.int64)
+    index = DateIndex(days)
+    taken = index.take([0, 2, 3, 5])
+    assert taken.order.tolist() == DateIndex(days[[0, 2, 3, 5]]).order.tolist()
+    assert index.take([3, 0]) is None  # Reordered selections are rebuilt instead
+    other = DateIndex(np.array([7, NO_DAY], dtype=np.int64))
+    extended = index.extend(other)
+    assert extended.order.tolist() == DateIndex(np.r_[days, [7, NO_DAY]]).order.tolist()
+
+
+# ==================== RECORD VIEWS ====================
+def test_view_take_and_extend_carry_memoized_columns(view, records):
+    view.collection_dates(), view.sequence_digests(), view.gc_fractions(), view.accession_index()
+    taken = view.take([1, 4, 6])
+    assert [record[0] for record in taken] == [records[i][0] for i in (1, 4, 6)]
+    assert 'gc_fraction' in taken._columns
+    assert np.allclose(taken.gc_fractions(), [gc_fraction(records[i][1]) for i in (1, 4, 6)])
+    extended = taken.extend(RecordView([records[:2]]))
+    assert len(extended) == 5
+    assert extended.sequence_digests().tolist() == [sequence_digest(records[i][1]) for i in (1, 4, 6, 0, 1)]
+    assert extended.accession_index().lookup(['EPI_ISL_1002'])[0].tolist() == [0, 4]
+
+
+def test_view_metadata_codes(view):
+    codes, labels = view.metadata_codes('host')
+    assert [labels[c] for c in codes] == ['Chicken', 'Duck', 'Chicken', 'Chicken', 'Duck', 'Swan', 'Chicken', 'Goose']
+
+
+# ==================== QUERIES ====================
+@pytest.mark.parametrize("text, expected", [
+    ("host == chicken", [0, 2, 3, 6]),
+    ("host != chicken", [1, 4, 5, 7]),
+    ("not host == chicken", [1, 4, 5, 7]),
+    ("location in [Egypt, 'Viet Nam'] and segment == HA", [0, 1, 3, 4, 7]),
+    ("date >= 2023-01 and date < 2023-03", [0, 1, 6]),
+    ("date == 2022", [4]),
+    ("date != 2023", [4, 5, 7]),
+    ("year < 2023 or clade contains 2.2", [2, 4, 7]),
+    ("(host == duck or host == goose) and not location == egypt", [4]),
+    ("month == 1 and isolate_id not in [EPI_ISL_1007]", [0, 1]),
+])
+def test_query_mask_matches_record_test(view, records, text, expected):
+    query = Query(text)
+    assert np.flatnonzero(query.mask(view)).tolist() == expected
+    assert [i for i, record in enumerate(records) if query.test(record)] == expected
+
+
+def test_query_gc_is_a_percentage(view):
+    assert Query("gc > 0.5").mask(view).all()
+    assert not Query("gc > 90").mask(view).any()
+
+
+@pytest.mark.parametrize("text", ["", "host ==", "host == chicken and", "(host == duck", "date > soon",
+                                  "length > short", "date contains 2023"])
+def test_query_syntax_errors(text):
+    with pytest.raises(QueryError):
+        Query(text)
+
+
+def test_query_rejects_unknown_fields_on_views(view, records):
+    with pytest.raises(QueryError, match="hots"):
+        Query("hots == chicken").mask(view)
+    assert Query("hots == chicken").test(records[0]) is False  # Streams stay permissive
+
+
+# ==================== ANALYZER ====================
+def test_deduplicate_basic_keeps_first_occurrence(view):
+    result = SequenceAnalyzer(view).deduplicate_basic()
+    assert result.applied
+    assert [record[2]['isolate_id'] for record in result.sequences][:4] == \
+        ['EPI_ISL_1001', 'EPI_ISL_1002', 'EPI_ISL_1003', 'EPI_ISL_1005']
+    assert result.final_count == 6
+
+
+def test_filter_by_query_rejects_unknown_field(view):
+    result = SequenceAnalyzer(view).filter_by_query("hots == chicken")
+    assert not result.applied
+    assert result.final_count == len(view)
+
+
+def test_filter_by_list_reports_unmatched(view):
+    result = SequenceAnalyzer(view).filter_by_list(['epi_isl_1002', 'EPI_ISL_1008.1', 'EPI_ISL_9999'])
+    assert [record[2]['isolate_id'] for record in result.sequences] == ['EPI_ISL_1002', 'EPI_ISL_1008']
+    assert any('EPI_ISL_9999' in line for line in result.report_lines)
+
+
+def test_random_sample_is_reproducible(view):
+    first = SequenceAnalyzer(view).random_sample(3, seed=7)
+    second = SequenceAnalyzer(view).random_sample(3, seed=7)
+    assert first.final_count == 3
+    assert [r[0] for r in first.sequences] == [r[0] for r in second.sequences]
+
+
+def test_stratified_sample_per_stratum(view):
+    result = SequenceAnalyzer(view).stratified_sample(strata=('location',), per_stratum=1, seed=3)
+    assert sorted(record[2]['location'] for record in result.sequences) == ['Egypt', 'Poland', 'Viet Nam']
+
+
+def test_proportional_quotas_sum_to_total():
+    quotas = proportional_quotas([50, 30, 20], 7)
+    assert quotas.sum() == 7
+    assert quotas.tolist() == [4, 2, 1]
+    assert proportional_quotas([2, 1], 10).tolist() == [2, 1]
+
+
+@pytest.mark.parametrize("step, method, params", [
+    ({'op': 'random_sample', 'size': 3, 'seed': 5}, 'random_sample', {'size': 3, 'seed': 5}),
+    ({'op': 'stratified_sample', 'strata': ['host'], 'per_stratum': 1, 'seed': 2},
+     'stratified_sample', {'strata': ('host',), 'per_stratum': 1, 'seed': 2}),
+])
+def test_sampling_streams_match_analyzer(view, records, step, method, params):
+    op = build_stream_operation(step)
+    streamed = [record for record in map(op.feed, records) if record is not None] + op.flush()
+    expected = getattr(SequenceAnalyzer(view), method)(**params).sequences
+    assert sorted(r[0] for r in streamed) == sorted(r[0] for r in expected)
+
+
+def test_similarity_filter_rejects_queries_without_sketch_kmers(view):
+    analyzer = SequenceAnalyzer(view)
+    result = analyzer.filter_similar("ACGTACGTACGTGGCCAATT", top_n=5)
+    assert not result.applied
+    assert result.final_count == len(view)
+    assert analyzer.events[-1].key == 'similar_query_short'
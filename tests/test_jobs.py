@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import time
+
+from fasta_jobs import JOB_DONE, FINISHED_STATES, JobRunner, run_analyzer_operation
+
+
+def wait(job, timeout=10):
+    deadline = time.time() + timeout
+    while job.status not in FINISHED_STATES and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_run_analyzer_operation_by_name(view):
+    result = run_analyzer_operation(view, 'filter_by_query', {'query': 'host == duck'})
+    assert result.final_count == 2
+
+
+def test_chained_jobs_read_the_previous_result(view):
+    runner = JobRunner(max_workers=2)
+    first = runner.submit('session', 'hosts', 'filter_by_query', {'query': 'host == chicken'}, view, 1)
+    second = runner.submit('session', 'dedup', 'deduplicate_basic', {}, view, 1)
+    assert wait(first).status == JOB_DONE
+    assert wait(second).status == JOB_DONE
+    assert second.result.initial_count == 4
+    assert second.result.final_count == 2
+    assert runner.claim(first.id) is first and first.id not in runner.jobs
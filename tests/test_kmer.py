@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from fasta_engine import RecordView, SequenceAnalyzer
+from fasta_kmer import KmerIndex, clean_sequence, mash_identity
+
+from tests.conftest import random_sequences
+
+
+@pytest.fixture
+def sequences():
+    return random_sequences(40, 1500, seed=1)
+
+
+def test_nearest_ranks_the_identical_sequence_first(sequences):
+    index = KmerIndex.build(sequences, workers=2)
+    positions, jaccard, shared = index.nearest(sequences[7], top_n=3)
+    assert positions[0] == 7
+    assert jaccard[0] == 1.0
+    assert shared[0] == index.sizes[7]
+
+
+def test_index_is_independent_of_chunking_and_workers(sequences):
+    one = KmerIndex.build(sequences, workers=1)
+    many = KmerIndex.build(sequences, workers=4)
+    assert np.array_equal(one.keys, many.keys) and np.array_equal(one.owners, many.owners)
+
+
+def test_take_matches_a_rebuilt_index(sequences):
+    index = KmerIndex.build(sequences)
+    positions = np.array([2, 5, 11, 30])
+    taken = index.take(positions)
+    rebuilt = KmerIndex.build([sequences[i] for i in positions])
+    assert np.array_equal(taken.keys, rebuilt.keys) and np.array_equal(taken.owners, rebuilt.owners)
+    assert index.take([5, 2]) is None
+
+
+def test_motif_candidates_include_every_match(sequences):
+    index = KmerIndex.build(sequences)
+    motif = sequences[3][700:730]
+    candidates = index.motif_candidates(motif)
+    assert {i for i, seq in enumerate(sequences) if motif in seq} <= set(candidates.tolist())
+    assert len(index.motif_candidates("ACG")) == len(sequences)  # Too short to screen
+
+
+def test_query_cleaning_and_identity():
+    assert clean_sequence(">q1\nacgt n\n ACGT\n") == "ACGTNACGT"
+    assert mash_identity(np.array([1.0]))[0] == 1.0
+    assert mash_identity(np.array([0.0]))[0] == 0.0
+
+
+def test_motif_and_similarity_filters(sequences):
+    records = [[f">s{i}", seq, {}] for i, seq in enumerate(sequences)]
+    analyzer = SequenceAnalyzer(RecordView([records]))
+    motif = analyzer.filter_by_motif(sequences[9][100:120])
+    assert [record[0] for record in motif.sequences] == [">s9"]
+    similar = analyzer.filter_similar(sequences[9], top_n=1)
+    assert similar.applied and [record[0] for record in similar.sequences] == [">s9"]
+    unrelated = analyzer.filter_similar(random_sequences(1, 1500, seed=99)[0], top_n=5)
+    assert not unrelated.applied and unrelated.final_count == len(records)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from fasta_engine import sequence_digest
+from fasta_merge import DatasetMerge, merge_datasets, provenance_table
+
+
+def test_merge_keeps_first_occurrence_across_files(records):
+    first, second = records[:5], records[3:]
+    view, merge = merge_datasets({'first.fasta': first, 'second.fasta': second})
+    headers = [record[0] for record in view]
+    # Records 3 and 6 repeat record 0's sequence
+    assert headers == [records[i][0] for i in (0, 1, 2, 4, 5, 7)]
+    summary = merge.summary()
+    assert summary.loc['second.fasta', 'Records'] == 5
+    assert summary.loc['second.fasta', 'Kept'] == 2
+    assert merge.overlap().loc['first.fasta', 'second.fasta'] == 2
+
+
+def test_provenance_lists_source_files(records):
+    view, merge = merge_datasets({'a': records[:2], 'b': records[:1]})
+    table = provenance_table(view, merge)
+    assert table['Files'].tolist() == [2, 1]
+    assert table['Sources'].tolist() == ['a; b', 'a']
+
+
+def test_digests_can_be_fed_in_chunks():
+    merge = DatasetMerge()
+    digests = [sequence_digest(seq) for seq in ("AAAA", "CCCC", "AAAA", "GGGG")]
+    assert merge.add('x', digests[:2]).tolist() == [True, True]
+    assert merge.add('x', digests[2:]).tolist() == [False, True]
+    assert merge.summary().loc['x'].tolist() == [4, 3, 3]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from fasta_engine import Query, RecordView, gc_fraction, longest_n_run, sequence_digest
+from fasta_store import (DatasetRegistry, PackedRecords, PackedSequences, append_to_workspace,
+                         build_partitioned_workspace, build_workspace, is_partitioned_workspace)
+
+SEQUENCES = ["ACGT", "ACGTN", "", "NNNNACGTRYNNN", "acgt-u*", "GGGCCCSS", "A"]
+
+
+# ==================== PACKED SEQUENCES ====================
+def test_packed_sequences_round_trip():
+    packed = PackedSequences(SEQUENCES)
+    assert list(packed.iter_decoded()) == SEQUENCES
+    assert packed[-1] == "A"
+    assert list(packed.iter_decoded([4, 0, 4])) == ["acgt-u*", "ACGT", "acgt-u*"]
+
+
+def test_packed_statistics_match_string_versions():
+    packed = PackedSequences(SEQUENCES)
+    assert packed.sequence_lengths().tolist() == [len(s) for s in SEQUENCES]
+    assert packed.longest_n_runs().tolist() == [longest_n_run(s) for s in SEQUENCES]
+    assert np.allclose(packed.gc_fractions(), [gc_fraction(s) for s in SEQUENCES])
+    assert packed.sequence_digests().tolist() == [sequence_digest(s) for s in SEQUENCES]
+
+
+def test_packed_records_behave_like_the_record_list(records):
+    packed = PackedRecords(records)
+    assert [list(record) for record in packed] == [list(record) for record in records]
+    view = RecordView([packed])
+    assert view.collection_dates().tolist() == RecordView([records]).collection_dates().tolist()
+
+
+# ==================== WORKSPACES ====================
+def test_workspace_round_trip(tmp_path, records):
+    workspace = build_workspace(str(tmp_path / "ws"), records)
+    assert len(workspace) == len(records)
+    for stored, original in zip(workspace, records):
+        assert stored[0] == original[0] and stored[1] == original[1]
+        assert stored[2]['host'] == original[2]['host']
+        assert stored[2]['collection_date'] == original[2]['collection_date']
+    view = RecordView([workspace])
+    assert np.flatnonzero(Query("host == chicken and date >= 2023").mask(view)).tolist() == [0, 2, 3, 6]
+    assert [record[1] for record in workspace.iter_records([1, 3], with_sequence=False)] == [None, None]
+
+
+def test_append_skips_stored_duplicates(tmp_path, records):
+    path = str(tmp_path / "ws")
+    build_workspace(path, records[:4])
+    workspace, added, skipped = append_to_workspace(path, records[4:])
+    assert (added, skipped) == (3, 1)  # Record 6 repeats record 0's sequence
+    assert len(workspace) == 7
+    assert RecordView([workspace]).date_index().order.tolist() == \
+        RecordView([workspace]).take(np.arange(7)).date_index().order.tolist()
+
+
+def test_partitioned_workspace_routes_records(tmp_path, records):
+    path = str(tmp_path / "parts")
+    partitioned = build_partitioned_workspace(path, records, fields=('segment',))
+    assert is_partitioned_workspace(path)
+    assert sorted(partitioned.partitions) == ['HA', 'NA']
+    assert len(partitioned.view(partitioned.find(segment='NA'))) == 2
+    assert partitioned.stats().set_index('Partition')['Records'].to_dict() == {'HA': 6, 'NA': 2}
+    workspace, added, skipped = append_to_workspace(path, [records[0], ["New", "TTTT", {'segment': 'PB2'}]])
+    assert (added, skipped) == (1, 1)
+    assert sorted(workspace.partitions) == ['HA', 'NA', 'PB2']
+
+
+def test_partition_fields_are_checked(tmp_path, records):
+    with pytest.raises(ValueError):
+        build_partitioned_workspace(str(tmp_path / "bad"), records, fields=('host',))
+
+
+# ==================== REGISTRY ====================
+def test_registry_shares_parsed_datasets():
+    from tests.conftest import PIPE_FASTA
+    registry = DatasetRegistry()
+    first = registry.acquire(PIPE_FASTA, "a.fasta")
+    second = registry.acquire(PIPE_FASTA, "copy.fasta")
+    assert first is second
+    assert len(first.records) == 8